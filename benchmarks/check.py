@@ -0,0 +1,31 @@
+# Semantic check time of a large program with the function bodies checked
+# on 1, 2, 4, ... worker processes
+#
+#   python benchmarks/check.py [functions] [max jobs]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from parser import parse
+from validator import check_program
+from nodes import generate
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    max_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    text = generate(functions)
+    print(f'{functions} functions, {os.cpu_count()} cpus')
+
+    jobs = 1
+    while jobs <= max_jobs:
+        ast = parse(text, check_fields=False)
+        start = time.perf_counter()
+        check_program(ast, jobs)
+        print(f'{f"-j{jobs}":<8}{(time.perf_counter() - start) * 1000:>8.0f}ms')
+        jobs *= 2
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# Time from IR to native objects for a large generated program, as one LLVM
+# module and split into modules compiled on 1, 2, 4, ... worker processes
+#
+#   python benchmarks/codegen.py [functions] [max jobs] [LLVM level]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from ir import compile_ircode
+from llvm import generate_llvm, generate_objects, native_target, parse_llvm
+from nodes import generate
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    max_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    llvm_opt_level = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    ir_functions = compile_ircode(generate(functions))
+    print(f'{functions} functions, LLVM -O{llvm_opt_level}, {os.cpu_count()} cpus')
+
+    start = time.perf_counter()
+    llvm_code = generate_llvm(ir_functions, llvm_opt_level=llvm_opt_level)
+    machine = native_target(llvm_opt_level)
+    machine.emit_object(parse_llvm(llvm_code, machine))
+    print(f'{"module":<8}{(time.perf_counter() - start) * 1000:>8.0f}ms')
+
+    jobs = 1
+    while jobs <= max_jobs:
+        start = time.perf_counter()
+        generate_objects(ir_functions, jobs, llvm_opt_level=llvm_opt_level)
+        print(f'{f"-j{jobs}":<8}{(time.perf_counter() - start) * 1000:>8.0f}ms')
+        jobs *= 2
+
+if __name__ == '__main__':
+    main()
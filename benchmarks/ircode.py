@@ -0,0 +1,57 @@
+# Memory held by the IR of a large generated program as tuples and in the
+# compact array encoding, and the cost of a binary dump and reload
+#
+#   python benchmarks/ircode.py [functions]
+
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from parser import parse
+from validator import check_program
+from ir import GenerateCode, encode, dump, load
+from nodes import generate
+
+def held(build):
+    tracemalloc.start()
+    result = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, memory
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    ast = parse(generate(functions))
+    check_program(ast)
+
+    def tuples():
+        gen = GenerateCode()
+        gen.visit(ast)
+        return gen.functions
+
+    code, tuple_memory = held(tuples)
+    compact, compact_memory = held(lambda: encode(code))
+    count = sum(len(func.code) for func in code)
+
+    print(f'{count} instructions')
+    print(f'{"tuples":<12}{tuple_memory/2**20:>8.1f}MB{tuple_memory/count:>8.0f}B/instruction')
+    print(f'{"compact":<12}{compact_memory/2**20:>8.1f}MB{compact_memory/count:>8.0f}B/instruction')
+
+    file = io.BytesIO()
+    _, elapsed = timed(dump, code, file)
+    print(f'{"dump":<12}{elapsed:>8.0f}ms{len(file.getvalue())/2**20:>8.1f}MB')
+    file.seek(0)
+    _, elapsed = timed(load, file)
+    print(f'{"load":<12}{elapsed:>8.0f}ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# Lexing time of one long line, all at once and from a stream
+#
+#   python -O benchmarks/lexer.py [runs]
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.modules.pop('ast', None)
+
+from lexer import PulseLexer
+
+SIZES = [20000, 40000, 80000]
+
+def source(operands):
+    # a single statement adding up operands numbers, all on one line
+    terms = ' + '.join(str(i) for i in range(operands))
+    return f'function main() int {{ print({terms}); return 0; }}\n'
+
+def best(func, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    lexer = PulseLexer()
+
+    print(f'{"operands":<10}{"tokenize":>12}{"stream":>12}')
+    for operands in SIZES:
+        text = source(operands)
+        data = text.encode()
+        assert [(t.type, t.value) for t in lexer.tokenize(text)] == \
+            [(t.type, t.value) for t in lexer.tokenize_stream(io.BytesIO(data))]
+
+        whole = best(lambda: sum(1 for _ in lexer.tokenize(text)), runs)
+        stream = best(lambda: sum(1 for _ in lexer.tokenize_stream(io.BytesIO(data))), runs)
+        print(f'{operands:<10}{whole*1000:>10.1f}ms{stream*1000:>10.1f}ms')
+
+if __name__ == '__main__':
+    main()
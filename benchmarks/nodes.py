@@ -0,0 +1,74 @@
+# Time and memory to build the AST of a large generated program
+#
+#   python benchmarks/nodes.py [functions]
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from parser import parse
+from ast import flatten, field_checks
+
+FUNCTION = '''\
+function f{n}(x int, y float) int {{
+    var total int <- x + {n};
+    var scale float <- (y * 2.0 - 1.5) / 3.0;
+    while total < 1000 && !(scale > 4.0) {{
+        if total > {n} {{
+            total <- total + f{prev}(total - 1, scale * scale);
+        }} else {{
+            total <- total * 2 + 1;
+        }}
+        scale <- scale + 0.5;
+    }}
+    return total;
+}}
+'''
+
+def generate(functions):
+    parts = ['function f0(x int, y float) int {\n    return x;\n}\n']
+    parts.extend(FUNCTION.format(n=n, prev=n-1) for n in range(1, functions))
+    return ''.join(parts)
+
+def measure(text, check_fields):
+    start = time.perf_counter()
+    ast = parse(text, check_fields=check_fields)
+    elapsed = time.perf_counter() - start
+
+    # memory held by the finished tree, not the parser's working set
+    tracemalloc.start()
+    ast = parse(text, check_fields=check_fields)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return ast, elapsed, held
+
+def rebuild(nodes, check_fields):
+    # constructor cost on its own, without the LALR driver around it
+    args = [(type(node), [getattr(node, name) for name in node._fields], node.lineno)
+            for node in nodes]
+    with field_checks(check_fields):
+        start = time.perf_counter()
+        for cls, fields, lineno in args:
+            cls(*fields, lineno=lineno)
+        return time.perf_counter() - start
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    text = generate(functions)
+    parse('')
+
+    print(f'{"mode":<12}{"parse":>10}{"construct":>12}{"AST memory":>14}{"per node":>12}')
+    for check_fields in (True, False):
+        ast, elapsed, held = measure(text, check_fields)
+        nodes = [node for _, node in flatten(ast)]
+        construct = rebuild(nodes, check_fields)
+        mode = 'checked' if check_fields else 'unchecked'
+        print(f'{mode:<12}{elapsed*1000:>8.0f}ms{construct*1000:>10.0f}ms'
+              f'{held/2**20:>12.1f}MB{held/len(nodes):>11.0f}B')
+
+if __name__ == '__main__':
+    main()
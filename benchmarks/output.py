@@ -0,0 +1,62 @@
+# Write syscalls and run time of the example programs at -O2 under each
+# output flush policy, set through $PULSE_BUFFERING. The syscalls are counted
+# with strace, when it is installed.
+#
+#   python benchmarks/output.py [runs]
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from llvm import compile_llvm, OUTPUT_POLICIES
+from compile import build_executable
+from runtime import PROGRAMS, ROOT
+
+def writes(exe, env, tmp):
+    '''
+    The write syscalls exe makes, or None without strace.
+    '''
+    if not shutil.which('strace'):
+        return None
+    log = os.path.join(tmp, 'strace')
+    subprocess.run(['strace', '-qq', '-e', 'trace=write', '-o', log, exe], env=env,
+                   stdout=subprocess.DEVNULL, check=True)
+    with open(log) as file:
+        return sum(line.startswith('write(1,') for line in file)
+
+def best(exe, env, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([exe], env=env, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'{"":<12}' + ''.join(f'{policy + " writes":>16}{policy + " time":>16}'
+                                    for policy in OUTPUT_POLICIES))
+        for program, (path, edits) in PROGRAMS.items():
+            with open(os.path.join(ROOT, path)) as file:
+                source = file.read()
+            for old, new in edits.items():
+                source = source.replace(old, new)
+
+            exe = os.path.join(tmp, program)
+            build_executable(compile_llvm(source, opt_level=2, llvm_opt_level=2), exe, 2)
+            row = f'{program:<12}'
+            for policy in OUTPUT_POLICIES:
+                env = dict(os.environ, PULSE_BUFFERING=policy)
+                count = writes(exe, env, tmp)
+                row += f'{"-" if count is None else count:>16}{best(exe, env, runs):>14.1f}ms'
+            print(row)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# Run time of the example programs at -O2, and at -O2 with the profile of a
+# training run of an instrumented build (which is timed too)
+#
+#   python benchmarks/pgo.py [runs]
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from llvm import compile_llvm
+from compile import build_executable
+from runtime import PROGRAMS, ROOT, best
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    with tempfile.TemporaryDirectory() as tmp:
+        profile = os.path.join(tmp, 'profile')
+        configs = {
+            '-O2': {},
+            'instrumented': dict(profile_generate=profile),
+            '-O2 with profile': dict(profile_use=profile),
+        }
+
+        print(f'{"":<12}' + ''.join(f'{name:>18}' for name in configs))
+        for program, (path, edits) in PROGRAMS.items():
+            with open(os.path.join(ROOT, path)) as file:
+                source = file.read()
+            for old, new in edits.items():
+                source = source.replace(old, new)
+
+            row = f'{program:<12}'
+            for name, options in configs.items():
+                exe = os.path.join(tmp, program)
+                build_executable(compile_llvm(source, opt_level=2, llvm_opt_level=2, **options), exe, 2)
+                row += f'{best(exe, runs):>16.1f}ms'
+            print(row)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# Size of the LLVM IR and run time of the example programs compiled with
+# different Pulse IR and LLVM optimization settings, built as pulsec does.
+#
+#   python benchmarks/runtime.py [runs]
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import llvmlite.binding as llvm
+from llvm import compile_llvm
+from compile import build_executable
+from target import TargetOptions
+
+# sized to run long enough to time: fib.pulse as it is prints fibonacci(0..49),
+# far too slow without memoization, and mandel's 1000 iterations are too few
+PROGRAMS = {
+    'mandel': ('examples/mandel.pulse', {'threshhold <- 1000': 'threshhold <- 20000'}),
+    'fib': ('examples/fib.pulse', {'LAST <- 50': 'LAST <- 32'}),
+}
+
+CONFIGS = {
+    'Pulse -O0': dict(opt_level=0),
+    'Pulse -O1': dict(opt_level=1),
+    'Pulse -O2 no inlining': dict(opt_level=2, inline_threshold=0),
+    'Pulse -O2': dict(opt_level=2),
+    'LLVM -O1': dict(opt_level=0, llvm_opt_level=1),
+    'LLVM -O2': dict(opt_level=0, llvm_opt_level=2),
+    'LLVM -O3': dict(opt_level=0, llvm_opt_level=3),
+    '-O1': dict(opt_level=1, llvm_opt_level=1),
+    '-O2': dict(opt_level=2, llvm_opt_level=2),
+    '-O3': dict(opt_level=2, llvm_opt_level=3),
+    '-O3 no vectorize/unroll': dict(opt_level=2, llvm_opt_level=3,
+                                    target=TargetOptions(vectorize=False, unroll=False)),
+    '-O3 native': dict(opt_level=2, llvm_opt_level=3, target=TargetOptions('native')),
+    '-O3 native vectorize': dict(opt_level=2, llvm_opt_level=3,
+                                 target=TargetOptions('native', vectorize=True)),
+}
+
+def instructions(llvm_code):
+    module = llvm.parse_assembly(llvm_code)
+    return sum(len(list(block.instructions)) for func in module.functions for block in func.blocks)
+
+def best(exe, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([exe], stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    sources = {}
+    for program, (path, edits) in PROGRAMS.items():
+        with open(os.path.join(ROOT, path)) as file:
+            source = file.read()
+        for old, new in edits.items():
+            source = source.replace(old, new)
+        sources[program] = source
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'{"":<24}' + ''.join(f'{program + " insts":>14}{program + " time":>14}'
+                                    for program in sources))
+        for name, options in CONFIGS.items():
+            row = f'{name:<24}'
+            for program, source in sources.items():
+                llvm_code = compile_llvm(source, **options)
+                exe = os.path.join(tmp, program)
+                build_executable(llvm_code, exe, options.get('llvm_opt_level', 0), options.get('target'))
+                row += f'{instructions(llvm_code):>14}{best(exe, runs):>12.1f}ms'
+            print(row)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# Diagnostics latency of the incremental language server against a full
+# parse + check of the same buffer
+#
+#   python benchmarks/server.py [functions]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from error import collect_errors
+from parser import parse
+from validator import CheckProgramVisitor
+from server import Document
+
+FUNCTION = '''\
+function f{n}(x int, y float) int {{
+    var total int <- x;
+    var scale float <- y * 2.0;
+    while total < limit {{
+        if total > {n} {{
+            total <- total + f{prev}(total, scale);
+        }} else {{
+            total <- total * 2;
+        }}
+    }}
+    return total;
+}}
+'''
+
+def generate(functions):
+    parts = ['const limit <- 1000;\n', 'function f0(x int, y float) int {\n    return x;\n}\n']
+    parts.extend(FUNCTION.format(n=n, prev=n-1) for n in range(1, functions))
+    return ''.join(parts)
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+def full_check(text):
+    with collect_errors():
+        CheckProgramVisitor().visit(parse(text))
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 800
+    text = generate(functions)
+    print(f'{text.count(chr(10))} lines, {functions} functions')
+
+    print(f'{"full parse + check":<36}{timed(full_check, text):>8.1f}ms')
+
+    document = Document()
+    print(f'{"initial open":<36}{timed(lambda: (document.update(text), document.diagnostics())):>8.1f}ms')
+
+    middle = text.index(f'function f{functions // 2}(')
+    body = text.index('total * 2', middle)
+
+    def edit(start, end, new):
+        document.edit(start, end, new)
+        document.diagnostics()
+
+    print(f'{"edit inside a function body":<36}{timed(edit, body, body + 1, "x"):>8.1f}ms')
+    print(f'{"insert a line above it":<36}{timed(edit, middle, middle, chr(10)):>8.1f}ms')
+    print(f'{"change a function signature":<36}{timed(edit, middle + 9, middle + 9, "g"):>8.1f}ms')
+
+    start = time.perf_counter()
+    document.update(text)
+    document.diagnostics()
+    print(f'{"resend the whole buffer":<36}{(time.perf_counter() - start) * 1000:>8.1f}ms')
+
+if __name__ == '__main__':
+    main()
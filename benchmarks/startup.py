@@ -0,0 +1,46 @@
+# Cold-import time of the Pulse front end with and without the table cache
+#
+#   python benchmarks/startup.py [runs]
+
+import os
+import sys
+import subprocess
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# llvm.py imports the front end lazily from compile_llvm, so pull it in as well
+MODULES = {
+    'parser': 'parser',
+    'llvm': 'llvm, ir, parser, validator',
+}
+
+def cold_import(modules, cache_dir, runs):
+    env = dict(os.environ, PULSE_CACHE_DIR=cache_dir)
+    cmd = [sys.executable, '-O', '-c', f'import sys; sys.path.insert(0, {SRC!r}); import {modules}']
+
+    # one untimed run so the cache (when enabled) is populated
+    subprocess.run(cmd, env=env, check=True, stderr=subprocess.DEVNULL)
+
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, check=True, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    baseline = cold_import('sys', '', runs)
+
+    print(f'{"module":<10}{"no cache":>12}{"cached":>12}{"speedup":>10}')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for module, modules in MODULES.items():
+            before = cold_import(modules, '', runs) - baseline
+            after = cold_import(modules, cache_dir, runs) - baseline
+            print(f'{module:<10}{before*1000:>10.1f}ms{after*1000:>10.1f}ms{before/after:>9.2f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# NodeVisitor dispatch cost on a large program, and a 100k operand
+# expression that a recursive visitor cannot walk
+#
+#   python benchmarks/visitor.py [functions] [operands] [runs]
+
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from parser import parse
+from ast import AST, NodeVisitor, flatten
+from validator import CheckProgramVisitor
+from ir import GenerateCode, GenerateCodeWithLines
+from error import collect_errors
+from nodes import generate
+
+class RecursiveVisitor(object):
+    # the previous NodeVisitor: name lookup per node and one Python frame per level
+    def visit(self, node):
+        if isinstance(node, list):
+            for item in node:
+                self.visit(item)
+        elif isinstance(node, AST):
+            method = 'visit_' + node.__class__.__name__
+            visitor = getattr(self, method, self.generic_visit)
+            visitor(node)
+
+    def generic_visit(self, node):
+        for field in node._fields:
+            self.visit(getattr(node, field, None))
+
+class RecursiveCounter(RecursiveVisitor):
+    def __init__(self):
+        self.count = 0
+
+    def visit_BinOp(self, node):
+        self.count += 1
+        self.visit(node.left)
+        self.visit(node.right)
+
+class Counter(NodeVisitor):
+    def __init__(self):
+        self.count = 0
+
+    def visit_BinOp(self, node):
+        self.count += 1
+        yield node.left
+        yield node.right
+
+def best(func, runs=7):
+    return compare([func], runs)[0]
+
+def compare(funcs, runs=7):
+    '''
+    The best time of each of funcs over runs, in ms. They take turns, so
+    that a slow spell of the machine hits them all alike.
+    '''
+    times = [[] for _ in funcs]
+    gc.disable()
+    try:
+        for _ in range(runs):
+            for func, spent in zip(funcs, times):
+                start = time.perf_counter()
+                func()
+                spent.append(time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return [min(spent) * 1000 for spent in times]
+
+def calls(func):
+    '''
+    How many Python function calls func makes, generators resumed included:
+    the dispatch work, free of the timing noise.
+    '''
+    count = 0
+    def profile(frame, event, arg):
+        nonlocal count
+        if event == 'call':
+            count += 1
+    sys.setprofile(profile)
+    try:
+        func()
+    finally:
+        sys.setprofile(None)
+    return count
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    operands = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 15
+
+    tree = parse(generate(functions), check_fields=False)
+    nodes = len(flatten(tree))
+    print(f'{nodes} nodes')
+    recursive, iterative = compare([lambda: RecursiveCounter().visit(tree),
+                                    lambda: Counter().visit(tree)], runs)
+    print(f'{"recursive walk":<24}{recursive:>8.0f}ms')
+    print(f'{"NodeVisitor walk":<24}{iterative:>8.0f}ms  ({iterative / recursive:.2f}x)')
+    print(f'{"calls per node":<24}{calls(lambda: RecursiveCounter().visit(tree)) / nodes:>10.2f} recursive'
+          f'{calls(lambda: Counter().visit(tree)) / nodes:>10.2f} NodeVisitor')
+    print(f'{"CheckProgramVisitor":<24}{best(lambda: CheckProgramVisitor().visit(tree)):>8.0f}ms')
+    print(f'{"GenerateCode":<24}{best(lambda: GenerateCode().visit(tree)):>8.0f}ms')
+
+    source = ('function main() int {\n    var a int <- 1;\n    print(' +
+              ' + '.join(['a'] * operands) + ');\n    return 0;\n}\n')
+    tree = parse(source, check_fields=False)
+
+    try:
+        RecursiveCounter().visit(tree)
+        print(f'{"recursive, deep":<24}{"ok":>10}')
+    except RecursionError:
+        print(f'{"recursive, deep":<24}{"RecursionError":>10}')
+
+    with collect_errors() as diagnostics:
+        elapsed = best(lambda: CheckProgramVisitor().visit(tree), 1)
+    assert not diagnostics, diagnostics
+    print(f'{f"check, {operands} operands":<24}{elapsed:>8.0f}ms')
+
+    gen = GenerateCode()
+    elapsed = best(lambda: gen.visit(tree), 1)
+    print(f'{f"IR, {operands} operands":<24}{elapsed:>8.0f}ms  ({len(gen.functions[1].code)} instructions)')
+
+    # one long function, lowered with and without source lines
+    statements = operands // 5
+    source = ('function main() int {\n    var a int <- 1;\n' +
+              ''.join(f'    a <- a * 3 + {n};\n' for n in range(statements)) + '    return a;\n}\n')
+    tree = parse(source, check_fields=False)
+    CheckProgramVisitor().visit(tree)
+    plain, lines = compare([lambda: GenerateCode().visit(tree),
+                            lambda: GenerateCodeWithLines().visit(tree)], runs)
+    print(f'{f"IR, {statements} statements":<24}{plain:>8.0f}ms')
+    print(f'{"IR, same, with lines":<24}{lines:>8.0f}ms  ({lines / plain:.2f}x)')
+
+if __name__ == '__main__':
+    main()
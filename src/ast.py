@@ -1,36 +1,62 @@
 # Pulse AST (Abstract Snytax Tree)
 
+from contextlib import contextmanager
+
 # CORE AST
-class AST(object):
+class ASTMeta(type):
+    # fields become slots, so nodes carry no per-instance __dict__
+    def __new__(meta, clsname, bases, namespace):
+        namespace.setdefault('__slots__', tuple(namespace.get('__annotations__', {})))
+        return super().__new__(meta, clsname, bases, namespace)
+
+def make_init(fields):
+    # plain assignments, generated once per node class
+    names = [name for name, _ in fields]
+    params = ''.join(f'{name}, ' for name in names)
+    body = ''.join(f'    self.{name} = {name}\n' for name in names)
+    source = (f'def __init__(self, {params}*, lineno=None):\n'
+              f'{body}'
+              f'    self.lineno = lineno\n'
+              f'    self.type = None\n'
+              f'    self.register = None\n')
+
+    namespace = { }
+    exec(source, namespace)
+    return namespace['__init__']
+
+def make_checked_init(fields, init):
+    def __init__(self, *args, lineno=None):
+        if len(args) != len(fields):
+            raise TypeError(f'Expected {len(fields)} arguments')
+        for (name, ty), arg in zip(fields, args):
+            if isinstance(ty, list):
+                if not isinstance(arg, list):
+                    raise TypeError(f'{name} must be list')
+                if not all(isinstance(item, ty[0]) for item in arg):
+                    raise TypeError(f'All items of {name} must be {ty[0]}')
+            elif not isinstance(arg, ty):
+                raise TypeError(f'{name} must be {ty}')
+
+        init(self, *args, lineno=lineno)
+
+    return __init__
+
+class AST(object, metaclass=ASTMeta):
+    __slots__ = ('lineno', 'type', 'register')
+
     _nodes = { }
 
     @classmethod
     def __init_subclass__(cls):
         AST._nodes[cls.__name__] = cls
 
-        if not hasattr(cls, '__annotations__'):
-            return
-
-        fields = list(cls.__annotations__.items())
-
-        def __init__(self, *args, **kwargs):
-            if len(args) != len(fields):
-                raise TypeError(f'Expected {len(fields)} arguments')
-            for (name, ty), arg in zip(fields, args):
-                if isinstance(ty, list):
-                    if not isinstance(arg, list):
-                        raise TypeError(f'{name} must be list')
-                    if not all(isinstance(item, ty[0]) for item in arg):
-                        raise TypeError(f'All items of {name} must be {ty[0]}')
-                elif not isinstance(arg, ty):
-                    raise TypeError(f'{name} must be {ty}')
-                setattr(self, name, arg)
-
-            for name, val in kwargs.items():
-                setattr(self, name, val)
+        fields = list(vars(cls).get('__annotations__', {}).items())
 
-        cls.__init__ = __init__
+        cls._unchecked_init = make_init(fields)
+        cls._checked_init = make_checked_init(fields, cls._unchecked_init)
+        cls.__init__ = cls._checked_init
         cls._fields = [name for name,_ in fields]
+        cls._children = [name for name, ty in fields if not isinstance(ty, type) or issubclass(ty, AST)]
 
     def __repr__(self):
         vals = [ getattr(self, name) for name in self._fields ]
@@ -38,6 +64,21 @@ class AST(object):
                            for name, val in zip(self._fields, vals))
         return f'{type(self).__name__}({argstr})'
 
+@contextmanager
+def field_checks(enabled):
+    '''
+    Turn the per-field type validation of node constructors on or off for
+    the duration of the block.
+    '''
+    previous = {cls: cls.__init__ for cls in AST._nodes.values()}
+    for cls in AST._nodes.values():
+        cls.__init__ = cls._checked_init if enabled else cls._unchecked_init
+    try:
+        yield
+    finally:
+        for cls, init in previous.items():
+            cls.__init__ = init
+
 # AST NODES
 class Statement(AST):
     pass
@@ -104,6 +145,7 @@ class FuncDeclaration(Statement):
     params : [FuncParameter]
     datatype: DataType
     body : [Statement]
+    memo : bool
 
 class ReturnStatement(Statement):
     value: Expression
@@ -126,24 +168,45 @@ class WriteLocation(Statement):
     location: Location
     value : Expression
 
-# taken from python's ast module
+# taken from python's ast module, but walked with an explicit stack so deep
+# trees don't hit the recursion limit. A visit_ method that needs to visit
+# children is written as a generator and yields them (a node or a list of
+# nodes); it is resumed once the child has been visited. It may also just
+# return a list of children to visit after it, as generic_visit does.
 class NodeVisitor(object):
+    _dispatch = { }
+
     def visit(self, node):
-        if isinstance(node, list):
-            for item in node:
-                self.visit(item)
-        elif isinstance(node, AST):
-            method = 'visit_' + node.__class__.__name__
-            visitor = getattr(self, method, self.generic_visit)
-            visitor(node)
-
-    def generic_visit(self,node):
-        for field in getattr(node, '_fields'):
-            value = getattr(node, field, None)
-            self.visit(value)
+        dispatch = self._dispatch
+        stack = [iter((node,))]
+        push = stack.append
+        pop = stack.pop
+        while stack:
+            node = next(stack[-1], stack)
+            if node is stack:
+                pop()
+            elif isinstance(node, AST):
+                cls = node.__class__
+                visitor = dispatch.get(cls)
+                if visitor is None:
+                    visitor = dispatch[cls] = self.resolve(cls)
+
+                children = visitor(self, node)
+                if children:
+                    push(iter(children))
+            elif isinstance(node, list):
+                push(iter(node))
+
+    @classmethod
+    def resolve(cls, node_cls):
+        return getattr(cls, 'visit_' + node_cls.__name__, cls.generic_visit)
+
+    def generic_visit(self, node):
+        return [getattr(node, field) for field in node._children]
 
     @classmethod
     def __init_subclass__(cls):
+        cls._dispatch = { }
         for key in vars(cls):
             if key.startswith('visit_'):
                 assert key[6:] in globals(), f"{key} doesn't match any AST node"
@@ -156,7 +219,7 @@ def flatten(top):
         def generic_visit(self, node):
             self.nodes.append((self.depth, node))
             self.depth += 1
-            NodeVisitor.generic_visit(self, node)
+            yield NodeVisitor.generic_visit(self, node)
             self.depth -= 1
 
     d = Flattener()
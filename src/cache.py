@@ -0,0 +1,125 @@
+# Pulse table cache - persists the generated lexer regex and LALR tables
+
+import os
+import sys
+import pickle
+import hashlib
+import tempfile
+from types import SimpleNamespace
+
+import sly
+from sly import Lexer, Parser
+from sly.lex import LexerBuildError
+from sly.yacc import Production, _collect_grammar_rules
+
+# Directory holding the cached tables. Set PULSE_CACHE_DIR to move it, or to
+# an empty string to disable caching entirely.
+CACHE_DIR = os.environ.get('PULSE_CACHE_DIR',
+                           os.path.join(os.path.dirname(__file__), '__pycache__'))
+
+def grammar_hash(*spec):
+    text = repr((sly.__version__, sys.version_info[:2], spec))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def cache_path(name, digest):
+    return os.path.join(CACHE_DIR, f'{name}.{digest}.pickle')
+
+def load(name, digest):
+    if not CACHE_DIR:
+        return None
+
+    try:
+        with open(cache_path(name, digest), 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+def store(name, digest, data):
+    if not CACHE_DIR:
+        return
+
+    # write to a temp file first so a concurrent compiler never reads half a table
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_path(name, digest))
+    except OSError:
+        pass
+
+
+class CachedLexer(Lexer):
+    @classmethod
+    def _build(cls):
+        if 'tokens' not in vars(cls):
+            return
+
+        cls._token_names = cls._token_names | set(cls.tokens)
+        cls._collect_rules()
+        digest = grammar_hash(sorted(cls.tokens), cls.ignore, cls.reflags, sorted(cls._remap.items()),
+                              [(name, getattr(value, 'pattern', value)) for name, value in cls._rules])
+
+        pattern = load(cls.__name__, digest)
+        if pattern is None:
+            super()._build()
+            store(cls.__name__, digest, cls._master_re.pattern)
+            return
+
+        # the cached pattern has already been validated, only the master regex
+        # is compiled; the rest is set up as sly does it
+        cls._ignored_tokens = set(cls._ignored_tokens)
+        cls._token_funcs = dict(cls._token_funcs)
+        cls._remapping = dict(cls._remapping)
+
+        for (key, val), newtok in cls._remap.items():
+            cls._remapping.setdefault(key, {})[val] = newtok
+
+        undefined = {tok for d in cls._remapping.values() for tok in d.values()} - cls._token_names
+        if undefined:
+            raise LexerBuildError(f'{", ".join(undefined)} not included in token(s)')
+
+        for tokname, value in cls._rules:
+            if tokname.startswith('ignore_'):
+                cls._ignored_tokens.add(tokname[7:])
+            elif callable(value):
+                cls._token_funcs[tokname] = value
+
+        cls._master_re = cls.regex_module.compile(pattern, cls.reflags)
+
+
+class CachedParser(Parser):
+    @classmethod
+    def _build(cls, definitions):
+        if vars(cls).get('_build', False):
+            return
+
+        rules = [ (name, value) for name, value in definitions
+                  if callable(value) and hasattr(value, 'rules') ]
+        parsed_rules = [ rule for _, func in rules for rule in _collect_grammar_rules(func) ]
+
+        digest = grammar_hash(sorted(cls.tokens), getattr(cls, 'precedence', ()),
+                              getattr(cls, 'start', None),
+                              [(prodname, syms) for _, _, _, prodname, syms in parsed_rules])
+
+        tables = load(cls.__name__, digest)
+        if tables is None or len(tables['productions']) != len(parsed_rules) + 1:
+            super()._build(definitions)
+            tables = {
+                'productions': [(p.name, p.prod) for p in cls._grammar.Productions],
+                'lr_action': cls._lrtable.lr_action,
+                'lr_goto': cls._lrtable.lr_goto,
+                'defaulted_states': cls._lrtable.defaulted_states,
+            }
+            store(cls.__name__, digest, tables)
+            return
+
+        # productions are numbered in rule order, after the augmented start rule
+        funcs = [None] + [pfunc for pfunc, _, _, _, _ in parsed_rules]
+        productions = [Production(n, name, prod, func=func)
+                       for n, ((name, prod), func) in enumerate(zip(tables['productions'], funcs))]
+
+        cls._grammar = SimpleNamespace(Productions=productions)
+        cls._lrtable = SimpleNamespace(lr_action=tables['lr_action'],
+                                       lr_goto=tables['lr_goto'],
+                                       defaulted_states=tables['defaulted_states'])
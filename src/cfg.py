@@ -0,0 +1,366 @@
+# Pulse cfg - control flow graph form of the intermediate code
+
+import re
+
+import ir
+
+TERMINATORS = {'BRANCH', 'CBRANCH', 'RET'}
+
+
+class Value(object):
+    '''
+    An SSA value. IR registers are assigned exactly once, so each one becomes
+    a Value that knows the instruction defining it and the instructions
+    using it (once per operand).
+    '''
+    __slots__ = ('name', 'definition', 'uses')
+
+    def __init__(self, name):
+        self.name = name
+        self.definition = None
+        self.uses = []
+
+    def replace_uses(self, value):
+        for inst in self.uses:
+            inst.operands = tuple(value if op is self else op for op in inst.operands)
+            value.uses.append(inst)
+        self.uses = []
+
+    def __repr__(self):
+        return self.name
+
+
+class Instruction(object):
+    __slots__ = ('opcode', 'operands', 'result', 'block', 'lineno')
+
+    def __init__(self, opcode, operands, result=None, lineno=None):
+        self.opcode = opcode
+        self.operands = tuple(operands)
+        self.result = result
+        self.block = None
+        # the source line, None for code that passes made up
+        self.lineno = lineno
+
+        for op in self.operands:
+            if isinstance(op, Value):
+                op.uses.append(self)
+        if result is not None:
+            result.definition = self
+
+    @property
+    def values(self):
+        return [op for op in self.operands if isinstance(op, Value)]
+
+    @property
+    def targets(self):
+        return [op for op in self.operands if isinstance(op, Block)]
+
+    @property
+    def arguments(self):
+        '''
+        The operands in IR tuple order, with the defined value last.
+        '''
+        if self.result is None:
+            return self.operands
+        return self.operands + (self.result,)
+
+    def rewrite(self, opcode, operands):
+        '''
+        Turn this into another instruction defining the same value.
+        '''
+        for op in self.operands:
+            if isinstance(op, Value):
+                op.uses.remove(self)
+        self.opcode = opcode
+        self.operands = tuple(operands)
+        for op in self.operands:
+            if isinstance(op, Value):
+                op.uses.append(self)
+
+    def remove(self):
+        for op in self.operands:
+            if isinstance(op, Value):
+                op.uses.remove(self)
+        self.block.instructions.remove(self)
+        self.block = None
+
+    def as_tuple(self):
+        return (self.opcode, *[op.name if isinstance(op, Value) else
+                               op.label if isinstance(op, Block) else op
+                               for op in self.arguments])
+
+    def __repr__(self):
+        return repr(self.as_tuple())
+
+
+class Block(object):
+    def __init__(self, label):
+        self.label = label
+        self.instructions = []
+        self.predecessors = []
+        self.successors = []
+
+    def append(self, inst):
+        inst.block = self
+        self.instructions.append(inst)
+        return inst
+
+    def insert(self, index, inst):
+        inst.block = self
+        self.instructions.insert(index, inst)
+        return inst
+
+    @property
+    def terminator(self):
+        if self.instructions and self.instructions[-1].opcode in TERMINATORS:
+            return self.instructions[-1]
+        return None
+
+    def __iter__(self):
+        return self.instructions.__iter__()
+
+    def __repr__(self):
+        return self.label
+
+
+class Function(object):
+    '''
+    A function as a list of basic blocks, the first being the entry. A block
+    either ends in a terminator or, if it is the last one, falls off the end
+    of the function.
+    '''
+    def __init__(self, func_name, parameters, return_type, lineno=None):
+        self.name = func_name
+        self.parameters = parameters
+        self.return_type = return_type
+        self.memo = False
+        self.lineno = lineno
+
+        self.blocks = []
+
+    @property
+    def entry(self):
+        return self.blocks[0]
+
+    def link(self):
+        '''
+        Recompute the predecessor and successor edges from the terminators.
+        '''
+        for block in self.blocks:
+            block.predecessors = []
+        for block in self.blocks:
+            terminator = block.terminator
+            block.successors = list(dict.fromkeys(terminator.targets)) if terminator else []
+            for succ in block.successors:
+                succ.predecessors.append(block)
+
+    def merge_blocks(self):
+        '''
+        Append a block to its predecessor when that is its only one and
+        branches straight to it. Returns the number of branches removed.
+        '''
+        merged = set()
+        for block in self.blocks:
+            if block in merged:
+                continue
+            while True:
+                terminator = block.terminator
+                if terminator is None or terminator.opcode != 'BRANCH':
+                    break
+                succ = terminator.operands[0]
+                if succ is block or succ is self.entry or succ.predecessors != [block]:
+                    break
+
+                terminator.remove()
+                for inst in succ.instructions:
+                    inst.block = block
+                block.instructions.extend(succ.instructions)
+                block.successors = succ.successors
+                for next_block in succ.successors:
+                    next_block.predecessors = [block if pred is succ else pred
+                                               for pred in next_block.predecessors]
+                merged.add(succ)
+
+        self.blocks = [block for block in self.blocks if block not in merged]
+        return len(merged)
+
+    def postorder(self):
+        '''
+        The blocks reachable from the entry, each after all its successors
+        except along back edges.
+        '''
+        order = []
+        seen = {self.entry}
+        stack = [(self.entry, iter(self.entry.successors))]
+        while stack:
+            block, successors = stack[-1]
+            succ = next(successors, None)
+            if succ is None:
+                order.append(block)
+                stack.pop()
+            elif succ not in seen:
+                seen.add(succ)
+                stack.append((succ, iter(succ.successors)))
+        return order
+
+    def dominators(self):
+        '''
+        The immediate dominator of every reachable block, with the entry
+        mapped to itself (Cooper, Harvey and Kennedy's iterative algorithm).
+        '''
+        order = self.postorder()
+        index = {block: n for n, block in enumerate(order)}
+        idom = {self.entry: self.entry}
+
+        def intersect(a, b):
+            while a is not b:
+                while index[a] < index[b]:
+                    a = idom[a]
+                while index[b] < index[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(order[:-1]):
+                preds = [pred for pred in block.predecessors if pred in idom]
+                new = preds[0]
+                for pred in preds[1:]:
+                    new = intersect(pred, new)
+                if idom.get(block) is not new:
+                    idom[block] = new
+                    changed = True
+        return idom
+
+    def linearize(self):
+        '''
+        Back to the flat tuple form of ir.Function.
+        '''
+        func = ir.Function(self.name, self.parameters, self.return_type, self.lineno)
+        func.memo = self.memo
+        for n, block in enumerate(self.blocks):
+            if n:
+                func.append(('LABEL', block.label))
+            for inst in block:
+                func.append(inst.as_tuple(), inst.lineno)
+        return func
+
+    def __iter__(self):
+        return self.blocks.__iter__()
+
+    def __repr__(self):
+        params = [f"{pname}:{ptype}" for pname, ptype in self.parameters]
+        return f"{self.name}({params}) -> {self.return_type}"
+
+
+class Names(object):
+    '''
+    Fresh register and label names, numbered past every one in use, and
+    numbers for the copies of variables (name.N) passes make.
+    '''
+    def __init__(self, functions):
+        registers = [0]
+        labels = [0]
+        copies = [0]
+        for func in functions:
+            for block in func:
+                labels.extend(int(n) for n in re.findall(r'^L(\d+)$', block.label))
+                for inst in block:
+                    if inst.result is not None:
+                        registers.extend(int(n) for n in re.findall(r'^R(\d+)$', inst.result.name))
+                    if inst.opcode.startswith(('ALLOC', 'VAR')):
+                        copies.extend(int(n) for n in re.findall(r'\.(\d+)$', inst.operands[0]))
+
+        self.registers = max(registers)
+        self.labels = max(labels)
+        self.copies = max(copies)
+
+    def register(self):
+        self.registers += 1
+        return f'R{self.registers}'
+
+    def label(self):
+        self.labels += 1
+        return f'L{self.labels}'
+
+    def copy(self):
+        self.copies += 1
+        return self.copies
+
+
+def build_cfg(ir_function):
+    '''
+    Split the code of an ir.Function into basic blocks at its labels and
+    branches. Code after a terminator that no label leads to goes in a block
+    of its own, which nothing branches to.
+    '''
+    func = Function(ir_function.name, ir_function.parameters, ir_function.return_type,
+                    ir_function.lineno)
+    func.memo = ir_function.memo
+    blocks = {}
+    values = {}
+
+    def block(label):
+        if label not in blocks:
+            blocks[label] = Block(label)
+        return blocks[label]
+
+    current = Block('entry')
+    func.blocks.append(current)
+
+    for (opcode, *args), lineno in zip(ir_function, ir_function.lines):
+        if opcode == 'LABEL':
+            target = block(args[0])
+            if current is not None and current.terminator is None:
+                current.append(Instruction('BRANCH', [target]))
+            current = target
+            func.blocks.append(current)
+            continue
+
+        if current is None:
+            # code after a return, unreachable but possibly defining values
+            # used after a label it leads to
+            current = Block(f'dead{len(func.blocks)}')
+            func.blocks.append(current)
+
+        operands = []
+        result = None
+        for kind, arg in zip(ir.operand_kinds(opcode, len(args)), args):
+            if kind == 'v':
+                operands.append(values[arg])
+            elif kind == 'l':
+                operands.append(block(arg))
+            elif kind == 'r':
+                result = values[arg] = Value(arg)
+            else:
+                operands.append(arg)
+
+        current.append(Instruction(opcode, operands, result, lineno or None))
+        if opcode in TERMINATORS:
+            current = None
+
+    func.link()
+    return func
+
+def main():
+    import sys
+
+    if len(sys.argv) != 2:
+        raise SystemExit(1)
+
+    with open(sys.argv[1]) as source:
+        code = ir.compile_ircode(source)
+
+    for f in code:
+        func = build_cfg(f)
+        print(f'{"::"*5} {func} {"::"*5}')
+        for block in func:
+            preds = ', '.join(map(repr, block.predecessors))
+            print(f'{block.label + ":":<30}; preds: {preds}')
+            for inst in block:
+                print(f'    {inst}')
+        print("*"*30)
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,165 @@
-# Pulse compiler (uses clang)
+# Pulse compiler - emits a native object with llvmlite and links it with
+# the prebuilt runtime, or with --lto, with the runtime compiled in
 
 import subprocess
 import sys
 import os.path
 import tempfile
 
-from llvm import compile_llvm
+from llvm import (
+    compile_llvm, compile_objects, native_target, parse_llvm, run_passes, link_runtime, show_remarks,
+    MEMO_SIZE, LLVM_OPT_LEVELS, OUTPUT_POLICIES
+    )
+from target import add_target_arguments, target_options
 from error import errors_reported
+from optimize import report, split_level
+from inline import INLINE_THRESHOLD
 
 _rtlib = os.path.join(os.path.dirname(__file__), 'pulsert.c')
+_rtobj = os.path.join(os.path.dirname(__file__), 'pulsert.o')
+_rtbitcode = os.path.join(os.path.dirname(__file__), 'pulsert.bc')
 
-# clang installation
-CLANG = 'clang'
+# C compiler, used to build the runtime and as the linker driver
+CC = os.environ.get('CC', 'cc')
 
-def main():
-    if len(sys.argv) != 2:
-        sys.stderr.write("Usage: pulsec filename\n")
+# compiles the runtime to LLVM bitcode for --lto
+CLANG = os.environ.get('CLANG', 'clang')
+
+def prebuilt(path, *flags, compiler=CC):
+    '''
+    path, compiled from pulsert.c with flags first if it is missing or
+    older than pulsert.c.
+    '''
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(_rtlib):
+        subprocess.check_call([compiler, '-O2', '-fPIC', *flags, _rtlib, '-o', path])
+    return path
+
+def runtime_object():
+    return prebuilt(_rtobj, '-c', '-DNEED_MAIN')
+
+def runtime_bitcode():
+    return prebuilt(_rtbitcode, '-c', '-emit-llvm', '-DNEED_MAIN', compiler=CLANG)
+
+def build_executable(llvm_code, out, llvm_opt_level=0, target=None, lto=False):
+    '''
+    Compile LLVM IR text to a native object in-process and link it with the
+    runtime into the executable out. With lto, the runtime's bitcode is
+    linked into the module instead, and LLVM's optimizer runs over both.
+    '''
+    machine = native_target(llvm_opt_level, target)
+    module = parse_llvm(llvm_code, machine)
+    if not lto:
+        link_executable([machine.emit_object(module)], out)
+        return
+
+    with open(runtime_bitcode(), 'rb') as f:
+        bitcode = f.read()
+    try:
+        link_runtime(module, machine, bitcode)
+    except RuntimeError as err:
+        # bitcode from a newer LLVM than llvmlite's cannot be read
+        sys.stderr.write("Error: cannot link the runtime bitcode built by {}: {}\n".format(CLANG, err))
         raise SystemExit(1)
+    run_passes(module, machine, llvm_opt_level, target=target)
+    link_executable([machine.emit_object(module)], out, runtime=False)
+
+def link_executable(objects, out, runtime=True):
+    '''
+    Link native objects, given as bytes, and the runtime unless they already
+    include it, into out.
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for n, obj in enumerate(objects):
+            paths.append(os.path.join(tmp, f'{n}.o'))
+            with open(paths[-1], 'wb') as f:
+                f.write(obj)
+        if runtime:
+            paths.append(runtime_object())
+        subprocess.check_call([CC, *paths, '-o', out, '-lm'])
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='pulsec')
+    parser.add_argument('filename')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='check function bodies on this many processes')
+    parser.add_argument('--codegen-jobs', type=int, default=1,
+                        help='split the program into this many LLVM modules, compiled in parallel')
+    parser.add_argument('-O', dest='level', type=int, default=0, choices=LLVM_OPT_LEVELS,
+                        help='optimization level: Pulse IR passes up to 2, then LLVM at the same level')
+    parser.add_argument('--llvm-opt', dest='llvm_opt_level', type=int, choices=LLVM_OPT_LEVELS,
+                        help="run LLVM's optimizer at this level instead of -O's")
+    parser.add_argument('--inline-threshold', type=int, default=INLINE_THRESHOLD,
+                        help='inline functions of up to this many IR instructions at -O2')
+    parser.add_argument('--memo-size', type=int, default=MEMO_SIZE,
+                        help='results each memo function keeps cached')
+    parser.add_argument('--stats', action='store_true',
+                        help='report how many instructions each pass removed')
+    parser.add_argument('--profile-generate', metavar='PATH',
+                        help='instrument the program to write a profile to PATH when it exits '
+                             '($PULSE_PROFILE overrides it)')
+    parser.add_argument('--profile-use', metavar='PATH',
+                        help='optimize with the branch and call counts of a profile')
+    parser.add_argument('--buffering', choices=OUTPUT_POLICIES,
+                        help='when the program writes out what it prints: when its buffer is full, '
+                             'at each newline, or after every print ($PULSE_BUFFERING overrides it; '
+                             'default line on a terminal, else full)')
+    parser.add_argument('-g', dest='debug', action='store_true',
+                        help='emit DWARF line tables, for debuggers and perf annotate')
+    parser.add_argument('--profile', action='store_true',
+                        help='time each function, and print a flat profile to stderr at exit')
+    parser.add_argument('--lto', action='store_true',
+                        help='link the runtime in as bitcode and optimize it with the program '
+                             '(the bitcode is built by $CLANG, default clang, which must be no newer '
+                             'than the LLVM llvmlite uses)')
+    add_target_arguments(parser)
+    args = parser.parse_args()
+    if args.lto and args.codegen_jobs > 1:
+        parser.error('--lto optimizes the program as one module, so it cannot take --codegen-jobs')
 
     try:
-        f = open(sys.argv[1])
+        f = open(args.filename)
     except:
-        sys.stderr.write("Error: file '{}' does not exist\n".format(sys.argv[1]))
+        sys.stderr.write("Error: file '{}' does not exist\n".format(args.filename))
         raise SystemExit(1)
         
-    source = f.read()
-    llvm_code = compile_llvm(source)
+    opt_level, llvm_opt_level = split_level(args.level)
+    if args.llvm_opt_level is not None:
+        llvm_opt_level = args.llvm_opt_level
+
+    target = target_options(args)
+    # with --lto, LLVM's optimizer runs once the runtime is linked in
+    codegen_opt_level = llvm_opt_level
+    if args.lto:
+        llvm_opt_level = 0
+    if args.remarks:
+        show_remarks(args.remarks)
+
+    removed = {}
+    options = dict(jobs=args.jobs, opt_level=opt_level, removed=removed, memo_size=args.memo_size,
+                   llvm_opt_level=llvm_opt_level, target=target,
+                   profile_generate=args.profile_generate, profile_use=args.profile_use,
+                   buffering=args.buffering, timing=args.profile,
+                   debug=args.filename if args.debug else None, inline_threshold=args.inline_threshold)
+    with f:
+        if args.codegen_jobs > 1:
+            objects = compile_objects(f, args.codegen_jobs, **options)
+        else:
+            llvm_code = compile_llvm(f, **options)
+
+    if args.stats:
+        report(removed, sys.stderr)
 
     # out = os.path.join(os.path.dirname(sys.argv[1]), os.path.splitext(os.path.basename(sys.argv[1]))[0]);
-    out = os.path.splitext(os.path.basename(sys.argv[1]))[0];
-    if not errors_reported():
-        with tempfile.NamedTemporaryFile(suffix='.ll') as f:
-            f.write(llvm_code.encode('utf-8'))
-            f.flush()
-            subprocess.check_output([CLANG, '-DNEED_MAIN', f.name, '-o', out, _rtlib])
+    out = os.path.splitext(os.path.basename(args.filename))[0];
+    if errors_reported():
+        return
+    if args.codegen_jobs > 1:
+        link_executable(objects, out)
+    else:
+        build_executable(llvm_code, out, codegen_opt_level, target, args.lto)
 
 if __name__ == '__main__':
     main()
@@ -1,11 +1,20 @@
 # PulseLang Error Handler
 
 import sys
+from contextlib import contextmanager
 
 errors = 0
+collectors = []
 
 def error(linenum, error, filename=None):
     global errors
+
+    # errors raised while a collector is active are handed back to the
+    # caller instead of being printed
+    if collectors:
+        collectors[-1].append((linenum, error))
+        return
+
     if not filename:
         msg = "{}: {}".format(linenum, error)
     else:
@@ -14,6 +23,15 @@ def error(linenum, error, filename=None):
     print(msg, file=sys.stderr)
     errors += 1
 
+@contextmanager
+def collect_errors():
+    diagnostics = []
+    collectors.append(diagnostics)
+    try:
+        yield diagnostics
+    finally:
+        collectors.pop()
+
 def errors_reported():
     return errors
 
@@ -0,0 +1,196 @@
+# Pulse inliner - copies small functions into their callers
+
+from cfg import Value, Instruction, Block, Names
+
+# callees of up to this many instructions are inlined at every call site, and
+# ones called from a single place up to SINGLE_CALL_FACTOR times as large
+INLINE_THRESHOLD = 30
+SINGLE_CALL_FACTOR = 4
+
+def calls(func):
+    return [inst for block in func for inst in block if inst.opcode == 'CALL']
+
+def size(func):
+    return sum(len(block.instructions) for block in func)
+
+def local_names(func):
+    names = {pname for pname, _ in func.parameters}
+    for block in func:
+        for inst in block:
+            if inst.opcode.startswith('ALLOC'):
+                names.add(inst.operands[0])
+    return names
+
+def global_names(func):
+    names = set()
+    for block in func:
+        for inst in block:
+            if inst.opcode.startswith('LOAD'):
+                names.add(inst.operands[0])
+            elif inst.opcode.startswith('STORE'):
+                names.add(inst.operands[1])
+    return names - local_names(func)
+
+def recursive_groups(functions, by_name):
+    '''
+    The strongly connected components of the call graph, each listed after
+    every component it calls (Tarjan's algorithm). Calls within a component
+    are recursive.
+    '''
+    callees = {func: [by_name[call.operands[0]] for call in calls(func)
+                      if call.operands[0] in by_name]
+               for func in functions}
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    groups = []
+
+    def push(func):
+        index[func] = low[func] = len(index)
+        stack.append(func)
+        on_stack.add(func)
+        work.append((func, iter(callees[func])))
+
+    for root in functions:
+        if root in index:
+            continue
+        work = []
+        push(root)
+        while work:
+            func, pending = work[-1]
+            callee = next(pending, None)
+            if callee is None:
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    low[caller] = min(low[caller], low[func])
+                if low[func] == index[func]:
+                    group = []
+                    while not group or group[-1] is not func:
+                        group.append(stack.pop())
+                        on_stack.discard(group[-1])
+                    groups.append(group)
+            elif callee not in index:
+                push(callee)
+            elif callee in on_stack:
+                low[func] = min(low[func], index[callee])
+
+    return groups
+
+
+def inline(caller, call, callee, names):
+    '''
+    Replace call, in caller, with a copy of the body of callee. The callee's
+    parameters and locals become fresh locals of the caller, allocated in
+    its entry block.
+    '''
+    block = call.block
+    position = block.instructions.index(call)
+
+    # the code after the call continues in a block of its own
+    post = Block(names.label())
+    for inst in block.instructions[position+1:]:
+        post.append(inst)
+    del block.instructions[position:]
+    for op in call.values:
+        op.uses.remove(call)
+    call.block = None
+
+    copy = names.copy()
+    variables = {name: f'{name}.{copy}' for name in local_names(callee)}
+    allocs = [Instruction('ALLOC' + ptype, [variables[pname]]) for pname, ptype in callee.parameters]
+    for (pname, ptype), arg in zip(callee.parameters, call.operands[1:]):
+        block.append(Instruction('STORE' + ptype, [arg, variables[pname]]))
+
+    blocks = {old: Block(names.label()) for old in callee}
+    values = {}
+
+    def value(old):
+        if old not in values:
+            values[old] = Value(names.register())
+        return values[old]
+
+    returns = []
+    falls_off = False
+    for old in callee:
+        new = blocks[old]
+        for inst in old:
+            opcode = inst.opcode
+            if opcode.startswith('ALLOC'):
+                allocs.append(Instruction(opcode, [variables[inst.operands[0]]]))
+                continue
+            if opcode == 'RET':
+                returns.append((new, value(inst.operands[0])))
+                new.append(Instruction('BRANCH', [post]))
+                continue
+
+            operands = [value(op) if isinstance(op, Value) else blocks.get(op, op) if isinstance(op, Block)
+                        else variables.get(op, op) if opcode.startswith(('LOAD', 'STORE')) else op
+                        for op in inst.operands]
+            result = value(inst.result) if inst.result is not None else None
+            # without inlined-at scopes in the debug info, the call's line
+            # is the one to blame
+            new.append(Instruction(opcode, operands, result, call.lineno))
+
+        if new.terminator is None:
+            new.append(Instruction('BRANCH', [post]))
+            falls_off = True
+
+    if len(returns) == 1 and not falls_off:
+        call.result.replace_uses(returns[0][1])
+    else:
+        # several ways out, which meet at a return variable
+        variable = f'return.{copy}'
+        allocs.append(Instruction('ALLOC' + callee.return_type, [variable]))
+        for new, result in returns:
+            new.insert(len(new.instructions) - 1,
+                       Instruction('STORE' + callee.return_type, [result, variable]))
+        post.insert(0, Instruction('LOAD' + callee.return_type, [variable], call.result))
+
+    block.append(Instruction('BRANCH', [blocks[callee.entry]]))
+
+    for n, alloc in enumerate(allocs):
+        caller.entry.insert(n, alloc)
+
+    position = caller.blocks.index(block)
+    caller.blocks[position+1:position+1] = list(blocks.values()) + [post]
+
+def inline_functions(functions, threshold=INLINE_THRESHOLD):
+    '''
+    Inline calls to small functions, working up the call graph from the
+    leaves so that a callee has had its own calls inlined first. Calls
+    between mutually recursive functions are left alone.
+    '''
+    by_name = {func.name: func for func in functions}
+    call_counts = {}
+    for func in functions:
+        for call in calls(func):
+            call_counts[call.operands[0]] = call_counts.get(call.operands[0], 0) + 1
+
+    names = Names(functions)
+    for group in recursive_groups(functions, by_name):
+        for func in group:
+            changed = False
+            for call in calls(func):
+                callee = by_name.get(call.operands[0])
+                # a memo function's calls must go through its cache
+                if callee is None or callee in group or callee.memo:
+                    continue
+
+                limit = threshold
+                if call_counts[callee.name] == 1:
+                    limit *= SINGLE_CALL_FACTOR
+                if size(callee) > limit:
+                    continue
+
+                # a global the callee uses must not be hidden by a local here
+                if global_names(callee) & local_names(func):
+                    continue
+
+                inline(func, call, callee, names)
+                changed = True
+
+            if changed:
+                func.link()
+                func.merge_blocks()
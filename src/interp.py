@@ -0,0 +1,397 @@
+# Pulse interpreter - runs the IR on a register-based bytecode VM, with no
+# LLVM, C compiler or new process involved
+
+import math
+import struct
+import sys
+from collections import OrderedDict
+
+from ir import operand_kinds
+from purity import MEMO_SIZE
+
+# Bytecode instructions are 4-tuples (opcode, a, b, c). Registers and local
+# variables are both slots in the frame of the running function, and globals
+# slots in one shared list, so every operand is resolved to an index (or a
+# constant, or a jump target) before the program runs. The dispatch loop
+# tests opcodes in this order, roughly the most frequent first.
+(MOVE, LOADG, STOREG, CONST, BRANCH,
+ BRLT, BRLE, BRGT, BRGE, BREQ, BRNE, BRNEF, CBRANCH,
+ ADDI, SUBI, MULI, DIVI, ADDF, SUBF, MULF, DIVF,
+ LT, LE, GT, GE, EQ, NE, NEF, AND, OR, XOR,
+ CALL, RET, PRINTI, PRINTF, PRINTB) = range(36)
+
+ARITHMETIC = {
+    'ADDI': ADDI, 'SUBI': SUBI, 'MULI': MULI, 'DIVI': DIVI,
+    'ADDF': ADDF, 'SUBF': SUBF, 'MULF': MULF, 'DIVF': DIVF,
+    'AND': AND, 'ANDI': AND, 'OR': OR, 'ORI': OR, 'XOR': XOR,
+}
+
+COMPARISONS = {'<': LT, '<=': LE, '>': GT, '>=': GE, '=': EQ, '!=': NE}
+
+# a comparison followed by a branch on its result, with c the two targets
+BRANCHES = {LT: BRLT, LE: BRLE, GT: BRGT, GE: BRGE, EQ: BREQ, NE: BRNE, NEF: BRNEF}
+
+PRINTS = {'PRINTI': PRINTI, 'PRINTF': PRINTF, 'PRINTB': PRINTB}
+
+# calls deeper than this are stopped, as a native program would overflow
+# its stack
+MAX_DEPTH = 1 << 20
+
+class PulseRuntimeError(Exception):
+    pass
+
+class Function(object):
+    '''
+    A function translated to bytecode, with the number of slots its frame
+    needs and the slots its parameters arrive in.
+    '''
+    def __init__(self, name, memo):
+        self.name = name
+        self.memo = memo
+        self.code = []
+        self.size = 0
+        self.parameters = []
+        self.floats = []
+
+    def memo_key(self, args):
+        '''
+        The key of a call in the memo cache. Float arguments go in by their
+        bits, as in the native runtime, so 0.0 and -0.0 get entries of their
+        own and a NaN finds its own.
+        '''
+        key = list(args)
+        for n in self.floats:
+            key[n] = pack_float(key[n])
+        return tuple(key)
+
+    def __repr__(self):
+        return f'Function({self.name})'
+
+pack_float = struct.Struct('<d').pack
+
+def wrap(value):
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+def divide_float(left, right):
+    # IEEE division, which Python does not do for a zero divisor
+    if right:
+        return left / right
+    if left == 0 or math.isnan(left):
+        return math.nan
+    return math.copysign(math.inf, left) * math.copysign(1.0, right)
+
+def register_uses(code):
+    '''
+    The indexes of the instructions using each register.
+    '''
+    uses = {}
+    for n, (opcode, *args) in enumerate(code):
+        if opcode == 'LABEL':
+            continue
+        for kind, arg in zip(operand_kinds(opcode, len(args)), args):
+            if kind == 'v':
+                uses.setdefault(arg, []).append(n)
+    return uses
+
+def local_copies(code, local_names, uses):
+    '''
+    Registers loaded from a local variable that can share its slot instead:
+    ones only used further on in the same block, before the variable is
+    stored to again.
+    '''
+    copies = {}
+    for n, (opcode, *args) in enumerate(code):
+        if not opcode.startswith('LOAD') or args[0] not in local_names:
+            continue
+        name, register = args
+        last = max(uses.get(register, [n]))
+        if all(opcode != 'LABEL' and not (opcode.startswith('STORE') and args[1] == name)
+               for opcode, *args in code[n+1:last]):
+            copies[register] = name
+    return copies
+
+class Program(object):
+    '''
+    A whole program as bytecode: its functions by name and its globals.
+    '''
+    def __init__(self, ir_functions):
+        self.globals = {}
+        self.functions = {func.name: Function(func.name, func.memo) for func in ir_functions}
+
+        # a name no function allocates is a global, which every function
+        # sees the same slot of
+        for ir_func in ir_functions:
+            for opcode, *args in ir_func:
+                if opcode.startswith('VAR'):
+                    self.global_slot(args[0])
+
+        for ir_func in ir_functions:
+            self.translate(ir_func, self.functions[ir_func.name])
+
+        self.memory = [0] * len(self.globals)
+
+    def global_slot(self, name):
+        if name not in self.globals:
+            self.globals[name] = len(self.globals)
+        return self.globals[name]
+
+    def translate(self, ir_func, func):
+        code = list(ir_func)
+        slots = {}
+
+        func.parameters = [self.slot(slots, pname) for pname, _ in ir_func.parameters]
+        func.floats = [n for n, (_, ptype) in enumerate(ir_func.parameters) if ptype == 'F']
+        local_names = {pname for pname, _ in ir_func.parameters}
+        local_names.update(args[0] for opcode, *args in code if opcode.startswith('ALLOC'))
+
+        uses = register_uses(code)
+        copies = local_copies(code, local_names, uses)
+        slots.update((register, self.slot(slots, name)) for register, name in copies.items())
+
+        def slot(name):
+            return self.slot(slots, name)
+
+        # a comparison only branched on becomes a compare-and-branch
+        skipped = set()
+        for n, (opcode, *args) in enumerate(code):
+            if opcode == 'LABEL' or opcode.startswith(('ALLOC', 'VAR')):
+                skipped.add(n)
+            elif opcode.startswith('LOAD') and args[1] in copies:
+                skipped.add(n)
+            elif (opcode == 'CBRANCH' and code[n-1][0].startswith('CMP')
+                  and uses[args[0]] == [n] and code[n-1][-1] == args[0]):
+                skipped.add(n)
+
+        # labels go to the index of the next instruction, as they are dropped
+        labels = {}
+        position = 0
+        for n, (opcode, *args) in enumerate(code):
+            if opcode == 'LABEL':
+                labels[args[0]] = position
+            elif n not in skipped:
+                position += 1
+
+        for n, (opcode, *args) in enumerate(code):
+            if n in skipped:
+                continue
+
+            if opcode.startswith('MOV'):
+                value, target = args
+                inst = (CONST, wrap(value) if opcode == 'MOVI' else value, slot(target), None)
+            elif opcode.startswith('LOAD'):
+                name, target = args
+                if name in local_names:
+                    inst = (MOVE, slot(name), slot(target), None)
+                else:
+                    inst = (LOADG, self.global_slot(name), slot(target), None)
+            elif opcode.startswith('STORE'):
+                source, name = args
+                if name in local_names:
+                    inst = (MOVE, slot(source), slot(name), None)
+                else:
+                    inst = (STOREG, slot(source), self.global_slot(name), None)
+            elif opcode in ARITHMETIC:
+                left, right, target = args
+                inst = (ARITHMETIC[opcode], slot(left), slot(right), slot(target))
+            elif opcode.startswith('CMP'):
+                op, left, right, target = args
+                compare = NEF if opcode == 'CMPF' and op == '!=' else COMPARISONS[op]
+                if n + 1 in skipped and code[n+1][0] == 'CBRANCH':
+                    _, _, true_label, false_label = code[n+1]
+                    inst = (BRANCHES[compare], slot(left), slot(right),
+                            (labels[true_label], labels[false_label]))
+                else:
+                    inst = (compare, slot(left), slot(right), slot(target))
+            elif opcode == 'CBRANCH':
+                test, true_label, false_label = args
+                inst = (CBRANCH, slot(test), labels[true_label], labels[false_label])
+            elif opcode == 'BRANCH':
+                inst = (BRANCH, labels[args[0]], None, None)
+            elif opcode == 'CALL':
+                name, *registers, target = args
+                inst = (CALL, self.functions[name], tuple(slot(r) for r in registers), slot(target))
+            elif opcode == 'RET':
+                inst = (RET, slot(args[0]), None, None)
+            elif opcode in PRINTS:
+                inst = (PRINTS[opcode], slot(args[0]), None, None)
+            else:
+                raise PulseRuntimeError(f'cannot interpret {opcode}')
+            func.code.append(inst)
+
+        # falling off the end returns whatever the return slot holds, 0 here
+        func.code.append((RET, slot('return'), None, None))
+        func.size = len(set(slots.values()))
+
+    @staticmethod
+    def slot(slots, name):
+        if name not in slots:
+            slots[name] = len(set(slots.values()))
+        return slots[name]
+
+    def call(self, name, out, memo_size=MEMO_SIZE):
+        '''
+        Run a function with no parameters to completion and return its
+        result, writing what it prints to the binary stream out.
+        '''
+        memory = self.memory
+        write = out.write
+        caches = {}
+
+        func = self.functions[name]
+        code = func.code
+        regs = [0] * func.size
+        pc = 0
+        stack = []
+        key = None
+
+        while True:
+            op, a, b, c = code[pc]
+            pc += 1
+            if op == MOVE:
+                regs[b] = regs[a]
+            elif op == LOADG:
+                regs[b] = memory[a]
+            elif op == STOREG:
+                memory[b] = regs[a]
+            elif op == CONST:
+                regs[b] = a
+            elif op == BRANCH:
+                pc = a
+            elif op == BRLT:
+                pc = c[0] if regs[a] < regs[b] else c[1]
+            elif op == BRLE:
+                pc = c[0] if regs[a] <= regs[b] else c[1]
+            elif op == BRGT:
+                pc = c[0] if regs[a] > regs[b] else c[1]
+            elif op == BRGE:
+                pc = c[0] if regs[a] >= regs[b] else c[1]
+            elif op == BREQ:
+                pc = c[0] if regs[a] == regs[b] else c[1]
+            elif op == BRNE:
+                pc = c[0] if regs[a] != regs[b] else c[1]
+            elif op == BRNEF:
+                pc = c[0] if regs[a] < regs[b] or regs[a] > regs[b] else c[1]
+            elif op == CBRANCH:
+                pc = b if regs[a] & 1 else c
+            elif op == ADDI:
+                value = regs[a] + regs[b]
+                regs[c] = value if -0x80000000 <= value <= 0x7FFFFFFF else wrap(value)
+            elif op == SUBI:
+                value = regs[a] - regs[b]
+                regs[c] = value if -0x80000000 <= value <= 0x7FFFFFFF else wrap(value)
+            elif op == MULI:
+                value = regs[a] * regs[b]
+                regs[c] = value if -0x80000000 <= value <= 0x7FFFFFFF else wrap(value)
+            elif op == DIVI:
+                left, right = regs[a], regs[b]
+                if not right:
+                    raise PulseRuntimeError('integer division by zero')
+                if left == -0x80000000 and right == -1:
+                    raise PulseRuntimeError('integer division overflow')
+                value = abs(left) // abs(right)
+                regs[c] = wrap(value if (left < 0) == (right < 0) else -value)
+            elif op == ADDF:
+                regs[c] = regs[a] + regs[b]
+            elif op == SUBF:
+                regs[c] = regs[a] - regs[b]
+            elif op == MULF:
+                regs[c] = regs[a] * regs[b]
+            elif op == DIVF:
+                regs[c] = divide_float(regs[a], regs[b])
+            elif op == LT:
+                regs[c] = regs[a] < regs[b]
+            elif op == LE:
+                regs[c] = regs[a] <= regs[b]
+            elif op == GT:
+                regs[c] = regs[a] > regs[b]
+            elif op == GE:
+                regs[c] = regs[a] >= regs[b]
+            elif op == EQ:
+                regs[c] = regs[a] == regs[b]
+            elif op == NE:
+                regs[c] = regs[a] != regs[b]
+            elif op == NEF:
+                # ordered: false if either side is NaN
+                regs[c] = regs[a] < regs[b] or regs[a] > regs[b]
+            elif op == AND:
+                regs[c] = regs[a] & regs[b]
+            elif op == OR:
+                regs[c] = regs[a] | regs[b]
+            elif op == XOR:
+                regs[c] = regs[a] ^ regs[b]
+            elif op == CALL:
+                args = [regs[r] for r in b]
+                callee = a
+                if callee.memo:
+                    cache = caches.setdefault(callee, OrderedDict())
+                    callee_key = callee.memo_key(args) if callee.floats else tuple(args)
+                    if callee_key in cache:
+                        cache.move_to_end(callee_key)
+                        regs[c] = cache[callee_key]
+                        continue
+                else:
+                    callee_key = None
+
+                stack.append((code, pc, regs, c, key))
+                code = callee.code
+                regs = [0] * callee.size
+                for param, arg in zip(callee.parameters, args):
+                    regs[param] = arg
+                pc = 0
+                key = callee_key is not None and (callee, callee_key)
+                if len(stack) > MAX_DEPTH:
+                    raise PulseRuntimeError('call stack overflow')
+            elif op == RET:
+                value = regs[a]
+                if key:
+                    cache = caches[key[0]]
+                    cache[key[1]] = value
+                    if len(cache) > memo_size:
+                        cache.popitem(last=False)
+                if not stack:
+                    return value
+                code, pc, regs, target, key = stack.pop()
+                regs[target] = value
+            elif op == PRINTI:
+                write(b'%i\n' % regs[a])
+            elif op == PRINTF:
+                write(b'%f\n' % regs[a])
+            elif op == PRINTB:
+                write(bytes((regs[a] & 0xFF,)))
+
+def interpret(ir_functions, out=None, memo_size=MEMO_SIZE):
+    '''
+    Run a program given as a list of IR functions, the way the native
+    runtime does: __pulse_init, then __pulse_main. Returns main's result.
+    '''
+    if out is None:
+        out = sys.stdout.buffer
+
+    program = Program(ir_functions)
+    try:
+        program.call('__pulse_init', out, memo_size)
+        return program.call('__pulse_main', out, memo_size)
+    finally:
+        out.flush()
+
+def main():
+    from ir import compile_ircode
+    from error import errors_reported
+
+    if len(sys.argv) != 2:
+        raise SystemExit(1)
+
+    with open(sys.argv[1]) as source:
+        functions = compile_ircode(source)
+    if errors_reported():
+        raise SystemExit(1)
+
+    try:
+        status = interpret(functions)
+    except PulseRuntimeError as err:
+        print(f'error: {err}', file=sys.stderr)
+        raise SystemExit(1)
+    raise SystemExit(status & 0xFF)
+
+if __name__ == '__main__':
+    main()
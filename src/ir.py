@@ -1,5 +1,9 @@
 # Pulse ircode - turns AST into machine code
 
+import sys
+import struct
+from array import array
+from types import GeneratorType
 from collections import ChainMap
 import ast
 
@@ -33,23 +37,74 @@ OP_CODES = ChainMap(
     dict.fromkeys(['<', '>', '<=', '>=', '=', '!='], "CMP")
 )
 
-def get_op_code(operation, type_name=None):
+def make_op_code(operation, type_name=None):
     op_code = OP_CODES[operation]
     suffix = "" if not type_name else IR_TYPE_MAPPING[type_name]
 
     return f"{op_code}{suffix}"
 
+# every opcode string is built once, and shared by all instructions using it
+_op_code_strings = {(operation, type_name): make_op_code(operation, type_name)
+                    for operation in OP_CODES for type_name in (None, *IR_TYPE_MAPPING)}
+
+def get_op_code(operation, type_name=None):
+    try:
+        return _op_code_strings[operation, type_name]
+    except KeyError:
+        return make_op_code(operation, type_name)
+
+OPCODE_NAMES = sorted(set(_op_code_strings.values()) | {'XOR'})
+OPCODE_NUMBERS = {name: n for n, name in enumerate(OPCODE_NAMES)}
+
+# what each operand of an instruction is: a register read (v), the register
+# defined (r), a label (l), a name (n), a constant (c) or an operator (o).
+# '*' repeats the next kind.
+OPERANDS = {
+    'MOV': 'cr',
+    'VAR': 'n',
+    'ALLOC': 'n',
+    'LOAD': 'nr',
+    'STORE': 'vn',
+    'ADD': 'vvr',
+    'SUB': 'vvr',
+    'MUL': 'vvr',
+    'DIV': 'vvr',
+    'AND': 'vvr',
+    'OR': 'vvr',
+    'XOR': 'vvr',
+    'CMP': 'ovvr',
+    'PRINT': 'v',
+    'CALL': 'n*vr',
+    'RET': 'v',
+    'LABEL': 'l',
+    'BRANCH': 'l',
+    'CBRANCH': 'vll',
+}
+
+def operand_kinds(opcode, count):
+    kinds = OPERANDS.get(opcode) or OPERANDS[opcode[:-1]]
+    if '*' in kinds:
+        star = kinds.index('*')
+        kinds = kinds[:star] + kinds[star+1] * (count - len(kinds) + 2) + kinds[star+2:]
+    return kinds
+
 
 class Function():
-    def __init__(self, func_name, parameters, return_type):
+    def __init__(self, func_name, parameters, return_type, lineno=None):
         self.name = func_name
         self.parameters = parameters
         self.return_type = return_type
+        # calls go through a cache of results (a memo function)
+        self.memo = False
+        self.lineno = lineno
 
         self.code = []
+        # the source line of each instruction, None where there is none
+        self.lines = []
 
-    def append(self, ir_instruction):
+    def append(self, ir_instruction, lineno=None):
         self.code.append(ir_instruction)
+        self.lines.append(lineno)
 
     def __iter__(self):
         return self.code.__iter__()
@@ -59,6 +114,216 @@ class Function():
         return f"{self.name}({params}) -> {self.return_type}"
 
 
+class Pool():
+    '''
+    The names and constants of a program, each stored once.
+    '''
+    def __init__(self, values=()):
+        self.values = []
+        self.index = {}
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        # 1, 1.0 and -0.0, 0.0 compare equal but are different constants
+        key = (type(value), repr(value))
+        if key not in self.index:
+            self.index[key] = len(self.values)
+            self.values.append(value)
+        return self.index[key]
+
+
+class CompactFunction():
+    '''
+    A Function whose code is kept in parallel array('i') columns: the opcode
+    number and up to four operands per instruction. Registers and labels are
+    stored by number, names and constants as an index into a Pool shared by
+    the program. The arguments of a call go to their own column, which the
+    call's second and third operands point into. Source lines are 0 where
+    there are none.
+    '''
+    def __init__(self, func_name, parameters, return_type, pool, lineno=None):
+        self.name = func_name
+        self.parameters = parameters
+        self.return_type = return_type
+        self.memo = False
+        self.lineno = lineno
+        self.pool = pool
+
+        self.opcodes = array('i')
+        self.columns = tuple(array('i') for _ in range(4))
+        self.call_args = array('i')
+        self.lines = array('i')
+
+    def append(self, ir_instruction, lineno=None):
+        self.lines.append(lineno or 0)
+        opcode, *args = ir_instruction
+        if opcode == 'CALL':
+            start = len(self.call_args)
+            self.call_args.extend(int(reg[1:]) for reg in args[1:-1])
+            operands = [self.pool.add(args[0]), start, len(args) - 2, int(args[-1][1:])]
+        else:
+            operands = [int(arg[1:]) if kind in 'vrl' else self.pool.add(arg)
+                        for kind, arg in zip(operand_kinds(opcode, len(args)), args)]
+            operands += [0] * (4 - len(operands))
+
+        self.opcodes.append(OPCODE_NUMBERS[opcode])
+        for column, operand in zip(self.columns, operands):
+            column.append(operand)
+
+    def __iter__(self):
+        pool = self.pool.values
+        for n, number in enumerate(self.opcodes):
+            opcode = OPCODE_NAMES[number]
+            a, b, c, d = (column[n] for column in self.columns)
+            if opcode == 'CALL':
+                args = [f'R{reg}' for reg in self.call_args[b:b+c]]
+                yield (opcode, pool[a], *args, f'R{d}')
+                continue
+
+            kinds = operand_kinds(opcode, 0)
+            yield (opcode, *[f'R{operand}' if kind in 'vr' else
+                             f'L{operand}' if kind == 'l' else pool[operand]
+                             for kind, operand in zip(kinds, (a, b, c, d))])
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    @property
+    def code(self):
+        return list(self)
+
+    def __repr__(self):
+        params = [f"{pname}:{ptype}" for pname, ptype in self.parameters]
+        return f"{self.name}({params}) -> {self.return_type}"
+
+
+def encode(functions):
+    '''
+    Compact copies of the given functions, sharing one Pool.
+    '''
+    pool = Pool()
+    compact = []
+    for func in functions:
+        cfunc = CompactFunction(func.name, func.parameters, func.return_type, pool, func.lineno)
+        cfunc.memo = func.memo
+        for instruction, lineno in zip(func, func.lines):
+            cfunc.append(instruction, lineno)
+        compact.append(cfunc)
+    return compact
+
+# Binary IR files start with MAGIC and a format version, followed by the
+# opcode names, the pool and the functions. All numbers are little endian.
+MAGIC = b'PLIR'
+VERSION = 3
+
+def _write_string(file, value):
+    data = value.encode('utf-8')
+    file.write(struct.pack('<I', len(data)))
+    file.write(data)
+
+def _read_string(file):
+    size, = struct.unpack('<I', file.read(4))
+    return file.read(size).decode('utf-8')
+
+def _write_array(file, values):
+    if sys.byteorder == 'big':
+        values = array('i', values)
+        values.byteswap()
+    file.write(struct.pack('<I', len(values)))
+    values.tofile(file)
+
+def _read_array(file):
+    size, = struct.unpack('<I', file.read(4))
+    values = array('i')
+    values.fromfile(file, size)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def dump(functions, file):
+    '''
+    Write functions to a binary file opened for writing.
+    '''
+    functions = encode(functions)
+    pool = functions[0].pool if functions else Pool()
+
+    file.write(MAGIC + struct.pack('<I', VERSION))
+
+    file.write(struct.pack('<I', len(OPCODE_NAMES)))
+    for name in OPCODE_NAMES:
+        _write_string(file, name)
+
+    file.write(struct.pack('<I', len(pool.values)))
+    for value in pool.values:
+        if isinstance(value, str):
+            file.write(b's')
+            _write_string(file, value)
+        elif isinstance(value, float):
+            file.write(b'f' + struct.pack('<d', value))
+        else:
+            file.write(b'i' + struct.pack('<q', value))
+
+    file.write(struct.pack('<I', len(functions)))
+    for func in functions:
+        _write_string(file, func.name)
+        _write_string(file, func.return_type or '')
+        file.write(struct.pack('<I', func.memo))
+        file.write(struct.pack('<I', func.lineno or 0))
+        file.write(struct.pack('<I', len(func.parameters)))
+        for pname, ptype in func.parameters:
+            _write_string(file, pname)
+            _write_string(file, ptype)
+        for column in (func.opcodes, *func.columns, func.call_args, func.lines):
+            _write_array(file, column)
+
+def load(file):
+    '''
+    Read the functions from a binary file opened for reading, as
+    CompactFunctions.
+    '''
+    header = file.read(8)
+    if header[:4] != MAGIC:
+        raise ValueError('not a Pulse IR file')
+    version, = struct.unpack('<I', header[4:])
+    if version != VERSION:
+        raise ValueError(f'unsupported Pulse IR version {version}')
+
+    count, = struct.unpack('<I', file.read(4))
+    opcodes = array('i', [OPCODE_NUMBERS[_read_string(file)] for _ in range(count)])
+
+    pool = Pool()
+    count, = struct.unpack('<I', file.read(4))
+    for _ in range(count):
+        tag = file.read(1)
+        if tag == b's':
+            pool.add(_read_string(file))
+        elif tag == b'f':
+            pool.add(struct.unpack('<d', file.read(8))[0])
+        else:
+            pool.add(struct.unpack('<q', file.read(8))[0])
+
+    functions = []
+    count, = struct.unpack('<I', file.read(4))
+    for _ in range(count):
+        name = _read_string(file)
+        return_type = _read_string(file) or None
+        memo, lineno = struct.unpack('<II', file.read(8))
+        parameters = []
+        for _ in range(struct.unpack('<I', file.read(4))[0]):
+            parameters.append((_read_string(file), _read_string(file)))
+
+        func = CompactFunction(name, parameters, return_type, pool, lineno or None)
+        func.memo = bool(memo)
+        func.opcodes = array('i', [opcodes[number] for number in _read_array(file)])
+        func.columns = tuple(_read_array(file) for _ in range(4))
+        func.call_args = _read_array(file)
+        func.lines = _read_array(file)
+        functions.append(func)
+
+    return functions
+
+
 class GenerateCode(ast.NodeVisitor):
     def __init__(self):
         self.register_count = 0
@@ -69,10 +334,18 @@ class GenerateCode(ast.NodeVisitor):
 
         self.functions = [ init_function ]
 
+        self.function = init_function
+
         self.code = init_function.code
 
         self.global_scope = True
 
+    def visit(self, node):
+        super().visit(node)
+        # the code has no source lines, unless a subclass filled them in
+        for func in self.functions:
+            func.lines.extend([None] * (len(func.code) - len(func.lines)))
+
     def new_register(self):
          self.register_count += 1
          return f'R{self.register_count}'
@@ -108,8 +381,12 @@ class GenerateCode(ast.NodeVisitor):
         node.register = target
 
     def visit_BinOp(self, node):
-        self.visit(node.left)
-        self.visit(node.right)
+        if node.op in ('&&', '||'):
+            yield from self.short_circuit(node)
+            return
+
+        yield node.left
+        yield node.right
         operator = node.op
 
         op_code = get_op_code(operator, node.left.type.name)
@@ -123,8 +400,54 @@ class GenerateCode(ast.NodeVisitor):
         self.code.append(inst)
         node.register = target
 
+    def short_circuit(self, node):
+        '''
+        The value of a && b or a || b, evaluating b only when a does not
+        decide it. The two ways to the result meet at a local variable.
+        '''
+        right_label = self.new_label()
+        merge_label = self.new_label()
+        result = f'{node.op}.{merge_label}'
+
+        self.code.append((get_op_code('alloc', 'bool'), result))
+        yield node.left
+        self.code.append((get_op_code('store', 'bool'), node.left.register, result))
+        if node.op == '&&':
+            self.code.append((get_op_code('cbranch'), node.left.register, right_label, merge_label))
+        else:
+            self.code.append((get_op_code('cbranch'), node.left.register, merge_label, right_label))
+
+        self.code.append((get_op_code('label'), right_label))
+        yield node.right
+        self.code.append((get_op_code('store', 'bool'), node.right.register, result))
+        self.code.append((get_op_code('branch'), merge_label))
+
+        self.code.append((get_op_code('label'), merge_label))
+        target = self.new_register()
+        self.code.append((get_op_code('load', 'bool'), result, target))
+        node.register = target
+
+    def branch_on(self, node, true_label, false_label):
+        '''
+        Branch to true_label or false_label on a condition. &&, || and !
+        become jumps instead of values.
+        '''
+        if isinstance(node, ast.BinOp) and node.op in ('&&', '||'):
+            right_label = self.new_label()
+            if node.op == '&&':
+                yield from self.branch_on(node.left, right_label, false_label)
+            else:
+                yield from self.branch_on(node.left, true_label, right_label)
+            self.code.append((get_op_code('label'), right_label))
+            yield from self.branch_on(node.right, true_label, false_label)
+        elif isinstance(node, ast.UnaryOp) and node.op == '!':
+            yield from self.branch_on(node.right, false_label, true_label)
+        else:
+            yield node
+            self.code.append((get_op_code('cbranch'), node.register, true_label, false_label))
+
     def visit_UnaryOp(self, node):
-        self.visit(node.right)
+        yield node.right
         operator = node.op
 
         if operator == "-":
@@ -153,7 +476,7 @@ class GenerateCode(ast.NodeVisitor):
             node.register = node.right.register
 
     def visit_PrintStatement(self, node):
-        self.visit(node.value)
+        yield node.value
         op_code = get_op_code('print', node.value.type.name)
         inst = (op_code, node.value.register)
         self.code.append(inst)
@@ -166,13 +489,13 @@ class GenerateCode(ast.NodeVisitor):
         node.register = register
 
     def visit_WriteLocation(self, node):
-        self.visit(node.value)
+        yield node.value
         op_code = get_op_code('store', node.location.type.name)
         inst = (op_code, node.value.register, node.location.name)
         self.code.append(inst)
 
     def visit_ConstDeclaration(self, node):
-        self.visit(node.value)
+        yield node.value
 
         op_code = get_op_code('var', node.type.name)
         inst = (op_code, node.name)
@@ -183,13 +506,13 @@ class GenerateCode(ast.NodeVisitor):
         self.code.append(inst)
 
     def visit_VarDeclaration(self, node):
-        self.visit(node.datatype)
+        yield node.datatype
 
         op_code = get_op_code('var' if self.global_scope else 'alloc', node.type.name)
         def_inst = (op_code, node.name)
 
         if node.value:
-            self.visit(node.value)
+            yield node.value
             self.code.append(def_inst)
             op_code = get_op_code('store', node.type.name)
             inst = (op_code, node.value.register, node.name)
@@ -198,25 +521,22 @@ class GenerateCode(ast.NodeVisitor):
             self.code.append(def_inst)
 
     def visit_IfStatement(self, node):
-        self.visit(node.condition)
-
         f_label = self.new_label()
         t_label = self.new_label()
         merge_label = self.new_label()
         lbl_op_code = get_op_code('label')
 
-        cbranch_op_code = get_op_code('cbranch')
-        self.code.append((cbranch_op_code, node.condition.register, t_label, f_label))
+        yield from self.branch_on(node.condition, t_label, f_label)
 
         self.code.append((lbl_op_code, t_label))
-        self.visit(node.true_block)
+        yield node.true_block
 
         branch_op_code = get_op_code('branch')
         self.code.append((branch_op_code, merge_label))
 
 
         self.code.append((lbl_op_code, f_label))
-        self.visit(node.false_block)
+        yield node.false_block
         self.code.append((branch_op_code, merge_label))
 
         self.code.append((lbl_op_code, merge_label))
@@ -231,12 +551,10 @@ class GenerateCode(ast.NodeVisitor):
 
         self.code.append((branch_op_code, top_label))
         self.code.append((lbl_op_code, top_label))
-        self.visit(node.condition)
-        cbranch_op_code = get_op_code('cbranch')
-        self.code.append((cbranch_op_code, node.condition.register, start_label, merge_label))
+        yield from self.branch_on(node.condition, start_label, merge_label)
 
         self.code.append((lbl_op_code, start_label))
-        self.visit(node.body)
+        yield node.body
 
         self.code.append((branch_op_code, top_label))
 
@@ -246,23 +564,27 @@ class GenerateCode(ast.NodeVisitor):
         func = Function(node.name,
                         [(p.name, IR_TYPE_MAPPING[p.datatype.type.name])
                          for p in node.params],
-                        IR_TYPE_MAPPING[node.datatype.type.name])
+                        IR_TYPE_MAPPING[node.datatype.type.name],
+                        node.lineno)
+        func.memo = node.memo
         self.functions.append(func)
 
         if func.name == "main":
             func.name = "__pulse_main"
 
-        old_code = self.code
+        old_function = self.function
+        self.function = func
         self.code = func.code
 
         self.global_scope = False
-        self.visit(node.body)
+        yield node.body
         self.global_scope = True
 
-        self.code = old_code
+        self.function = old_function
+        self.code = old_function.code
 
     def visit_FuncCall(self, node):
-        self.visit(node.arguments)
+        yield node.arguments
         target = self.new_register()
         op_code = get_op_code('call')
         registers = [arg.register for arg in node.arguments]
@@ -270,35 +592,83 @@ class GenerateCode(ast.NodeVisitor):
         node.register = target
 
     def visit_ReturnStatement(self, node):
-        self.visit(node.value)
+        yield node.value
         op_code = get_op_code('ret')
         self.code.append((op_code, node.value.register))
         node.register = node.value.register
 
 
-def compile_ircode(source):
+class GenerateCodeWithLines(GenerateCode):
+    '''
+    GenerateCode recording the source line of each instruction, for debug
+    info. Each step of a visit_ method gives what it emitted the line of its
+    node, or of the closest one above with a line. That costs an extra call
+    on every visit, so plain GenerateCode does not.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.lineno = None
+
+    @classmethod
+    def resolve(cls, node_cls):
+        visitor = super().resolve(node_cls)
+
+        def visit(self, node):
+            lineno = self.lineno if node.lineno is None else node.lineno
+            self.lineno = lineno
+            children = visitor(self, node)
+            if isinstance(children, GeneratorType):
+                return self.at_line(children, lineno)
+            self.mark(lineno)
+            return children
+        return visit
+
+    def at_line(self, visitor, lineno):
+        '''
+        Run the rest of a generator visit_ method, back at its node's line
+        each time it is resumed after its children.
+        '''
+        while True:
+            self.lineno = lineno
+            try:
+                child = next(visitor)
+            except StopIteration:
+                self.mark(lineno)
+                return
+            self.mark(lineno)
+            yield child
+
+    def mark(self, lineno):
+        lines = self.function.lines
+        lines.extend([lineno] * (len(self.function.code) - len(lines)))
+
+
+def compile_ircode(source, jobs=1, lines=False):
     from parser import parse
     from validator import check_program
     from error import errors_reported
 
     ast = parse(source)
-    check_program(ast)
+    check_program(ast, jobs)
 
     if not errors_reported():
-        gen = GenerateCode()
+        gen = GenerateCodeWithLines() if lines else GenerateCode()
         gen.visit(ast)
         return gen.functions
     else:
         return []
 
 def main():
-    import sys
-
-    if len(sys.argv) != 2:
+    if len(sys.argv) not in (2, 4) or (len(sys.argv) == 4 and sys.argv[2] != '-o'):
         raise SystemExit(1)
 
-    source = open(sys.argv[1]).read()
-    code = compile_ircode(source)
+    with open(sys.argv[1]) as source:
+        code = compile_ircode(source)
+
+    if len(sys.argv) == 4:
+        with open(sys.argv[3], 'wb') as file:
+            dump(code, file)
+        return
 
     for f in code :
         print(f'{"::"*5} {f} {"::"*5}')
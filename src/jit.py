@@ -0,0 +1,98 @@
+# Pulse JIT - compiles a program in memory with llvmlite's MCJIT and runs it
+# against the runtime in pulsert.so, with no executable or process involved
+
+import ctypes
+import os
+import sys
+
+import llvmlite.binding as binding
+
+from llvm import native_target, parse_llvm
+from compile import prebuilt
+
+_rtshared = os.path.join(os.path.dirname(__file__), 'pulsert.so')
+
+def runtime_library():
+    return prebuilt(_rtshared, '-shared')
+
+def write_perf_map(engine, module, objects):
+    '''
+    Add the JIT compiled functions to /tmp/perf-<pid>.map, where perf looks
+    for the symbols of code that is in no file. MCJIT does not tell their
+    sizes, so each is taken to run up to the next, and the last to the end
+    of the code in objects.
+    '''
+    code_size = sum(section.size() for obj in objects
+                    for section in binding.ObjectFileRef.from_data(obj).sections() if section.is_text())
+    addresses = sorted((engine.get_function_address(func.name), func.name)
+                       for func in module.functions if not func.is_declaration)
+    addresses = [(address, name) for address, name in addresses if address]
+    if not addresses:
+        return
+
+    ends = [address for address, _ in addresses[1:]] + [addresses[0][0] + code_size]
+    with open(f'/tmp/perf-{os.getpid()}.map', 'a') as f:
+        for (address, name), end in zip(addresses, ends):
+            f.write(f'{address:x} {max(end - address, 1):x} {name}\n')
+
+def run_jit(llvm_code, llvm_opt_level=0, target=None, perf_map=False):
+    '''
+    Compile LLVM IR text to machine code in this process, run __pulse_init
+    and then __pulse_main, and return main's result. What the program
+    printed is flushed out of the runtime's buffer and C stdio on return,
+    and the profile of a program compiled with timing is printed. With
+    perf_map, the code is listed in /tmp/perf-<pid>.map for perf.
+    '''
+    runtime = runtime_library()
+    binding.load_library_permanently(runtime)
+
+    machine = native_target(llvm_opt_level, target)
+    module = parse_llvm(llvm_code, machine)
+    engine = binding.create_mcjit_compiler(module, machine)
+    objects = []
+    if perf_map:
+        engine.set_object_cache(lambda module, buffer: objects.append(buffer))
+    engine.finalize_object()
+    engine.run_static_constructors()
+    if perf_map:
+        write_perf_map(engine, module, objects)
+
+    init = ctypes.CFUNCTYPE(None)(engine.get_function_address('__pulse_init'))
+    main = ctypes.CFUNCTYPE(ctypes.c_int)(engine.get_function_address('__pulse_main'))
+
+    sys.stdout.flush()
+    init()
+    status = main()
+    ctypes.CDLL(runtime)._output_flush()
+    # before the engine, and the counters in it, go away
+    ctypes.CDLL(runtime)._timing_report()
+    ctypes.CDLL(None).fflush(None)
+    return status
+
+def main():
+    import argparse
+    from llvm import compile_llvm, show_remarks, LLVM_OPT_LEVELS
+    from optimize import split_level
+    from error import errors_reported
+    from target import add_target_arguments, target_options
+
+    parser = argparse.ArgumentParser(prog='jit.py')
+    parser.add_argument('filename')
+    parser.add_argument('-O', dest='level', type=int, default=0, choices=LLVM_OPT_LEVELS,
+                        help='optimization level of the Pulse IR passes and LLVM')
+    add_target_arguments(parser)
+    args = parser.parse_args()
+    opt_level, llvm_opt_level = split_level(args.level)
+    target = target_options(args)
+    if args.remarks:
+        show_remarks(args.remarks)
+
+    with open(args.filename) as source:
+        llvm_code = compile_llvm(source, opt_level=opt_level, llvm_opt_level=llvm_opt_level,
+                                 target=target)
+    if errors_reported():
+        raise SystemExit(1)
+    raise SystemExit(run_jit(llvm_code, llvm_opt_level, target) & 0xFF)
+
+if __name__ == '__main__':
+    main()
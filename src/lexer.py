@@ -1,11 +1,15 @@
 # Pulse tokenizer / lexer
 
+import os
+import mmap
+import codecs
+from sly.lex import Token
 from error import error
-from sly import Lexer
+from cache import CachedLexer
 
-class PulseLexer(Lexer):
+class PulseLexer(CachedLexer):
     tokens = {
-        'PRINT', 'CONST', 'ELSE', 'EXTERN', 'FUNCTION', 'IF', 'RETURN', 'WHILE', 'VAR',
+        'PRINT', 'CONST', 'ELSE', 'EXTERN', 'FUNCTION', 'IF', 'MEMO', 'RETURN', 'WHILE', 'VAR',
         'ID',
         'INTEGER', 'FLOAT', 'CHAR', 'BOOL',
         'PLUS', 'MINUS', 'TIMES', 'DIVIDE', 'ASSIGN', 'SEMI', 'COMA',
@@ -67,6 +71,7 @@ class PulseLexer(Lexer):
             'extern',
             'function',
             'if',
+            'memo',
             'print',
             'return',
             'while',
@@ -80,6 +85,93 @@ class PulseLexer(Lexer):
         error(self.lineno,"Illegal character %r" % t.value[0])
         self.index += 1
 
+    def tokenize_stream(self, stream, lineno=1, chunk_size=1 << 16):
+        '''
+        Lazily tokenize anything with a read(n) method returning str or
+        (utf-8) bytes. Only complete lines, plus any block comment still
+        open at the end of them, are kept in memory.
+        '''
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        master_re = self._master_re
+        ignore = self.ignore
+        token_funcs = self._token_funcs
+        ignored_tokens = self._ignored_tokens
+
+        buf = ''
+        base = 0
+        index = 0
+        # buf[:lines] is the whole lines read so far
+        lines = 0
+        eof = False
+        while True:
+            # no token but BLOCK_COMMENT and NEWLINE crosses a line, so a
+            # match against a buffer of whole lines is the same as against
+            # the whole file
+            while not eof and (index >= lines or
+                               (buf.startswith('/*', index) and buf.find('*/', index + 2) < 0)):
+                data = stream.read(chunk_size)
+                eof = not data
+                if isinstance(data, bytes):
+                    data = decoder.decode(data, eof)
+                base += index
+                buf = buf[index:] + data
+                lines = max(lines - index, 0)
+                index = 0
+                end = data.rfind('\n')
+                if end >= 0:
+                    lines = len(buf) - len(data) + end + 1
+
+            if index >= len(buf):
+                break
+
+            if buf[index] in ignore:
+                index += 1
+                continue
+
+            tok = Token()
+            tok.lineno = lineno
+            tok.index = base + index
+            m = master_re.match(buf, index)
+            if m:
+                index = m.end()
+                tok.end = base + index
+                tok.value = m.group()
+                tok.type = m.lastgroup
+
+                if tok.type in token_funcs:
+                    self.text = buf
+                    self.index = index
+                    self.lineno = lineno
+                    tok = token_funcs[tok.type](self, tok)
+                    index = self.index
+                    lineno = self.lineno
+                    if not tok:
+                        continue
+
+                if tok.type in ignored_tokens:
+                    continue
+
+                yield tok
+            else:
+                self.text = buf
+                self.index = index
+                self.lineno = lineno
+                tok.type = 'ERROR'
+                tok.value = buf[index:]
+                self.error(tok)
+                index = self.index
+                lineno = self.lineno
+
+        self.index = base + index
+        self.lineno = lineno
+
+    def tokenize_file(self, filename, lineno=1):
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as source:
+                yield from self.tokenize_stream(source, lineno)
+
 def main():
     import sys
 
@@ -87,8 +179,7 @@ def main():
         raise SystemExit(1)
 
     lexer = PulseLexer()
-    text = open(sys.argv[1]).read()
-    for tok in lexer.tokenize(text):
+    for tok in lexer.tokenize_file(sys.argv[1]):
         print(tok)
 
 if __name__ == '__main__':
@@ -1,16 +1,24 @@
 # Pulse llvmgen -> turns intermediate code to llvm ir
+import os.path
 from collections import ChainMap
 from functools import partialmethod
 
+import llvmlite.binding as binding
 from llvmlite.ir import (
     Module, IRBuilder, Function, IntType, DoubleType, VoidType, Constant,
-    GlobalVariable, FunctionType
+    GlobalVariable, FunctionType, PointerType, ArrayType, DIToken
     )
 
+from purity import MEMO_SIZE
+from optimize import split_level
+from target import TargetOptions, add_target_arguments, target_options
+
 
 int_type    = IntType(32)         # 32-bit integer
 float_type  = DoubleType()        # 64-bit float
 byte_type   = IntType(8)          # 8-bit integer
+word_type   = IntType(64)         # memo cache keys and values
+cache_type  = PointerType(PointerType(byte_type))
 
 void_type   = VoidType()          # Void type.  This is a special type
                                   # used for internal functions returning
@@ -23,13 +31,49 @@ LLVM_TYPE_MAPPING = {
     None: void_type
 }
 
+# when the runtime writes out what the program prints: once its buffer is
+# full, also at each newline, or after every print
+OUTPUT_POLICIES = ['full', 'line', 'explicit']
+
+def llvm_function_type(function):
+    return FunctionType(
+        LLVM_TYPE_MAPPING[function.return_type],
+        [LLVM_TYPE_MAPPING[ptype] for _, ptype in function.parameters]
+    )
+
 class GenerateLLVM(object):
-    def __init__(self):
+    def __init__(self, memo_size=MEMO_SIZE, pgo=None, buffering=None, timing=None, debug=None):
         self.module = Module('module')
         self.globals = { }
-        self.blocks = { }
+        self.memo_size = memo_size
+        # the output policy __pulse_init starts the runtime with, None to
+        # leave it to the runtime
+        self.buffering = buffering
         self.declare_runtime_library()
 
+        # profile-guided optimization (a pgo.PGO): counters to instrument the
+        # code with, or a profile whose counts annotate it
+        self.pgo = pgo
+        if pgo is not None and pgo.instrument:
+            counters_type = ArrayType(word_type, pgo.layout.size)
+            self.counters = GlobalVariable(self.module, counters_type, name='__pulse_profile')
+            self.counters.initializer = Constant(counters_type, None)
+        elif pgo is not None:
+            self.add_profile_summary()
+
+        # --profile: the names of the program's functions, in the order of
+        # their counters (calls, self time, total time, active calls)
+        self.timing = timing
+        if timing is not None:
+            counters_type = ArrayType(word_type, 4 * len(timing))
+            self.timing_counters = GlobalVariable(self.module, counters_type, name='__pulse_timing')
+            self.timing_counters.initializer = Constant(counters_type, None)
+
+        # -g: the path of the source, whose lines the code is annotated with
+        self.debug = debug
+        if debug is not None:
+            self.add_debug_unit(debug)
+
 
     def declare_runtime_library(self):
         self.runtime = {}
@@ -46,18 +90,139 @@ class GenerateLLVM(object):
                                                 FunctionType(void_type, [byte_type]),
                                                 name="_print_byte")
 
-    def generate_code(self, ir_function):
-        self.function = Function(self.module,
-                                 FunctionType(
-                                     LLVM_TYPE_MAPPING[ir_function.return_type],
-                                     [LLVM_TYPE_MAPPING[ptype] for _, ptype in ir_function.parameters]
-                                 ),
-                                 name=ir_function.name)
-
-        self.block = self.function.append_basic_block('entry')
+        memo_args = [cache_type, int_type, int_type, PointerType(word_type)]
+        self.runtime['_memo_lookup'] = Function(self.module,
+                                                FunctionType(int_type, memo_args + [PointerType(word_type)]),
+                                                name="_memo_lookup")
+
+        self.runtime['_memo_store'] = Function(self.module,
+                                               FunctionType(void_type, memo_args + [word_type]),
+                                               name="_memo_store")
+
+        self.runtime['_division_trap'] = Function(self.module,
+                                                  FunctionType(void_type, []),
+                                                  name="_division_trap")
+        self.runtime['_division_trap'].attributes.add('noreturn')
+        self.runtime['_division_trap'].attributes.add('cold')
+
+        self.runtime['_output_start'] = Function(self.module,
+                                                 FunctionType(void_type, [int_type]),
+                                                 name="_output_start")
+
+        profile_args = [PointerType(byte_type), word_type, PointerType(word_type), int_type]
+        self.runtime['_profile_start'] = Function(self.module,
+                                                  FunctionType(void_type, profile_args),
+                                                  name="_profile_start")
+
+        timing_args = [PointerType(PointerType(byte_type)), PointerType(word_type), int_type]
+        self.runtime['_timing_start'] = Function(self.module,
+                                                 FunctionType(void_type, timing_args),
+                                                 name="_timing_start")
+
+        self.runtime['_timing_enter'] = Function(self.module,
+                                                 FunctionType(word_type, [int_type]),
+                                                 name="_timing_enter")
+
+        self.runtime['_timing_exit'] = Function(self.module,
+                                                FunctionType(void_type, [int_type, word_type]),
+                                                name="_timing_exit")
+
+    def add_profile_summary(self):
+        '''
+        The ProfileSummary module flag, which is what lets LLVM tell hot and
+        cold code apart from the counts, for inlining and block layout.
+        '''
+        fields, detailed = self.pgo.summary()
+        summary = [self.module.add_metadata(['ProfileFormat', 'InstrProf'])]
+        for name, value in fields:
+            summary.append(self.module.add_metadata([name, Constant(word_type, value)]))
+        cutoffs = [self.module.add_metadata([Constant(int_type, cutoff), Constant(word_type, count),
+                                             Constant(int_type, number)])
+                   for cutoff, count, number in detailed]
+        summary.append(self.module.add_metadata(['DetailedSummary', self.module.add_metadata(cutoffs)]))
+        self.module.add_named_metadata('llvm.module.flags', [
+            Constant(int_type, 1), 'ProfileSummary', self.module.add_metadata(summary)])
+
+    def add_debug_unit(self, path):
+        '''
+        The DWARF compile unit of the module, which each function's
+        subprogram and so each line points back to.
+        '''
+        directory, filename = os.path.split(os.path.abspath(path))
+        self.debug_file = self.module.add_debug_info('DIFile', {
+            'filename': filename, 'directory': directory})
+        # DWARF has no language code for Pulse
+        self.debug_unit = self.module.add_debug_info('DICompileUnit', {
+            'language': DIToken('DW_LANG_C'), 'file': self.debug_file, 'producer': 'pulsec',
+            'runtimeVersion': 0, 'emissionKind': DIToken('FullDebug')}, is_distinct=True)
+        self.debug_type = self.module.add_debug_info('DISubroutineType', {
+            'types': self.module.add_metadata([])})
+        self.module.add_named_metadata('llvm.dbg.cu', self.debug_unit)
+        self.module.add_named_metadata('llvm.module.flags', [
+            Constant(int_type, 2), 'Debug Info Version', Constant(int_type, 3)])
+        self.module.add_named_metadata('llvm.module.flags', [
+            Constant(int_type, 7), 'Dwarf Version', Constant(int_type, 4)])
+
+    def debug_function(self, cfg_function):
+        '''
+        Attach a subprogram to the function being generated, and start its
+        code at the line it is declared on.
+        '''
+        lineno = cfg_function.lineno or 0
+        self.subprogram = self.module.add_debug_info('DISubprogram', {
+            'name': cfg_function.name, 'scope': self.debug_file, 'file': self.debug_file,
+            'line': lineno, 'type': self.debug_type, 'scopeLine': lineno,
+            'spFlags': DIToken('DISPFlagDefinition'), 'unit': self.debug_unit}, is_distinct=True)
+        self.function.set_metadata('dbg', self.subprogram)
+        self.locations = {}
+        self.debug_line(lineno)
+
+    def debug_line(self, lineno):
+        if lineno not in self.locations:
+            self.locations[lineno] = self.module.add_debug_info('DILocation', {
+                'line': lineno, 'column': 0, 'scope': self.subprogram})
+        self.builder.debug_metadata = self.locations[lineno]
+
+    def count(self, index):
+        counter = self.builder.gep(self.counters, [Constant(int_type, 0), index])
+        self.builder.store(self.builder.add(self.builder.load(counter), Constant(word_type, 1)), counter)
+
+    def declare_function(self, function):
+        '''
+        Declare a function some other module defines, for calls to it.
+        '''
+        self.globals[function.name] = Function(self.module, llvm_function_type(function),
+                                               name=function.name)
+
+    def declare_globals(self, init_function):
+        '''
+        Declare the global variables another module's init function (in IR
+        tuple form) defines.
+        '''
+        for opcode, *args in init_function:
+            if opcode.startswith('VAR'):
+                self.globals[args[0]] = GlobalVariable(self.module, LLVM_TYPE_MAPPING[opcode[-1]],
+                                                       name=args[0])
+        if self.pgo is not None and self.pgo.instrument:
+            self.counters.initializer = None
+        if self.timing is not None:
+            self.timing_counters.initializer = None
+
+    def generate_code(self, cfg_function):
+        function_type = llvm_function_type(cfg_function)
+
+        if cfg_function.memo:
+            # every caller, the function itself included, goes through the cache
+            self.function = Function(self.module, function_type, name=cfg_function.name + '.body')
+            self.globals[cfg_function.name] = self.memoize(cfg_function, function_type, self.function)
+        else:
+            self.function = Function(self.module, function_type, name=cfg_function.name)
+            self.globals[cfg_function.name] = self.function
+
+        self.block = self.entry = self.function.append_basic_block('entry')
         self.builder = IRBuilder(self.block)
-
-        self.globals[ir_function.name] = self.function
+        if self.debug is not None:
+            self.debug_function(cfg_function)
 
         self.locals = { }
 
@@ -65,34 +230,149 @@ class GenerateLLVM(object):
 
         self.temps = { }
 
-        for n, (pname, ptype) in enumerate(ir_function.parameters):
+        for n, (pname, ptype) in enumerate(cfg_function.parameters):
             self.vars[pname] = self.builder.alloca(LLVM_TYPE_MAPPING[ptype], name=pname)
             self.builder.store(self.function.args[n], self.vars[pname])
 
-        if ir_function.return_type:
+        if cfg_function.return_type:
             self.vars['return'] = self.builder.alloca(
-                LLVM_TYPE_MAPPING[ir_function.return_type], name='return')
+                LLVM_TYPE_MAPPING[cfg_function.return_type], name='return')
         self.return_block = self.function.append_basic_block('return')
 
-        for opcode, *args in ir_function.code:
-            if hasattr(self, 'emit_'+opcode):
-                getattr(self, 'emit_'+opcode)(*args)
-            else:
-                print('Warning: No emit_'+opcode+'() method')
-
-        if not self.block.is_terminated:
-            self.builder.branch(self.return_block)
+        self.name = cfg_function.name
+        self.branches = 0
+        if self.name == '__pulse_init':
+            policy = OUTPUT_POLICIES.index(self.buffering) if self.buffering else -1
+            self.builder.call(self.runtime['_output_start'], [Constant(int_type, policy)])
+        if self.pgo is not None:
+            self.profile_entry()
+        if self.timing is not None:
+            self.timing_entry()
+
+        self.blocks = {cfg_function.entry: self.block}
+        for block in cfg_function:
+            self.block = self.get_block(block)
+            self.builder.position_at_end(self.block)
+
+            for inst in block:
+                if self.debug is not None and inst.lineno is not None:
+                    self.debug_line(inst.lineno)
+                if hasattr(self, 'emit_'+inst.opcode):
+                    getattr(self, 'emit_'+inst.opcode)(*inst.arguments)
+                else:
+                    print('Warning: No emit_'+inst.opcode+'() method')
+
+            if not self.block.is_terminated:
+                self.builder.branch(self.return_block)
 
         self.builder.position_at_end(self.return_block)
+        if self.timing is not None:
+            self.builder.call(self.runtime['_timing_exit'], [self.timing_index, self.timing_start])
         self.builder.ret(self.builder.load(self.vars['return'], 'return'))
 
-    def get_block(self, block_name):
-        block = self.blocks.get(block_name)
-        if block is None:
-            block = self.function.append_basic_block(block_name)
-            self.blocks[block_name] = block
-
-        return block
+    def profile_entry(self):
+        offset = self.pgo.layout.offsets[self.name]
+        if not self.pgo.instrument:
+            self.function.set_metadata('prof', self.module.add_metadata([
+                'function_entry_count', Constant(word_type, self.pgo.entry_count(self.name))]))
+            return
+
+        if self.name == '__pulse_init':
+            path = self.pgo.path.encode('utf-8') + b'\0'
+            path_type = ArrayType(byte_type, len(path))
+            path_var = GlobalVariable(self.module, path_type, name='__pulse_profile.path')
+            path_var.initializer = Constant(path_type, bytearray(path))
+            path_var.global_constant = True
+            zero = Constant(int_type, 0)
+            self.builder.call(self.runtime['_profile_start'], [
+                self.builder.gep(path_var, [zero, zero]),
+                Constant(word_type, self.pgo.layout.checksum),
+                self.builder.gep(self.counters, [zero, zero]),
+                Constant(int_type, self.pgo.layout.size)])
+        self.count(Constant(int_type, offset))
+
+    def timing_entry(self):
+        '''
+        Start timing a call of the function. __pulse_init first hands the
+        runtime the counters and the names to report them under.
+        '''
+        zero = Constant(int_type, 0)
+        if self.name == '__pulse_init':
+            names = []
+            for n, name in enumerate(self.timing):
+                text = name.encode('utf-8') + b'\0'
+                text_type = ArrayType(byte_type, len(text))
+                text_var = GlobalVariable(self.module, text_type, name=f'__pulse_timing.name.{n}')
+                text_var.initializer = Constant(text_type, bytearray(text))
+                text_var.global_constant = True
+                names.append(text_var.gep([zero, zero]))
+            names_type = ArrayType(PointerType(byte_type), len(names))
+            names_var = GlobalVariable(self.module, names_type, name='__pulse_timing.names')
+            names_var.initializer = Constant(names_type, names)
+            names_var.global_constant = True
+            self.builder.call(self.runtime['_timing_start'], [
+                self.builder.gep(names_var, [zero, zero]),
+                self.builder.gep(self.timing_counters, [zero, zero]),
+                Constant(int_type, len(self.timing))])
+
+        self.timing_index = Constant(int_type, self.timing.index(self.name))
+        self.timing_start = self.builder.call(self.runtime['_timing_enter'], [self.timing_index])
+
+    def memoize(self, cfg_function, function_type, body):
+        '''
+        A function looking up its arguments in a cache of results, and only
+        calling body for ones it has not seen.
+        '''
+        cache = GlobalVariable(self.module, cache_type.pointee, name=cfg_function.name + '.cache')
+        cache.initializer = Constant(cache_type.pointee, None)
+
+        function = Function(self.module, function_type, name=cfg_function.name)
+        builder = IRBuilder(function.append_basic_block('entry'))
+
+        count = len(cfg_function.parameters)
+        key = builder.alloca(ArrayType(word_type, count), name='key')
+        value = builder.alloca(word_type, name='value')
+        zero = Constant(int_type, 0)
+        for n, (arg, (_, ptype)) in enumerate(zip(function.args, cfg_function.parameters)):
+            slot = builder.gep(key, [zero, Constant(int_type, n)])
+            if ptype == 'F':
+                builder.store(builder.bitcast(arg, word_type), slot)
+            else:
+                builder.store(builder.sext(arg, word_type), slot)
+
+        args = [cache, Constant(int_type, self.memo_size), Constant(int_type, count),
+                builder.gep(key, [zero, zero])]
+        found = builder.call(self.runtime['_memo_lookup'], args + [value])
+
+        hit = function.append_basic_block('hit')
+        miss = function.append_basic_block('miss')
+        builder.cbranch(builder.icmp_signed('!=', found, zero), hit, miss)
+
+        return_type = LLVM_TYPE_MAPPING[cfg_function.return_type]
+        builder.position_at_end(hit)
+        cached = builder.load(value)
+        if cfg_function.return_type == 'F':
+            builder.ret(builder.bitcast(cached, return_type))
+        else:
+            builder.ret(builder.trunc(cached, return_type))
+
+        builder.position_at_end(miss)
+        result = builder.call(body, function.args)
+        if cfg_function.return_type == 'F':
+            builder.call(self.runtime['_memo_store'], args + [builder.bitcast(result, word_type)])
+        else:
+            builder.call(self.runtime['_memo_store'], args + [builder.sext(result, word_type)])
+        builder.ret(result)
+
+        return function
+
+    def get_block(self, block):
+        llvm_block = self.blocks.get(block)
+        if llvm_block is None:
+            llvm_block = self.function.append_basic_block(block.label)
+            self.blocks[block] = llvm_block
+
+        return llvm_block
 
     def emit_MOV(self, value, target, val_type):
         self.temps[target] = Constant(val_type, value)
@@ -111,14 +391,20 @@ class GenerateLLVM(object):
     emit_VARB = partialmethod(emit_VAR, var_type=byte_type)
 
     def emit_ALLOC(self, name, var_type):
-        self.locals[name] = self.builder.alloca(var_type, name=name)
+        # variables live in the entry block, so that a loop declaring one
+        # does not grow the stack on every iteration
+        builder = self.builder
+        if self.block is not self.entry:
+            builder = IRBuilder()
+            builder.position_at_start(self.entry)
+        self.locals[name] = builder.alloca(var_type, name=name)
 
     emit_ALLOCI = partialmethod(emit_ALLOC, var_type=int_type)
     emit_ALLOCF = partialmethod(emit_ALLOC, var_type=float_type)
     emit_ALLOCB = partialmethod(emit_ALLOC, var_type=byte_type)
 
     def emit_LOADI(self, name, target):
-        self.temps[target] = self.builder.load(self.vars[name], name=target)
+        self.temps[target] = self.builder.load(self.vars[name], name=target.name)
 
     emit_LOADF = emit_LOADI
     emit_LOADB = emit_LOADI
@@ -130,28 +416,38 @@ class GenerateLLVM(object):
     emit_STOREB = emit_STOREI
 
     def emit_ADDI(self, left, right, target):
-        self.temps[target] = self.builder.add(self.temps[left], self.temps[right], name=target)
+        self.temps[target] = self.builder.add(self.temps[left], self.temps[right], name=target.name)
 
     def emit_ADDF(self, left, right, target):
-        self.temps[target] = self.builder.fadd(self.temps[left], self.temps[right], name=target)
+        self.temps[target] = self.builder.fadd(self.temps[left], self.temps[right], name=target.name)
 
     def emit_SUBI(self, left, right, target):
-        self.temps[target] = self.builder.sub(self.temps[left], self.temps[right], name=target)
+        self.temps[target] = self.builder.sub(self.temps[left], self.temps[right], name=target.name)
 
     def emit_SUBF(self, left, right, target):
-        self.temps[target] = self.builder.fsub(self.temps[left], self.temps[right], name=target)
+        self.temps[target] = self.builder.fsub(self.temps[left], self.temps[right], name=target.name)
 
     def emit_MULI(self, left, right, target):
-        self.temps[target] = self.builder.mul(self.temps[left], self.temps[right], name=target)
+        self.temps[target] = self.builder.mul(self.temps[left], self.temps[right], name=target.name)
 
     def emit_MULF(self, left, right, target):
-        self.temps[target] = self.builder.fmul(self.temps[left], self.temps[right], name=target)
+        self.temps[target] = self.builder.fmul(self.temps[left], self.temps[right], name=target.name)
 
     def emit_DIVI(self, left, right, target):
-        self.temps[target] = self.builder.sdiv(self.temps[left], self.temps[right], name=target)
+        # sdiv by zero or of INT_MIN by -1 is undefined to LLVM, so trap on
+        # those before it can optimize on the assumption they never happen
+        left, right = self.temps[left], self.temps[right]
+        zero = self.builder.icmp_signed('==', right, Constant(int_type, 0))
+        overflow = self.builder.and_(self.builder.icmp_signed('==', left, Constant(int_type, -0x80000000)),
+                                     self.builder.icmp_signed('==', right, Constant(int_type, -1)))
+        with self.builder.if_then(self.builder.or_(zero, overflow), likely=False):
+            self.builder.call(self.runtime['_division_trap'], [])
+            self.builder.unreachable()
+        self.block = self.builder.block
+        self.temps[target] = self.builder.sdiv(left, right, name=target.name)
 
     def emit_DIVF(self, left, right, target):
-        self.temps[target] = self.builder.fdiv(self.temps[left], self.temps[right], name=target)
+        self.temps[target] = self.builder.fdiv(self.temps[left], self.temps[right], name=target.name)
 
     def emit_PRINT(self, source, runtime_name):
         self.builder.call(self.runtime[runtime_name], [self.temps[source]])
@@ -165,39 +461,51 @@ class GenerateLLVM(object):
             operator = "=="
             
         tmp = self.builder.icmp_signed(operator, self.temps[left], self.temps[right], 'tmp')
-        self.temps[target] = self.builder.zext(tmp, int_type, target)
+        self.temps[target] = self.builder.zext(tmp, int_type, target.name)
 
     def emit_CMPF(self, operator, left, right, target):
         if operator == "=":
             operator = "=="
             
         tmp = self.builder.fcmp_ordered(operator, self.temps[left], self.temps[right], 'tmp')
-        self.temps[target] = self.builder.zext(tmp, int_type, target)
+        self.temps[target] = self.builder.zext(tmp, int_type, target.name)
 
     emit_CMPB = emit_CMPI
 
     def emit_AND(self, left, right, target):
-        self.temps[target] = self.builder.and_(self.temps[left], self.temps[right], target)
+        self.temps[target] = self.builder.and_(self.temps[left], self.temps[right], target.name)
+
+    # && and || on bools, which are ints
+    emit_ANDI = emit_AND
 
     def emit_OR(self, left, right, target):
-        self.temps[target] = self.builder.or_(self.temps[left], self.temps[right], target)
+        self.temps[target] = self.builder.or_(self.temps[left], self.temps[right], target.name)
 
-    def emit_XOR(self, left, right, target):
-        self.temps[target] = self.builder.xor(self.temps[left], self.temps[right], target)
+    emit_ORI = emit_OR
 
-    def emit_LABEL(self, lbl_name):
-        self.block = self.get_block(lbl_name)
-        self.builder.position_at_end(self.block)
+    def emit_XOR(self, left, right, target):
+        self.temps[target] = self.builder.xor(self.temps[left], self.temps[right], target.name)
 
-    def emit_BRANCH(self, dst_label):
-        if not self.block.is_terminated:
-            self.builder.branch(self.get_block(dst_label))
+    def emit_BRANCH(self, dst_block):
+        self.builder.branch(self.get_block(dst_block))
 
-    def emit_CBRANCH(self, test_target, true_label, false_label):
-        true_block = self.get_block(true_label)
-        false_block = self.get_block(false_label)
+    def emit_CBRANCH(self, test_target, true_block, false_block):
+        true_block = self.get_block(true_block)
+        false_block = self.get_block(false_block)
         testvar = self.temps[test_target]
-        self.builder.cbranch(self.builder.trunc(testvar, IntType(1)), true_block, false_block)
+        test = self.builder.trunc(testvar, IntType(1))
+        if self.pgo is not None and self.pgo.instrument:
+            # the taken counter, or the one after it
+            index = self.pgo.layout.offsets[self.name] + 2 + 2 * self.branches
+            self.count(self.builder.sub(Constant(int_type, index), self.builder.zext(test, int_type)))
+        branch = self.builder.cbranch(test, true_block, false_block)
+        if self.pgo is not None and not self.pgo.instrument:
+            weights = self.pgo.branch_weights(self.name, self.branches)
+            # weights are 32 bits wide
+            scale = max(1, -(-max(weights) // 0xFFFFFFFF))
+            branch.set_metadata('prof', self.module.add_metadata(
+                ['branch_weights', *[Constant(int_type, weight // scale) for weight in weights]]))
+        self.branches += 1
 
     def emit_RET(self, register):
         self.builder.store(self.temps[register], self.vars['return'])
@@ -209,25 +517,226 @@ class GenerateLLVM(object):
         self.temps[target] = self.builder.call(self.globals[func_name], args)
 
 
-def compile_llvm(source):
-    from ir import compile_ircode
+# levels of LLVM's own optimizer: 0 keeps the module as generated, 1 to 3
+# run the standard pipeline of clang -O1 to -O3 (SROA/mem2reg, instcombine,
+# GVN, the loop passes and the inliner)
+LLVM_OPT_LEVELS = [0, 1, 2, 3]
+
+def native_target(llvm_opt_level=0, target=None):
+    '''
+    A target machine for the host, optimizing at llvm_opt_level, for the CPU
+    and features in target (a TargetOptions). A native CPU brings the host's
+    features along unless others are given.
+    '''
+    target = target or TargetOptions()
+    binding.initialize_native_target()
+    binding.initialize_native_asmprinter()
+
+    cpu, features = target.cpu, target.features
+    if cpu == 'native':
+        cpu = binding.get_host_cpu_name()
+        features = features or 'native'
+    if features == 'native':
+        features = binding.get_host_cpu_features().flatten()
+
+    return binding.Target.from_default_triple().create_target_machine(
+        cpu=cpu, features=features, opt=llvm_opt_level, reloc='pic')
+
+def parse_llvm(llvm_code, machine):
+    '''
+    The module in llvm_code, parsed and verified, for machine's target.
+    '''
+    module = binding.parse_assembly(llvm_code)
+    module.triple = machine.triple
+    module.data_layout = str(machine.target_data)
+    module.verify()
+    return module
+
+def run_passes(module, machine, llvm_opt_level, inline_threshold=None, target=None):
+    '''
+    Run LLVM's pass pipeline for llvm_opt_level over module. inline_threshold
+    overrides the inliner's cost threshold for the level, and target's
+    switches the vectorizers and loop unrolling.
+    '''
+    target = target or TargetOptions()
+    if llvm_opt_level:
+        tuning = binding.create_pipeline_tuning_options(speed_level=llvm_opt_level)
+        if inline_threshold is not None:
+            tuning.inlining_threshold = inline_threshold
+        if target.vectorize is not None:
+            tuning.loop_vectorization = tuning.slp_vectorization = target.vectorize
+        if target.unroll is not None:
+            tuning.loop_unrolling = target.unroll
+        passes = binding.create_pass_builder(machine, tuning)
+        passes.getModulePassManager().run(module, passes)
+
+def optimize_llvm(llvm_code, llvm_opt_level, inline_threshold=None, target=None):
+    machine = native_target(llvm_opt_level, target)
+    module = parse_llvm(llvm_code, machine)
+    run_passes(module, machine, llvm_opt_level, inline_threshold, target)
+    return str(module)
+
+def link_runtime(module, machine, bitcode):
+    '''
+    Link the runtime, compiled to bitcode, into module, and make everything
+    defined but main internal. LLVM then optimizes the runtime together with
+    the program, inlining what it calls, and this drops what it does not.
+    '''
+    module.link_in(binding.parse_bitcode(bitcode))
+    for value in [*module.functions, *module.global_variables]:
+        if not value.is_declaration and value.name != 'main':
+            value.linkage = 'internal'
+
+    passes = binding.create_pass_builder(machine, binding.create_pipeline_tuning_options())
+    dead_code = binding.create_new_module_pass_manager()
+    dead_code.add_global_dead_code_eliminate_pass()
+    dead_code.run(module, passes)
+
+def show_remarks(passes):
+    '''
+    Have LLVM print to stderr what the passes matching the regex passes did,
+    missed and why, e.g. which loops loop-vectorize could not vectorize.
+    '''
+    for option in ('-pass-remarks', '-pass-remarks-missed', '-pass-remarks-analysis'):
+        binding.set_option('pulse', f'{option}={passes}')
+
+def generate_llvm(ir_functions, opt_level=0, removed=None, memo_size=MEMO_SIZE,
+                  llvm_opt_level=0, target=None, profile_generate=None, profile_use=None,
+                  buffering=None, timing=False, debug=None, **options):
+    from cfg import build_cfg
+    from optimize import optimize
+    from pgo import pgo_options
+
+    cfg_functions = [build_cfg(ir_func) for ir_func in ir_functions]
+    stats = optimize(cfg_functions, opt_level, **options)
+    if removed is not None:
+        removed.update(stats)
+
+    timing = [cfg_func.name for cfg_func in cfg_functions] if timing else None
+    generator = GenerateLLVM(memo_size, pgo_options(cfg_functions, profile_generate, profile_use),
+                             buffering, timing, debug)
+    for cfg_func in cfg_functions:
+        generator.generate_code(cfg_func)
+
+    if llvm_opt_level:
+        return optimize_llvm(str(generator.module), llvm_opt_level, target=target)
+    return str(generator.module)
 
-    generator = GenerateLLVM()
+def compile_llvm(source, jobs=1, opt_level=0, removed=None, memo_size=MEMO_SIZE,
+                 llvm_opt_level=0, target=None, **options):
+    from ir import compile_ircode
 
-    ir_functions = compile_ircode(source)
-    for ir_func in ir_functions:
-        generator.generate_code(ir_func)
+    lines = options.get('debug') is not None
+    return generate_llvm(compile_ircode(source, jobs, lines), opt_level, removed, memo_size,
+                         llvm_opt_level, target, **options)
+
+def partition(cfg_functions, parts):
+    '''
+    Split functions into at most parts groups of about the same number of
+    instructions, largest function first into the smallest group.
+    '''
+    groups = [[] for _ in range(min(parts, len(cfg_functions)))]
+    sizes = [0] * len(groups)
+    by_size = sorted(range(len(cfg_functions)), key=lambda n: -sum(
+        len(block.instructions) for block in cfg_functions[n]))
+    for n in by_size:
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(n)
+        sizes[smallest] += sum(len(block.instructions) for block in cfg_functions[n])
+    return [sorted(group) for group in groups]
+
+# the program's functions and settings, shared by every codegen worker
+_program = None
+
+def _init_worker(ir_functions, memo_size, llvm_opt_level, target, pgo, buffering, timing, debug):
+    global _program
+    _program = ir_functions, memo_size, llvm_opt_level, target, pgo, buffering, timing, debug
+
+def _generate_object(group):
+    '''
+    A native object defining the functions at the indexes in group, and
+    declaring the others and the globals they use.
+    '''
+    from cfg import build_cfg
+
+    ir_functions, memo_size, llvm_opt_level, target, pgo, buffering, timing, debug = _program
+    generator = GenerateLLVM(memo_size, pgo, buffering, timing, debug)
+    if 0 not in group:
+        generator.declare_globals(ir_functions[0])
+
+    group = set(group)
+    for n, ir_func in enumerate(ir_functions):
+        if n in group:
+            generator.generate_code(build_cfg(ir_func))
+        else:
+            generator.declare_function(ir_func)
+
+    machine = native_target(llvm_opt_level, target)
+    module = parse_llvm(str(generator.module), machine)
+    run_passes(module, machine, llvm_opt_level, target=target)
+    return machine.emit_object(module)
+
+def generate_objects(ir_functions, jobs, opt_level=0, removed=None, memo_size=MEMO_SIZE,
+                     llvm_opt_level=0, target=None, profile_generate=None, profile_use=None,
+                     buffering=None, timing=False, debug=None, **options):
+    '''
+    Native objects for a program, its functions split into one LLVM module
+    per worker process, each generated, optimized and compiled there. The
+    Pulse IR passes still see the whole program first; LLVM's only see one
+    module, so it does not inline across them.
+    '''
+    from multiprocessing import Pool
+    from cfg import build_cfg
+    from optimize import optimize
+    from pgo import pgo_options
+
+    cfg_functions = [build_cfg(ir_func) for ir_func in ir_functions]
+    stats = optimize(cfg_functions, opt_level, **options)
+    if removed is not None:
+        removed.update(stats)
+
+    groups = partition(cfg_functions, jobs)
+    if not groups:
+        return []
+    pgo = pgo_options(cfg_functions, profile_generate, profile_use)
+    timing = [cfg_func.name for cfg_func in cfg_functions] if timing else None
+    ir_functions = [cfg_func.linearize() for cfg_func in cfg_functions]
+    with Pool(len(groups), _init_worker,
+              (ir_functions, memo_size, llvm_opt_level, target, pgo, buffering, timing, debug)) as pool:
+        return pool.map(_generate_object, groups)
+
+def compile_objects(source, codegen_jobs, jobs=1, opt_level=0, removed=None, memo_size=MEMO_SIZE,
+                    llvm_opt_level=0, target=None, **options):
+    from ir import compile_ircode
 
-    return str(generator.module)
+    lines = options.get('debug') is not None
+    return generate_objects(compile_ircode(source, jobs, lines), codegen_jobs, opt_level, removed,
+                            memo_size, llvm_opt_level, target, **options)
 
 def main():
-    import sys
-
-    if len(sys.argv) != 2:
-        raise SystemExit(1)
-
-    source = open(sys.argv[1]).read()
-    llvm_code = compile_llvm(source)
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='llvm.py')
+    parser.add_argument('filename', help='Pulse source, or IR dumped by ir.py -o (.pir)')
+    parser.add_argument('-O', dest='level', type=int, default=0, choices=LLVM_OPT_LEVELS,
+                        help='optimization level of the Pulse IR passes and LLVM')
+    add_target_arguments(parser)
+    args = parser.parse_args()
+    opt_level, llvm_opt_level = split_level(args.level)
+    target = target_options(args)
+    if args.remarks:
+        show_remarks(args.remarks)
+
+    if args.filename.endswith('.pir'):
+        from ir import load
+
+        with open(args.filename, 'rb') as file:
+            llvm_code = generate_llvm(load(file), opt_level, llvm_opt_level=llvm_opt_level,
+                                      target=target)
+    else:
+        with open(args.filename) as source:
+            llvm_code = compile_llvm(source, opt_level=opt_level, llvm_opt_level=llvm_opt_level,
+                                     target=target)
     print(llvm_code)
 
 if __name__ == '__main__':
@@ -0,0 +1,162 @@
+# Pulse loop optimizer - natural loops and invariant code motion
+
+from cfg import Instruction, Block, Names
+from inline import calls, local_names, recursive_groups
+
+class Loop(object):
+    '''
+    A natural loop: a header, the latches branching back to it, and every
+    block that reaches a latch without passing through the header.
+    '''
+    def __init__(self, header):
+        self.header = header
+        self.latches = []
+        self.blocks = {header}
+        self.preheader = None
+
+    def __contains__(self, block):
+        return block in self.blocks
+
+    def __repr__(self):
+        return f'Loop({self.header.label}, {sorted(block.label for block in self.blocks)})'
+
+def find_loops(func):
+    '''
+    The natural loops of func, each loop before the loops containing it.
+    '''
+    idom = func.dominators()
+
+    def dominates(a, b):
+        while a is not b:
+            if b is idom[b]:
+                return False
+            b = idom[b]
+        return True
+
+    loops = {}
+    for block in func:
+        if block not in idom:
+            continue
+        for succ in block.successors:
+            if not dominates(succ, block):
+                continue
+
+            loop = loops.setdefault(succ, Loop(succ))
+            loop.latches.append(block)
+            stack = [block]
+            while stack:
+                member = stack.pop()
+                if member not in loop.blocks and member in idom:
+                    loop.blocks.add(member)
+                    stack.extend(member.predecessors)
+
+    return sorted(loops.values(), key=lambda loop: len(loop.blocks))
+
+def add_preheaders(func, names):
+    '''
+    Give every loop a preheader: a block outside the loop that is the only
+    way into its header. A lone predecessor that only branches to the
+    header already is one.
+    '''
+    for loop in find_loops(func):
+        header = loop.header
+        if header is func.entry:
+            continue
+
+        outside = [pred for pred in header.predecessors if pred not in loop]
+        if len(outside) == 1 and outside[0].successors == [header]:
+            continue
+
+        preheader = Block(names.label())
+        preheader.append(Instruction('BRANCH', [header]))
+        for pred in outside:
+            terminator = pred.terminator
+            terminator.rewrite(terminator.opcode,
+                               [preheader if op is header else op for op in terminator.operands])
+        func.blocks.insert(func.blocks.index(header), preheader)
+        func.link()
+
+    loops = find_loops(func)
+    for loop in loops:
+        outside = [pred for pred in loop.header.predecessors if pred not in loop]
+        if len(outside) == 1:
+            loop.preheader = outside[0]
+    return [loop for loop in loops if loop.preheader is not None]
+
+def stored_globals(functions):
+    '''
+    The globals each function may store to, itself or through its calls.
+    '''
+    by_name = {func.name: func for func in functions}
+    stores = {}
+    for group in recursive_groups(functions, by_name):
+        names = set()
+        for func in group:
+            locals_ = local_names(func)
+            for block in func:
+                for inst in block:
+                    if inst.opcode.startswith('STORE') and inst.operands[1] not in locals_:
+                        names.add(inst.operands[1])
+            for call in calls(func):
+                callee = by_name.get(call.operands[0])
+                if callee is not None and callee not in group:
+                    names |= stores[callee]
+        for func in group:
+            stores[func] = names
+    return stores
+
+def hoist(inst, preheader):
+    inst.block.instructions.remove(inst)
+    preheader.insert(len(preheader.instructions) - 1, inst)
+
+def is_invariant(value, loop):
+    return value.definition.block not in loop
+
+def is_constant(value):
+    return value.definition.opcode.startswith('MOV')
+
+def can_trap(inst):
+    # an integer division only moves if it cannot fault, as the loop might
+    # not have run it at all
+    if inst.opcode != 'DIVI':
+        return False
+    divisor = inst.operands[1]
+    return not is_constant(divisor) or divisor.definition.operands[0] in (0, -1)
+
+def hoist_loop_invariants(functions):
+    '''
+    Move pure instructions whose operands do not change in a loop, and loads
+    of variables the loop does not store to, into the loop's preheader.
+    Inner loops go first so code can move out of a whole loop nest.
+    '''
+    by_name = {func.name: func for func in functions}
+    stores = stored_globals(functions)
+    names = Names(functions)
+
+    for func in functions:
+        locals_ = local_names(func)
+        for loop in add_preheaders(func, names):
+            blocks = [block for block in func if block in loop]
+
+            stored = set()
+            for block in blocks:
+                for inst in block:
+                    if inst.opcode.startswith('STORE'):
+                        stored.add(inst.operands[1])
+                    elif inst.opcode.startswith('ALLOC'):
+                        stored.add(inst.operands[0])
+                    elif inst.opcode == 'CALL' and inst.operands[0] in by_name:
+                        stored |= stores[by_name[inst.operands[0]]] - locals_
+
+            changed = True
+            while changed:
+                changed = False
+                for block in blocks:
+                    for inst in list(block):
+                        if inst.result is None or inst.opcode == 'CALL' or can_trap(inst):
+                            continue
+                        if inst.opcode.startswith('LOAD') and inst.operands[0] in stored:
+                            continue
+                        if all(is_invariant(op, loop) for op in inst.values):
+                            hoist(inst, loop.preheader)
+                            changed = True
@@ -0,0 +1,373 @@
+# Pulse optimizer - passes over the control flow graph of the IR
+
+import math
+import operator
+from collections import ChainMap
+
+from cfg import Value
+from inline import inline_functions, INLINE_THRESHOLD
+from loops import hoist_loop_invariants
+from tailcalls import eliminate_tail_calls
+
+def suffix(opcode):
+    # the type an instruction works on; AND, OR and XOR are on ints
+    return opcode[-1] if opcode[-1] in 'IFB' and opcode not in ('AND', 'OR', 'XOR') else 'I'
+
+def is_constant(value):
+    return value.definition.opcode.startswith('MOV')
+
+def constant(value):
+    return value.definition.operands[0]
+
+def is_pure(inst):
+    return inst.result is not None and inst.opcode != 'CALL'
+
+def drop_if_dead(value):
+    inst = value.definition
+    if not value.uses and inst.block is not None and is_pure(inst):
+        inst.remove()
+        for op in inst.values:
+            drop_if_dead(op)
+
+def local_names(func):
+    '''
+    Names that refer to a local variable somewhere in the function. Calls
+    cannot change these, as Pulse has no pointers.
+    '''
+    names = {pname for pname, _ in func.parameters}
+    for block in func:
+        for inst in block:
+            if inst.opcode.startswith('ALLOC'):
+                names.add(inst.operands[0])
+    return names
+
+
+def wrap(value, bits):
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+def divide(left, right):
+    quotient = abs(left) // abs(right)
+    return quotient if (left < 0) == (right < 0) else -quotient
+
+ARITHMETIC = {
+    'ADD': operator.add,
+    'SUB': operator.sub,
+    'MUL': operator.mul,
+    'DIV': None,
+    'AND': operator.and_,
+    'OR': operator.or_,
+    'XOR': operator.xor,
+}
+
+COMPARISONS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+    '!=': operator.ne,
+}
+
+BITS = {'I': 32, 'B': 8}
+
+def fold(inst):
+    '''
+    The constant inst computes from constant operands, or None if it cannot
+    be known at compile time (or would trap).
+    '''
+    opcode = inst.opcode
+    ty = suffix(opcode)
+
+    if opcode.startswith('CMP'):
+        op, left, right = inst.operands
+        left, right = constant(left), constant(right)
+        if ty == 'F' and (math.isnan(left) or math.isnan(right)):
+            return 0
+        return int(COMPARISONS[op](left, right))
+
+    name = opcode if opcode in ARITHMETIC else opcode[:-1]
+    left, right = (constant(op) for op in inst.operands)
+    if ty == 'F':
+        left, right = float(left), float(right)
+        if name == 'DIV':
+            return left / right if right else None
+        return ARITHMETIC[name](left, right)
+
+    if name == 'DIV':
+        if right == 0 or (left == -(1 << 31) and right == -1):
+            return None
+        return wrap(divide(left, right), BITS[ty])
+    return wrap(ARITHMETIC[name](left, right), BITS[ty])
+
+def constant_globals(functions):
+    '''
+    Globals stored exactly once, in __pulse_init, from a constant and before
+    any call could read them. Every load of one elsewhere reads that value.
+    '''
+    init = functions[0]
+    init_locals = local_names(init)
+    candidates = {}
+    for inst in init.entry:
+        if inst.opcode == 'CALL':
+            break
+        if (inst.opcode.startswith('STORE') and is_constant(inst.operands[0])
+                and inst.operands[1] not in init_locals):
+            name = inst.operands[1]
+            candidates[name] = None if name in candidates else inst.operands[0].definition
+
+    stores = {}
+    for func in functions:
+        locals_ = local_names(func)
+        for block in func:
+            for inst in block:
+                if inst.opcode.startswith('STORE') and inst.operands[1] not in locals_:
+                    stores[inst.operands[1]] = stores.get(inst.operands[1], 0) + 1
+
+    return {name: mov for name, mov in candidates.items()
+            if mov is not None and stores[name] == 1}
+
+def fold_constants(functions):
+    '''
+    Evaluate instructions whose operands are all constants, loads of
+    globals that never change, and branches on constants.
+    '''
+    if not functions:
+        return
+
+    fold_function(functions[0], {})
+    globals_ = constant_globals(functions)
+    for func in functions[1:]:
+        locals_ = local_names(func)
+        fold_function(func, {name: mov for name, mov in globals_.items() if name not in locals_})
+
+def fold_function(func, globals_):
+    relink = False
+    for block in func:
+        for inst in list(block):
+            opcode = inst.opcode
+            if opcode.startswith('LOAD') and inst.operands[0] in globals_:
+                mov = globals_[inst.operands[0]]
+                inst.rewrite(mov.opcode, mov.operands)
+            elif opcode == 'CBRANCH' and is_constant(inst.operands[0]):
+                test, true_block, false_block = inst.operands
+                inst.rewrite('BRANCH', [true_block if constant(test) & 1 else false_block])
+                drop_if_dead(test)
+                relink = True
+            elif (is_pure(inst) and not opcode.startswith(('MOV', 'LOAD'))
+                  and all(is_constant(op) for op in inst.values)):
+                value = fold(inst)
+                if value is None:
+                    continue
+                operands = inst.values
+                inst.rewrite('MOVI' if opcode.startswith('CMP') else 'MOV' + suffix(opcode), [value])
+                for op in operands:
+                    drop_if_dead(op)
+
+    if relink:
+        func.link()
+
+
+def memory_effect(inst, known, locals_):
+    '''
+    Forget what is known about variables inst may write.
+    '''
+    opcode = inst.opcode
+    if opcode == 'CALL':
+        for name in [name for name in known if name not in locals_]:
+            del known[name]
+    elif opcode.startswith(('ALLOC', 'VAR')):
+        known.pop(inst.operands[0], None)
+
+def propagate_copies(functions):
+    '''
+    Replace a load by the value last stored to the variable in the same
+    block.
+    '''
+    for func in functions:
+        locals_ = local_names(func)
+        for block in func:
+            stored = {}
+            for inst in list(block):
+                opcode = inst.opcode
+                if opcode.startswith('STORE'):
+                    stored[inst.operands[1]] = inst.operands[0]
+                elif opcode.startswith('LOAD') and inst.operands[0] in stored:
+                    inst.result.replace_uses(stored[inst.operands[0]])
+                    inst.remove()
+                else:
+                    memory_effect(inst, stored, locals_)
+
+
+COMMUTATIVE = {'ADD', 'MUL', 'AND', 'OR', 'XOR'}
+
+def operand_key(op):
+    # -0.0 == 0.0 and 1 == 1.0, which must not share a value
+    return op if isinstance(op, Value) else (type(op), repr(op))
+
+def expression_key(inst):
+    opcode = inst.opcode
+    operands = [operand_key(op) for op in inst.operands]
+    if (opcode in COMMUTATIVE or opcode[:-1] in COMMUTATIVE) and not opcode.startswith('MOV'):
+        operands.sort(key=id)
+    return (opcode, *operands)
+
+def eliminate_common_subexpressions(functions):
+    '''
+    Reuse a pure computation already made in a dominating block, and a
+    variable already loaded earlier in the same block.
+    '''
+    for func in functions:
+        locals_ = local_names(func)
+        idom = func.dominators()
+        children = {block: [] for block in idom}
+        for block, parent in idom.items():
+            if block is not func.entry:
+                children[parent].append(block)
+
+        stack = [(func.entry, ChainMap())]
+        while stack:
+            block, available = stack.pop()
+            loaded = {}
+            for inst in list(block):
+                opcode = inst.opcode
+                if opcode.startswith('LOAD'):
+                    name = inst.operands[0]
+                    if name in loaded:
+                        inst.result.replace_uses(loaded[name])
+                        inst.remove()
+                    else:
+                        loaded[name] = inst.result
+                elif opcode.startswith('STORE'):
+                    loaded.pop(inst.operands[1], None)
+                elif is_pure(inst):
+                    key = expression_key(inst)
+                    if key in available:
+                        inst.result.replace_uses(available[key])
+                        inst.remove()
+                    else:
+                        available[key] = inst.result
+                else:
+                    memory_effect(inst, loaded, locals_)
+
+            for child in children[block]:
+                stack.append((child, available.new_child()))
+
+
+def eliminate_dead_code(functions):
+    '''
+    Remove unreachable blocks, stores to local variables that are never
+    read and computations whose result is never used.
+    '''
+    for func in functions:
+        reachable = set(func.postorder())
+        for block in func:
+            if block not in reachable:
+                for inst in list(block):
+                    inst.remove()
+        func.blocks = [block for block in func if block in reachable]
+        func.link()
+
+        loaded = set()
+        for block in func:
+            for inst in block:
+                if inst.opcode.startswith('LOAD'):
+                    loaded.add(inst.operands[0])
+
+        params = {pname for pname, _ in func.parameters}
+        unread = local_names(func) - loaded - params
+        for block in func:
+            for inst in list(block):
+                opcode = inst.opcode
+                if opcode.startswith(('ALLOC', 'STORE')) and inst.operands[-1] in unread:
+                    operands = inst.values
+                    inst.remove()
+                    for op in operands:
+                        drop_if_dead(op)
+                elif is_pure(inst) and not inst.result.uses:
+                    drop_if_dead(inst.result)
+
+
+PASSES = {
+    'tail call elimination': eliminate_tail_calls,
+    'inlining': inline_functions,
+    'constant folding': fold_constants,
+    'copy propagation': propagate_copies,
+    'common subexpression elimination': eliminate_common_subexpressions,
+    'loop invariant code motion': hoist_loop_invariants,
+    'dead code elimination': eliminate_dead_code,
+}
+
+LEVELS = {
+    0: [],
+    1: ['constant folding', 'dead code elimination'],
+    2: ['tail call elimination', 'inlining', 'constant folding', 'copy propagation', 'common subexpression elimination',
+        'loop invariant code motion', 'constant folding', 'common subexpression elimination',
+        'dead code elimination'],
+}
+
+def split_level(level):
+    '''
+    The Pulse IR and LLVM optimization levels that -O level stands for:
+    LLVM's go up to 3, the Pulse passes stop at 2.
+    '''
+    return min(level, max(LEVELS)), level
+
+def size(functions):
+    return sum(len(block.instructions) for func in functions for block in func)
+
+def optimize(functions, level=2, inline_threshold=INLINE_THRESHOLD):
+    '''
+    Run the passes of an optimization level over a program's functions in
+    CFG form. Returns the number of instructions each pass removed.
+    '''
+    options = {'inlining': {'threshold': inline_threshold}}
+
+    removed = {}
+    for name in LEVELS[level]:
+        before = size(functions)
+        PASSES[name](functions, **options.get(name, {}))
+        removed[name] = removed.get(name, 0) + before - size(functions)
+    return removed
+
+def report(removed, file):
+    for name, count in removed.items():
+        if count < 0:
+            print(f'{name}: {-count} instructions added', file=file)
+        else:
+            print(f'{name}: {count} instructions removed', file=file)
+
+def main():
+    import sys
+    from ir import compile_ircode
+    from cfg import build_cfg
+
+    if len(sys.argv) < 2:
+        raise SystemExit(1)
+
+    level = 2
+    threshold = INLINE_THRESHOLD
+    for arg in sys.argv[2:]:
+        if arg.startswith('-O'):
+            level = int(arg[2:])
+        elif arg.startswith('--inline-threshold='):
+            threshold = int(arg.split('=')[1])
+
+    with open(sys.argv[1]) as source:
+        functions = [build_cfg(f) for f in compile_ircode(source)]
+
+    before = size(functions)
+    removed = optimize(functions, level, threshold)
+
+    for func in functions:
+        f = func.linearize()
+        print(f'{"::"*5} {f} {"::"*5}')
+        for instruction in f.code:
+            print(instruction)
+        print("*"*30)
+
+    report(removed, sys.stderr)
+    print(f'{before} -> {size(functions)} instructions', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,11 @@
 # Pulse parser
 
-from sly import Parser
 from error import error
+from cache import CachedParser
 from lexer import PulseLexer
 from ast import *
 
-class PulseParser(Parser):
+class PulseParser(CachedParser):
     tokens = PulseLexer.tokens
 
     precedence = (
@@ -66,7 +66,12 @@ class PulseParser(Parser):
 
     @_('FUNCTION ID LPAREN func_params RPAREN datatype LBRACE block RBRACE')
     def func_declaration(self, p):
-        return FuncDeclaration(p.ID, p.func_params, p.datatype, p.block, lineno=p.lineno)
+        return FuncDeclaration(p.ID, p.func_params, p.datatype, p.block, False, lineno=p.lineno)
+
+    # a pure function whose results are cached by its arguments
+    @_('MEMO FUNCTION ID LPAREN func_params RPAREN datatype LBRACE block RBRACE')
+    def func_declaration(self, p):
+        return FuncDeclaration(p.ID, p.func_params, p.datatype, p.block, True, lineno=p.lineno)
 
     @_('func_params COMA func_param')
     def func_params(self, p):
@@ -209,10 +214,18 @@ class PulseParser(Parser):
         else:
             error('EOF','Syntax error. No more input.')
 
-def parse(source):
+def parse(source, check_fields=True):
     lexer = PulseLexer()
     parser = PulseParser()
-    ast = parser.parse(lexer.tokenize(source))
+    if isinstance(source, str):
+        tokens = lexer.tokenize(source)
+    else:
+        tokens = lexer.tokenize_stream(source)
+
+    # the grammar already guarantees the field types, so callers building
+    # large trees can skip validating them
+    with field_checks(check_fields):
+        ast = parser.parse(tokens)
     return ast
 
 def main():
@@ -221,7 +234,8 @@ def main():
     if len(sys.argv) != 2:
         raise SystemExit(1)
 
-    ast = parse(open(sys.argv[1]).read())
+    with open(sys.argv[1]) as source:
+        ast = parse(source)
 
     for depth, node in flatten(ast):
         print('%s: %s%s' % (getattr(node, 'lineno', None), ' '*(4*depth), node))
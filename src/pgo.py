@@ -0,0 +1,116 @@
+# Pulse PGO - profile-guided optimization: counters for which functions an
+# instrumented program enters and which way its branches go, and the
+# profiles they produce
+
+import sys
+import zlib
+
+# fractions of the total count, in millionths, that LLVM's profile summary
+# gives the smallest count of the hottest counters adding up to
+CUTOFFS = [10000, 100000, 200000, 300000, 400000, 500000, 600000, 700000, 800000,
+           900000, 950000, 990000, 999000, 999900, 999990, 999999]
+
+class ProfileLayout(object):
+    '''
+    Where each function's counters are in a program's counter array: the
+    times it was entered, then two for each conditional branch (taken, not
+    taken) in block order. The checksum covers the layout, so a profile is
+    only ever applied to the code it was collected from.
+    '''
+    def __init__(self, cfg_functions):
+        self.offsets = {}
+        self.size = 0
+        shape = []
+        for func in cfg_functions:
+            branches = sum(inst.opcode == 'CBRANCH' for block in func for inst in block)
+            self.offsets[func.name] = self.size
+            self.size += 1 + 2 * branches
+            shape.append((func.name, func.parameters, func.return_type, branches))
+        self.checksum = zlib.crc32(repr(shape).encode('utf-8'))
+
+class PGO(object):
+    '''
+    How a program is compiled for profile-guided optimization: instrumented
+    to write its counters to path, or, given the counts of a profile, with
+    them attached as function entry counts and branch weights.
+    '''
+    def __init__(self, layout, path=None, counts=None):
+        self.layout = layout
+        self.path = path
+        self.counts = counts
+
+    @property
+    def instrument(self):
+        return self.counts is None
+
+    def entry_count(self, name):
+        return self.counts[self.layout.offsets[name]]
+
+    def branch_weights(self, name, branch):
+        index = self.layout.offsets[name] + 1 + 2 * branch
+        return self.counts[index], self.counts[index + 1]
+
+    def summary(self):
+        '''
+        The fields of LLVM's ProfileSummary for the counts, in its order,
+        and its detailed summary: for each cutoff, the smallest count among
+        the hottest counters reaching it and how many of them there are.
+        '''
+        starts = set(self.layout.offsets.values())
+        entries = [self.counts[offset] for offset in starts]
+        internal = [count for n, count in enumerate(self.counts) if n not in starts]
+        ordered = sorted(self.counts, reverse=True)
+        total = sum(ordered)
+
+        detailed = []
+        taken = covered = 0
+        for cutoff in CUTOFFS:
+            while taken < len(ordered) and covered * 1000000 < total * cutoff:
+                covered += ordered[taken]
+                taken += 1
+            detailed.append((cutoff, ordered[taken - 1] if taken else 0, taken))
+
+        return [
+            ('TotalCount', total),
+            ('MaxCount', ordered[0] if ordered else 0),
+            ('MaxInternalCount', max(internal, default=0)),
+            ('MaxFunctionCount', max(entries, default=0)),
+            ('NumCounts', len(ordered)),
+            ('NumFunctions', len(entries)),
+        ], detailed
+
+def read_profile(path, layout):
+    '''
+    The counts in the profile at path, or None, after a warning, if it is
+    missing or was collected from different code.
+    '''
+    try:
+        with open(path) as file:
+            header = file.readline().split()
+            counts = [int(line) for line in file]
+    except (OSError, ValueError):
+        print(f"warning: cannot read profile '{path}', compiling without it", file=sys.stderr)
+        return None
+
+    if header != ['pulse-profile', str(layout.checksum), str(layout.size)] or len(counts) != layout.size:
+        print(f"warning: profile '{path}' was collected from different code, compiling without it",
+              file=sys.stderr)
+        return None
+    return counts
+
+def pgo_options(cfg_functions, profile_generate=None, profile_use=None):
+    '''
+    The PGO for a program's functions, after the Pulse passes, given the
+    path to instrument for or the profile to use. None if neither.
+    '''
+    if profile_generate is None and profile_use is None:
+        return None
+
+    layout = ProfileLayout(cfg_functions)
+    if profile_generate is not None:
+        return PGO(layout, path=profile_generate)
+
+    counts = read_profile(profile_use, layout)
+    if counts is None:
+        return None
+    return PGO(layout, counts=counts)
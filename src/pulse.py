@@ -0,0 +1,130 @@
+# Pulse driver - runs programs, JIT compiled or on the bytecode interpreter
+#
+#   python pulse.py run [--interp | --exe] [-O n] file.pulse
+
+import os
+import sys
+import subprocess
+import tempfile
+
+from error import errors_reported
+from optimize import split_level
+from target import add_target_arguments, target_options
+
+def compile_functions(source, jobs, opt_level, inline_threshold):
+    '''
+    The IR functions of a program, optimized at opt_level.
+    '''
+    from ir import compile_ircode
+
+    functions = compile_ircode(source, jobs)
+    if opt_level and functions:
+        from cfg import build_cfg
+        from optimize import optimize
+
+        cfg_functions = [build_cfg(func) for func in functions]
+        optimize(cfg_functions, opt_level, inline_threshold)
+        functions = [func.linearize() for func in cfg_functions]
+    return functions
+
+def run_interpreted(args, source):
+    from interp import interpret, PulseRuntimeError
+
+    opt_level, _ = split_level(args.level)
+    functions = compile_functions(source, args.jobs, opt_level, args.inline_threshold)
+    if errors_reported():
+        return 1
+
+    try:
+        return interpret(functions, memo_size=args.memo_size) & 0xFF
+    except PulseRuntimeError as err:
+        print(f'error: {err}', file=sys.stderr)
+        return 1
+
+def run_jitted(args, source):
+    from llvm import compile_llvm, show_remarks
+    from jit import run_jit
+
+    if args.remarks:
+        show_remarks(args.remarks)
+    opt_level, llvm_opt_level = split_level(args.level)
+    llvm_code = compile_llvm(source, jobs=args.jobs, opt_level=opt_level, memo_size=args.memo_size,
+                             llvm_opt_level=llvm_opt_level, target=target_options(args),
+                             buffering=args.buffering, timing=args.profile,
+                             debug=args.filename if args.debug else None,
+                             inline_threshold=args.inline_threshold)
+    if errors_reported():
+        return 1
+    return run_jit(llvm_code, llvm_opt_level, target_options(args), args.debug) & 0xFF
+
+def run_compiled(args, source):
+    from llvm import compile_llvm, show_remarks
+    from compile import build_executable
+
+    if args.remarks:
+        show_remarks(args.remarks)
+    opt_level, llvm_opt_level = split_level(args.level)
+    llvm_code = compile_llvm(source, jobs=args.jobs, opt_level=opt_level, memo_size=args.memo_size,
+                             llvm_opt_level=llvm_opt_level, target=target_options(args),
+                             buffering=args.buffering, timing=args.profile,
+                             debug=args.filename if args.debug else None,
+                             inline_threshold=args.inline_threshold)
+    if errors_reported():
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        exe = os.path.join(tmp, 'program')
+        build_executable(llvm_code, exe, llvm_opt_level, target_options(args))
+        return subprocess.run([exe]).returncode
+
+def main():
+    import argparse
+    from inline import INLINE_THRESHOLD
+    from purity import MEMO_SIZE
+
+    parser = argparse.ArgumentParser(prog='pulse')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='compile and run a program')
+    run.add_argument('filename')
+    mode = run.add_mutually_exclusive_group()
+    mode.add_argument('--interp', action='store_true',
+                      help='run on the bytecode interpreter instead of the JIT')
+    mode.add_argument('--exe', action='store_true',
+                      help='build and run an executable instead of using the JIT')
+    run.add_argument('-j', '--jobs', type=int, default=1,
+                     help='check function bodies on this many processes')
+    run.add_argument('-O', dest='level', type=int, default=0, choices=[0, 1, 2, 3],
+                     help='optimization level: Pulse IR passes up to 2, then LLVM at the same level')
+    run.add_argument('--inline-threshold', type=int, default=INLINE_THRESHOLD,
+                     help='inline functions of up to this many IR instructions at -O2')
+    run.add_argument('--memo-size', type=int, default=MEMO_SIZE,
+                     help='results each memo function keeps cached')
+    run.add_argument('--buffering', choices=['full', 'line', 'explicit'],
+                     help='when a compiled program writes out what it prints: when its buffer is '
+                          'full, at each newline, or after every print')
+    run.add_argument('-g', dest='debug', action='store_true',
+                     help='emit DWARF line tables, and with the JIT write /tmp/perf-<pid>.map for perf')
+    run.add_argument('--profile', action='store_true',
+                     help='time each function of a compiled program, and print a flat profile '
+                          'to stderr at exit')
+    add_target_arguments(run)
+    args = parser.parse_args()
+
+    try:
+        f = open(args.filename)
+    except OSError:
+        sys.stderr.write("Error: file '{}' does not exist\n".format(args.filename))
+        raise SystemExit(1)
+
+    with f:
+        source = f.read()
+    sys.stdout.flush()
+    if args.interp:
+        raise SystemExit(run_interpreted(args, source))
+    if args.exe:
+        raise SystemExit(run_compiled(args, source))
+    raise SystemExit(run_jitted(args, source))
+
+if __name__ == '__main__':
+    main()
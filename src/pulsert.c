@@ -1,19 +1,387 @@
+#include <math.h>
+#include <signal.h>
 #include <stdio.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+
+/* Output. What a program prints collects in one buffer, written to stdout
+   when it fills up and also, depending on the flush policy, after each
+   newline (line) or after every print (explicit). The policy is
+   $PULSE_BUFFERING if set, else the one the program was compiled with,
+   else line on a terminal and full otherwise. The rest is written at exit. */
+
+enum { OUTPUT_FULL, OUTPUT_LINE, OUTPUT_EXPLICIT };
+static const char *output_policies[] = {"full", "line", "explicit"};
+
+#define OUTPUT_SIZE 65536
+
+static char output[OUTPUT_SIZE];
+static int output_used;
+static int output_policy = -1;
+
+// __declspec(dllexport)    // Uncomment on Windows
+void _output_flush(void) {
+  if (output_used)
+    fwrite(output, 1, output_used, stdout);
+  fflush(stdout);
+  output_used = 0;
+}
+
+// __declspec(dllexport)    // Uncomment on Windows
+void _output_start(int policy) {
+  const char *name = getenv("PULSE_BUFFERING");
+
+  if (output_policy < 0)
+    atexit(_output_flush);
+  if (name && *name) {
+    int i;
+    for (i = 0; i < 3 && strcmp(name, output_policies[i]); i++)
+      ;
+    if (i < 3)
+      policy = i;
+    else
+      fprintf(stderr, "unknown PULSE_BUFFERING %s, ignored\n", name);
+  }
+  if (policy < 0)
+    policy = isatty(fileno(stdout)) ? OUTPUT_LINE : OUTPUT_FULL;
+  output_policy = policy;
+}
+
+static void output_reserve(int size) {
+  if (output_used + size > OUTPUT_SIZE)
+    _output_flush();
+}
+
+static void output_printed(int newline) {
+  if (output_policy == OUTPUT_EXPLICIT || (newline && output_policy == OUTPUT_LINE))
+    _output_flush();
+}
 
 // __declspec(dllexport)      // Uncomment on Windows
 void _print_int(int x) {
-  printf("%i\n", x);
+  char digits[10];
+  unsigned int value = x < 0 ? 0u - x : x;
+  int n = 0;
+
+  output_reserve(12);
+  if (x < 0)
+    output[output_used++] = '-';
+  do {
+    digits[n++] = '0' + value % 10;
+    value /= 10;
+  } while (value);
+  while (n)
+    output[output_used++] = digits[--n];
+  output[output_used++] = '\n';
+  output_printed(1);
 }
 
 // __declspec(dllexport)     // Uncomment on Windows
 void _print_float(double x) {
-  printf("%f\n", x);
+  /* the sign of a NaN depends on how it was made: at run time or folded */
+  if (isnan(x))
+    x = NAN;
+  int n = snprintf(output + output_used, OUTPUT_SIZE - output_used, "%f\n", x);
+
+  if (n >= OUTPUT_SIZE - output_used) {
+    _output_flush();
+    n = snprintf(output, OUTPUT_SIZE, "%f\n", x);
+  }
+  output_used += n;
+  output_printed(1);
 }
 
 // __declspec(dllexport)    // Uncomment on Windows
 void _print_byte(char c) {
-  printf("%c", c);
-  fflush(stdout);
+  output_reserve(1);
+  output[output_used++] = c;
+  output_printed(c == '\n');
+}
+
+/* Integer division by zero, or of INT_MIN by -1. LLVM takes either to be
+   undefined and optimizes on it, so the code checks for them and traps
+   here the way the division instruction itself would. */
+void _division_trap(void) {
+  raise(SIGFPE);
+  abort();
+}
+
+/* Result caches for memo functions. A function's arguments are widened to
+   64 bits each to form the key, and so is its result. Each cache is a hash
+   table of at most `capacity` entries, also kept on a list from most to
+   least recently used; once full, storing a new result reuses the least
+   recently used entry. The compiler gives every memo function a pointer
+   to its cache, created on first use. */
+
+typedef struct memo_entry {
+  struct memo_entry *chain;            /* next entry in the same bucket */
+  struct memo_entry *newer, *older;
+  uint64_t hash;
+  int64_t value;
+  int64_t key[];
+} memo_entry;
+
+typedef struct {
+  int capacity, count, nargs;
+  uint64_t mask;
+  memo_entry **buckets;
+  memo_entry *newest, *oldest;
+} memo_cache;
+
+static uint64_t memo_hash(const int64_t *key, int nargs) {
+  uint64_t hash = 0x9e3779b97f4a7c15ULL;
+  for (int i = 0; i < nargs; i++) {
+    hash ^= (uint64_t) key[i];
+    hash *= 0xff51afd7ed558ccdULL;
+    hash ^= hash >> 32;
+  }
+  return hash;
+}
+
+static memo_cache *memo_open(memo_cache **cache, int capacity, int nargs) {
+  if (!*cache) {
+    memo_cache *c = calloc(1, sizeof(memo_cache));
+    uint64_t buckets = 1;
+    if (capacity < 1)
+      capacity = 1;
+    while (buckets < (uint64_t) capacity)
+      buckets <<= 1;
+    if (c)
+      c->buckets = calloc(buckets, sizeof(memo_entry *));
+    if (!c || !c->buckets) {
+      fprintf(stderr, "out of memory for memo cache\n");
+      exit(1);
+    }
+    c->capacity = capacity;
+    c->nargs = nargs;
+    c->mask = buckets - 1;
+    *cache = c;
+  }
+  return *cache;
+}
+
+static void memo_unlink(memo_cache *c, memo_entry *e) {
+  if (e->newer) e->newer->older = e->older; else c->newest = e->older;
+  if (e->older) e->older->newer = e->newer; else c->oldest = e->newer;
+}
+
+static void memo_push(memo_cache *c, memo_entry *e) {
+  e->newer = NULL;
+  e->older = c->newest;
+  if (c->newest) c->newest->newer = e; else c->oldest = e;
+  c->newest = e;
+}
+
+static memo_entry *memo_find(memo_cache *c, const int64_t *key, uint64_t hash) {
+  memo_entry *e = c->buckets[hash & c->mask];
+  for (; e; e = e->chain)
+    if (e->hash == hash && !memcmp(e->key, key, c->nargs * sizeof(int64_t)))
+      return e;
+  return NULL;
+}
+
+// __declspec(dllexport)    // Uncomment on Windows
+int _memo_lookup(memo_cache **cache, int capacity, int nargs, const int64_t *key, int64_t *value) {
+  memo_cache *c = memo_open(cache, capacity, nargs);
+  memo_entry *e = memo_find(c, key, memo_hash(key, nargs));
+  if (!e)
+    return 0;
+  memo_unlink(c, e);
+  memo_push(c, e);
+  *value = e->value;
+  return 1;
+}
+
+// __declspec(dllexport)    // Uncomment on Windows
+void _memo_store(memo_cache **cache, int capacity, int nargs, const int64_t *key, int64_t value) {
+  memo_cache *c = memo_open(cache, capacity, nargs);
+  uint64_t hash = memo_hash(key, nargs);
+  memo_entry *e = memo_find(c, key, hash);
+
+  if (e) {
+    memo_unlink(c, e);
+  } else {
+    if (c->count < c->capacity) {
+      e = malloc(sizeof(memo_entry) + nargs * sizeof(int64_t));
+      if (!e) {
+        fprintf(stderr, "out of memory for memo cache\n");
+        exit(1);
+      }
+      c->count++;
+    } else {
+      memo_entry **link;
+      e = c->oldest;
+      memo_unlink(c, e);
+      for (link = &c->buckets[e->hash & c->mask]; *link != e; link = &(*link)->chain)
+        ;
+      *link = e->chain;
+    }
+    e->hash = hash;
+    memcpy(e->key, key, nargs * sizeof(int64_t));
+    e->chain = c->buckets[hash & c->mask];
+    c->buckets[hash & c->mask] = e;
+  }
+  e->value = value;
+  memo_push(c, e);
+}
+
+/* Counters of a program compiled with --profile-generate. The program
+   registers them from __pulse_init and they are written out at exit, to
+   $PULSE_PROFILE if set, else to the path it was compiled with. A profile
+   already there for the same program (its checksum and size match) is
+   added to, so that several runs make up one profile. */
+
+static const char *profile_path;
+static int64_t profile_checksum;
+static int64_t *profile_counters;
+static int profile_size;
+
+static void profile_write(void) {
+  const char *path = getenv("PULSE_PROFILE");
+  long long checksum, size, count;
+  FILE *f;
+
+  if (!path || !*path)
+    path = profile_path;
+
+  f = fopen(path, "r");
+  if (f) {
+    if (fscanf(f, "pulse-profile %lld %lld", &checksum, &size) == 2
+        && checksum == profile_checksum && size == profile_size) {
+      for (int i = 0; i < profile_size && fscanf(f, "%lld", &count) == 1; i++)
+        profile_counters[i] += count;
+    }
+    fclose(f);
+  }
+
+  f = fopen(path, "w");
+  if (!f) {
+    fprintf(stderr, "cannot write profile %s\n", path);
+    return;
+  }
+  fprintf(f, "pulse-profile %lld %d\n", (long long) profile_checksum, profile_size);
+  for (int i = 0; i < profile_size; i++)
+    fprintf(f, "%lld\n", (long long) profile_counters[i]);
+  fclose(f);
+}
+
+// __declspec(dllexport)    // Uncomment on Windows
+void _profile_start(const char *path, int64_t checksum, int64_t *counters, int size) {
+  profile_path = path;
+  profile_checksum = checksum;
+  profile_counters = counters;
+  profile_size = size;
+  atexit(profile_write);
+}
+
+/* Function timing of a program compiled with --profile. Each function has
+   four counters: calls, self and total time in nanoseconds, and how many
+   of its calls are active, so that only the outermost of a recursion adds
+   to its total. The stack holds, for each active call, the time spent in
+   the calls it made, which does not count as its self time. Times are
+   taken from the cycle counter where there is one, cheaper to read than the
+   clock, and converted to nanoseconds against the clock for the report. The
+   flat profile goes to stderr at exit. */
+
+static const char **timing_names;
+static int64_t *timing_counters;
+static int timing_count;
+static int64_t *timing_stack;
+static int timing_depth, timing_capacity;
+static int64_t timing_started, timing_started_clock;
+
+static int64_t timing_clock(void) {
+  struct timespec now;
+  clock_gettime(CLOCK_MONOTONIC, &now);
+  return (int64_t) now.tv_sec * 1000000000 + now.tv_nsec;
+}
+
+#if defined(__x86_64__) || defined(__i386__)
+#include <x86intrin.h>
+#define timing_now() ((int64_t) __rdtsc())
+#else
+#define timing_now() timing_clock()
+#endif
+
+// __declspec(dllexport)    // Uncomment on Windows
+int64_t _timing_enter(int function) {
+  int64_t *counter = timing_counters + 4 * function;
+
+  counter[0]++;
+  counter[3]++;
+  if (++timing_depth == timing_capacity) {
+    timing_capacity *= 2;
+    timing_stack = realloc(timing_stack, timing_capacity * sizeof(int64_t));
+  }
+  timing_stack[timing_depth] = 0;
+  return timing_now();
+}
+
+// __declspec(dllexport)    // Uncomment on Windows
+void _timing_exit(int function, int64_t start) {
+  int64_t *counter = timing_counters + 4 * function;
+  int64_t elapsed = timing_now() - start;
+
+  counter[1] += elapsed - timing_stack[timing_depth--];
+  if (--counter[3] == 0)
+    counter[2] += elapsed;
+  timing_stack[timing_depth] += elapsed;
+}
+
+static int timing_order(const void *a, const void *b) {
+  int64_t x = timing_counters[4 * *(const int *) a + 1];
+  int64_t y = timing_counters[4 * *(const int *) b + 1];
+  return (x < y) - (x > y);
+}
+
+// __declspec(dllexport)    // Uncomment on Windows
+void _timing_report(void) {
+  int64_t elapsed = 0;
+  double ms;
+  int *order;
+  int n = 0;
+
+  if (!timing_counters)
+    return;
+  _output_flush();
+  ms = (timing_clock() - timing_started_clock) / 1e6 / (timing_now() - timing_started);
+
+  order = malloc(timing_count * sizeof(int));
+  for (int i = 0; i < timing_count; i++) {
+    if (timing_counters[4 * i])
+      order[n++] = i;
+    elapsed += timing_counters[4 * i + 1];
+  }
+  qsort(order, n, sizeof(int), timing_order);
+
+  fprintf(stderr, "%7s %12s %12s %12s  %s\n", "% self", "calls", "self ms", "total ms", "function");
+  for (int i = 0; i < n; i++) {
+    int64_t *counter = timing_counters + 4 * order[i];
+    fprintf(stderr, "%7.2f %12lld %12.3f %12.3f  %s\n",
+            elapsed ? 100.0 * counter[1] / elapsed : 0.0, (long long) counter[0],
+            counter[1] * ms, counter[2] * ms, timing_names[order[i]]);
+  }
+  free(order);
+  timing_counters = NULL;
+}
+
+// __declspec(dllexport)    // Uncomment on Windows
+void _timing_start(const char **names, int64_t *counters, int count) {
+  if (!timing_stack) {
+    timing_capacity = 1024;
+    timing_stack = malloc(timing_capacity * sizeof(int64_t));
+    atexit(_timing_report);
+  }
+  timing_names = names;
+  timing_counters = counters;
+  timing_count = count;
+  timing_depth = 0;
+  timing_stack[0] = 0;
+  timing_started_clock = timing_clock();
+  timing_started = timing_now();
 }
 
 /* Bootstrapping code for a stand-alone executable */
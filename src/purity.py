@@ -0,0 +1,72 @@
+# Pulse purity - finds the functions whose result depends only on their
+# arguments, which memo functions must be
+
+from error import error
+from ast import *
+
+# results each memo function keeps cached, unless compiled with another size
+MEMO_SIZE = 4096
+
+class PurityChecker(NodeVisitor):
+    '''
+    Looks for the first thing in a function body that makes it impure.
+    '''
+    def __init__(self, function, pure, variables):
+        self.name = function.name
+        self.pure = pure
+        self.variables = variables
+        self.locals = {param.name for param in function.params}
+        self.reason = None
+
+    def impure(self, reason):
+        if self.reason is None:
+            self.reason = reason
+
+    def visit_VarDeclaration(self, node):
+        self.locals.add(node.name)
+        return [node.value]
+
+    def visit_WriteLocation(self, node):
+        if node.location.name not in self.locals:
+            self.impure(f"assigns to global '{node.location.name}'")
+        return [node.value]
+
+    def visit_ReadLocation(self, node):
+        name = node.location.name
+        if name not in self.locals and name in self.variables:
+            self.impure(f"reads global variable '{name}'")
+
+    def visit_PrintStatement(self, node):
+        self.impure("prints")
+        return [node.value]
+
+    def visit_FuncCall(self, node):
+        if node.name != self.name and node.name not in self.pure:
+            self.impure(f"calls '{node.name}', which is not pure")
+        return [node.arguments]
+
+def pure_functions(ast, variables=None, reasons=None):
+    '''
+    Maps each function of a checked program to None if it is pure, or else
+    the reason it is not. A pure function does not print, assign to or read
+    global variables (constants are fine) or call impure functions. To carry
+    on from the statements before ast, pass the global variables they declare
+    and their reasons, which are updated.
+    '''
+    variables = set() if variables is None else variables
+    reasons = {} if reasons is None else reasons
+    for node in ast:
+        if isinstance(node, VarDeclaration):
+            variables.add(node.name)
+        elif isinstance(node, FuncDeclaration):
+            pure = {name for name, reason in reasons.items() if reason is None}
+            checker = PurityChecker(node, pure, variables)
+            checker.visit(node.body)
+            reasons[node.name] = checker.reason
+    return reasons
+
+def check_memo(ast, variables=None, reasons=None):
+    reasons = pure_functions(ast, variables, reasons)
+    for node in ast:
+        if isinstance(node, FuncDeclaration) and node.memo and reasons[node.name]:
+            error(node.lineno, f"Memo function '{node.name}' must be pure, but it {reasons[node.name]}")
@@ -0,0 +1,309 @@
+# Pulse language server - incremental diagnostics for editors
+
+from bisect import bisect_left, bisect_right
+
+from error import collect_errors
+from lexer import PulseLexer
+from parser import PulseParser
+from validator import CheckProgramVisitor
+from purity import check_memo
+from ast import *
+
+class Chunk(object):
+    '''
+    One top-level statement of a document, together with the whitespace and
+    comments in front of it. Chunks partition the text: each one starts
+    where the previous one ends.
+    '''
+    def __init__(self, start, line):
+        self.start = start
+        self.end = start
+        self.line = line
+
+        self.tokens = []
+        self.diagnostics = []
+        self.statements = []
+        self.nodes = []
+        self.names = set()
+        self.defines = set()
+
+        # results of the last semantic check
+        self.signature = None
+        self.checked = []
+        self.symbols = {}
+        self.functions = {}
+
+        # results of the last memo function check
+        self.purity = None
+        self.memo = []
+        self.variables = set()
+        self.reasons = {}
+
+    def parse(self):
+        with collect_errors() as diagnostics, field_checks(False):
+            statements = PulseParser().parse(iter(self.tokens))
+
+        self.diagnostics.extend(diagnostics)
+        self.statements = statements or []
+        self.tokens = None
+        self.nodes = [node for _, node in flatten(self.statements)]
+
+        for node in self.nodes:
+            if isinstance(node, (VarDeclaration, ConstDeclaration, FuncDeclaration)):
+                self.defines.add(node.name)
+                self.names.add(node.name)
+            elif isinstance(node, (SimpleLocation, FuncCall)):
+                self.names.add(node.name)
+
+    def shift(self, offset, lines):
+        self.start += offset
+        self.end += offset
+
+        if lines:
+            self.line += lines
+            for node in self.nodes:
+                node.lineno += lines
+            self.diagnostics = shift_diagnostics(self.diagnostics, lines)
+            self.checked = shift_diagnostics(self.checked, lines)
+            self.memo = shift_diagnostics(self.memo, lines)
+
+def shift_diagnostics(diagnostics, lines):
+    return [(lineno + lines if isinstance(lineno, int) else lineno, msg)
+            for lineno, msg in diagnostics]
+
+def common_prefix(a, b):
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def common_suffix(a, b, limit):
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a)-mid:] == b[len(b)-mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class Document(object):
+    def __init__(self, text=''):
+        self.text = ''
+        self.chunks = [Chunk(0, 1)]
+        self.chunks[0].parse()
+        self.edit(0, 0, text)
+
+    def update(self, text):
+        '''
+        Replace the whole buffer, re-lexing only the region that differs.
+        '''
+        start = common_prefix(self.text, text)
+        suffix = common_suffix(self.text, text, min(len(self.text), len(text)) - start)
+        self.edit(start, len(self.text) - suffix, text[start:len(text)-suffix])
+
+    def edit(self, start, end, text):
+        '''
+        Replace self.text[start:end] with text.
+        '''
+        removed = self.text[max(start - 1, 0):end + 1]
+        self.text = self.text[:start] + text + self.text[end:]
+        offset = len(text) - (end - start)
+
+        # the chunk ending right at the edit is included, as the edit may
+        # continue its statement (e.g. an else after a closing brace), and so
+        # is one only whitespace or comments separate from the edit
+        ends = [chunk.end for chunk in self.chunks]
+        first = min(bisect_left(ends, start), len(self.chunks) - 1)
+        head = self.text[self.chunks[first].start:start].lstrip()
+        if first and (not head or head.startswith('/')):
+            first -= 1
+
+        # adding or removing a comment delimiter changes how an unclosed /*
+        # before the edit lexes: as two tokens or as the start of a comment.
+        # Such a /* can only follow the last */, which would have closed it
+        inserted = self.text[max(start - 1, 0):start + len(text) + 1]
+        if any(delimiter in part for delimiter in ('/*', '*/') for part in (removed, inserted)):
+            opener = self.text.find('/*', max(self.text.rfind('*/', 0, start) - 1, 0), start)
+            if opener >= 0:
+                first = min(first, bisect_right(ends, opener))
+
+        # old chunk boundaries past the edit, where re-lexing can stop
+        resync = {chunk.end + offset: n for n, chunk in enumerate(self.chunks)
+                  if n >= first and chunk.end >= end}
+
+        chunks, last = self.relex(self.chunks[first].start, self.chunks[first].line,
+                                  start + len(text), resync)
+
+        for chunk in chunks:
+            chunk.parse()
+
+        rest = self.chunks[last+1:]
+        if rest:
+            lines = chunks[-1].line + self.text.count('\n', chunks[-1].start, chunks[-1].end) - rest[0].line
+            for chunk in rest:
+                chunk.shift(offset, lines)
+
+        self.chunks[first:] = chunks + rest
+        self.checker = None
+
+    def relex(self, start, line, edit_end, resync):
+        '''
+        Split the text from start into chunks until a chunk boundary lines up
+        with an old one past the edit. Returns the new chunks and the index of
+        the old chunk they end with.
+        '''
+        with collect_errors() as lex_errors:
+            tokens = PulseLexer().tokenize(self.text, line, start)
+            chunks = [Chunk(start, line)]
+            depth = 0
+            closed = False
+
+            while True:
+                mark = len(lex_errors)
+                tok = next(tokens, None)
+                chunk = chunks[-1]
+
+                # a statement ends after a ';' or '}' at the top level, but an
+                # if block is only finished once we know no else follows
+                if closed and (tok is None or tok.type != 'ELSE'):
+                    closed = False
+                    end = chunk.tokens[-1].end
+                    chunk.end = end
+                    chunk.diagnostics.extend(lex_errors[:mark])
+                    del lex_errors[:mark]
+                    if end >= edit_end and end in resync:
+                        return chunks, resync[end]
+
+                    line = chunk.line + self.text.count('\n', chunk.start, end)
+                    chunk = Chunk(end, line)
+                    chunks.append(chunk)
+
+                if tok is None:
+                    chunk.end = len(self.text)
+                    chunk.diagnostics.extend(lex_errors)
+                    return chunks, len(self.chunks) - 1
+
+                chunk.tokens.append(tok)
+                if tok.type == 'LBRACE':
+                    depth += 1
+                elif tok.type == 'RBRACE':
+                    depth = max(depth - 1, 0)
+                    closed = depth == 0
+                elif tok.type == 'SEMI':
+                    closed = depth == 0
+
+    def signature(self, checker, chunk):
+        '''
+        What a chunk's check depends on: the types of the globals and the
+        signatures of the functions it names, plus where its own names were
+        previously defined (for redefinition errors).
+        '''
+        signature = []
+        for name in chunk.names:
+            symbol = checker.symbols.get(name)
+            func = checker.functions.get(name)
+            entry = (name,
+                     symbol and (type(symbol), symbol.type),
+                     func and (tuple(param.type for param in func.params), func.datatype.type))
+            if name in chunk.defines:
+                entry += (symbol and symbol.lineno, func and func.lineno)
+            signature.append(entry)
+
+        return tuple(signature)
+
+    def check(self):
+        '''
+        Check the chunks in order, re-running the checker only on chunks that
+        were re-parsed or whose dependencies changed.
+        '''
+        checker = CheckProgramVisitor()
+        for chunk in self.chunks:
+            signature = self.signature(checker, chunk)
+            if signature == chunk.signature:
+                checker.symbols.update(chunk.symbols)
+                checker.functions.update(chunk.functions)
+                continue
+
+            # drop the types from the last check so nothing stale survives
+            for node in chunk.nodes:
+                node.type = None
+
+            before = {name: (checker.symbols.get(name), checker.functions.get(name))
+                      for name in chunk.defines}
+            with collect_errors() as diagnostics:
+                checker.visit(chunk.statements)
+
+            chunk.signature = signature
+            chunk.checked = diagnostics
+            chunk.symbols = {name: checker.symbols[name] for name in chunk.defines
+                             if checker.symbols.get(name) is not before[name][0]}
+            chunk.functions = {name: checker.functions[name] for name in chunk.defines
+                               if checker.functions.get(name) is not before[name][1]}
+
+        self.check_memo()
+        self.checker = checker
+
+    def check_memo(self):
+        '''
+        Check the memo functions, re-running the purity check only on chunks
+        where a global they name was declared or a function they call became
+        pure or impure.
+        '''
+        variables = set()
+        reasons = {}
+        for chunk in self.chunks:
+            purity = tuple((name, name in variables, name in reasons and reasons[name] is None)
+                           for name in chunk.names)
+            if purity != chunk.purity:
+                chunk.variables = variables & chunk.names
+                known = {name: reasons[name] for name in chunk.names if name in reasons}
+                with collect_errors() as diagnostics:
+                    check_memo(chunk.statements, chunk.variables, known)
+
+                chunk.purity = purity
+                chunk.memo = diagnostics
+                chunk.reasons = {name: known[name] for name in chunk.defines if name in known}
+
+            variables |= chunk.variables
+            reasons.update(chunk.reasons)
+
+    def diagnostics(self):
+        if self.checker is None:
+            self.check()
+
+        return [diagnostic for chunk in self.chunks
+                for diagnostic in chunk.diagnostics + chunk.checked + chunk.memo]
+
+    @property
+    def ast(self):
+        return [statement for chunk in self.chunks for statement in chunk.statements]
+
+def main():
+    '''
+    Reads one JSON request per line on stdin, either {"text": ...} with the
+    whole buffer or {"start": ..., "end": ..., "text": ...} with an edit, and
+    answers each with a line of {"diagnostics": [...]}.
+    '''
+    import sys
+    import json
+
+    document = Document()
+    for request in sys.stdin:
+        request = json.loads(request)
+        if 'start' in request:
+            document.edit(request['start'], request['end'], request['text'])
+        else:
+            document.update(request['text'])
+
+        diagnostics = [{'line': lineno, 'message': msg}
+                       for lineno, msg in document.diagnostics()]
+        print(json.dumps({'diagnostics': diagnostics}), flush=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# Pulse tail calls - self tail calls and linear recursion turned into loops
+
+from cfg import Value, Instruction, Block, Names
+from inline import local_names
+
+# integer operations a recursive result can be combined with through an
+# accumulator, as they are associative and commutative even as they wrap
+ACCUMULATORS = {'ADDI': 0, 'MULI': 1}
+
+def reads_locals(inst, locals_):
+    # e in func(...) OP e can be computed before the recursion instead of
+    # after it if it only reads variables the call cannot change
+    if inst.result is None or inst.opcode in ('CALL', 'DIVI'):
+        return False
+    return not inst.opcode.startswith('LOAD') or inst.operands[0] in locals_
+
+def self_tail_call(func, block, locals_):
+    '''
+    For a block ending in return func(...), or return func(...) OP e with OP
+    in ACCUMULATORS, the call and the OP instruction (or None).
+    '''
+    code = block.instructions
+    if len(code) < 2 or code[-1].opcode != 'RET':
+        return None
+
+    returned = code[-1].operands[0]
+    if code[-2].opcode == 'CALL' and code[-2].result is returned:
+        call, combine = code[-2], None
+    elif code[-2].result is returned and code[-2].opcode in ACCUMULATORS:
+        n = len(code) - 3
+        while n >= 0 and reads_locals(code[n], locals_):
+            n -= 1
+        if n < 0 or code[n].opcode != 'CALL' or code[n].result not in code[-2].operands:
+            return None
+        call, combine = code[n], code[-2]
+    else:
+        return None
+
+    if call.operands[0] != func.name or len(call.result.uses) != 1:
+        return None
+    return call, combine
+
+def eliminate_tail_calls(functions):
+    '''
+    Turn calls a function makes to itself as the last thing before it
+    returns into stores to its parameters and a branch back to the start.
+    Where the recursive result is added to or multiplied by another value,
+    that value goes into an accumulator instead, which every other return
+    then applies.
+    '''
+    names = Names(functions)
+
+    for func in functions:
+        # recursive calls of a memo function should hit its cache
+        if func.memo:
+            continue
+
+        locals_ = local_names(func)
+        sites = [(block, *site) for block in func
+                 for site in [self_tail_call(func, block, locals_)] if site is not None]
+        if not sites:
+            continue
+
+        opcodes = {combine.opcode for _, _, combine in sites if combine is not None}
+        if len(opcodes) > 1:
+            sites = [site for site in sites if site[2] is None]
+            opcodes = set()
+            if not sites:
+                continue
+
+        start = split_entry(func, names)
+        accumulator = None
+        if opcodes:
+            opcode = opcodes.pop()
+            accumulator = f'accumulator.{names.copy()}'
+            identity = Value(names.register())
+            entry = func.entry
+            entry.insert(0, Instruction('ALLOCI', [accumulator]))
+            entry.insert(len(entry.instructions) - 1, Instruction('MOVI', [ACCUMULATORS[opcode]], identity))
+            entry.insert(len(entry.instructions) - 1, Instruction('STOREI', [identity, accumulator]))
+
+            for block in func:
+                ret = block.terminator
+                if ret is None or ret.opcode != 'RET' or any(block is site[0] for site in sites):
+                    continue
+                total = Value(names.register())
+                result = Value(names.register())
+                position = len(block.instructions) - 1
+                block.insert(position, Instruction('LOADI', [accumulator], total))
+                block.insert(position + 1, Instruction(opcode, [total, ret.operands[0]], result))
+                ret.rewrite('RET', [result])
+
+        for block, call, combine in sites:
+            arguments = call.operands[1:]
+            ret = block.terminator
+            ret.remove()
+            if combine is not None:
+                other = combine.operands[1] if combine.operands[0] is call.result else combine.operands[0]
+                total = Value(names.register())
+                block.insert(block.instructions.index(call), Instruction('LOADI', [accumulator], total))
+                combine.rewrite(combine.opcode, [total, other])
+                block.append(Instruction('STOREI', [combine.result, accumulator]))
+            call.remove()
+            for (pname, ptype), arg in zip(func.parameters, arguments):
+                block.append(Instruction('STORE' + ptype, [arg, pname]))
+            block.append(Instruction('BRANCH', [start]))
+
+        func.link()
+
+def split_entry(func, names):
+    '''
+    Move the code of the entry block, other than the function's variable
+    allocations, into a new block for tail calls to branch back to. Every
+    allocation moves to the entry block so that looping does not grow the
+    stack.
+    '''
+    entry = func.entry
+    start = Block(names.label())
+    allocs = []
+    for block in func:
+        for inst in list(block):
+            if inst.opcode.startswith('ALLOC'):
+                block.instructions.remove(inst)
+                allocs.append(inst)
+
+    for inst in list(entry):
+        start.append(inst)
+    entry.instructions = []
+    for inst in allocs:
+        entry.append(inst)
+    entry.append(Instruction('BRANCH', [start]))
+
+    func.blocks.insert(1, start)
+    func.link()
+    return start
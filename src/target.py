@@ -0,0 +1,36 @@
+# Pulse target - what LLVM may assume about the machine it generates code for,
+# and how hard it tries to vectorize and unroll loops
+
+class TargetOptions(object):
+    '''
+    The CPU and feature string for the target machine ('' for generic code,
+    'native' for the host's), and switches for the loop and SLP vectorizers
+    and loop unrolling (None leaves them to the optimization level).
+    '''
+    def __init__(self, cpu='', features='', vectorize=None, unroll=None):
+        self.cpu = cpu
+        self.features = features
+        self.vectorize = vectorize
+        self.unroll = unroll
+
+    def __repr__(self):
+        return (f'TargetOptions(cpu={self.cpu!r}, features={self.features!r}, '
+                f'vectorize={self.vectorize}, unroll={self.unroll})')
+
+def add_target_arguments(parser):
+    import argparse
+
+    parser.add_argument('--target-cpu', default='', metavar='CPU',
+                        help="CPU to generate code for, 'native' for this one (default generic)")
+    parser.add_argument('--target-features', default='', metavar='FEATURES',
+                        help="LLVM feature string such as +avx2,+fma, or 'native'")
+    parser.add_argument('--vectorize', action=argparse.BooleanOptionalAction,
+                        help="run the loop and SLP vectorizers (default: LLVM's, only the loop one)")
+    parser.add_argument('--unroll', action=argparse.BooleanOptionalAction,
+                        help='unroll loops (default: on at -O1 and up)')
+    parser.add_argument('--remarks', metavar='PASSES',
+                        help="print LLVM's optimization remarks from passes matching this "
+                             "regex, e.g. loop-vectorize")
+
+def target_options(args):
+    return TargetOptions(args.target_cpu, args.target_features, args.vectorize, args.unroll)
@@ -1,9 +1,11 @@
 # Pulse semantics checker and validator
 
 from collections import ChainMap
-from error import error
+from operator import attrgetter
+from error import error, collect_errors
 from ast import *
 from type import *
+from purity import check_memo
 
 class CheckProgramVisitor(NodeVisitor):
 
@@ -24,11 +26,11 @@ class CheckProgramVisitor(NodeVisitor):
             return
 
         if node.name not in self.symbols:
-            self.visit(node.datatype)
+            yield node.datatype
 
             if node.datatype.type:
                 if node.value:
-                    self.visit(node.value)
+                    yield node.value
 
                     if node.value.type:
                         if node.value.type == node.datatype.type:
@@ -48,7 +50,7 @@ class CheckProgramVisitor(NodeVisitor):
 
     def visit_ConstDeclaration(self, node):
         if node.name not in self.symbols:
-            self.visit(node.value)
+            yield node.value
             node.type = node.value.type
             self.symbols[node.name] = node
         else:
@@ -68,32 +70,32 @@ class CheckProgramVisitor(NodeVisitor):
         node.type = BoolType
 
     def visit_PrintStatement(self, node):
-        self.visit(node.value)
+        yield node.value
 
     def visit_IfStatement(self, node):
-        self.visit(node.condition)
+        yield node.condition
 
         cond_type = node.condition.type
         if cond_type:
             if issubclass(node.condition.type, BoolType):
-                self.visit(node.true_block)
-                self.visit(node.false_block)
+                yield node.true_block
+                yield node.false_block
             else:
                 error(node.lineno, f"'Condition must be of type 'bool' but got type '{cond_type.name}'")
 
     def visit_WhileStatement(self, node):
-        self.visit(node.condition)
+        yield node.condition
 
         cond_type = node.condition.type
         if cond_type:
             if issubclass(node.condition.type, BoolType):
-                self.visit(node.body)
+                yield node.body
             else:
                 error(node.lineno, f"'Condition must be of type 'bool' but got type '{cond_type.name}'")
 
     def visit_BinOp(self, node):
-        self.visit(node.left)
-        self.visit(node.right)
+        yield node.left
+        yield node.right
 
         node.type = None
         if node.left.type and node.right.type:
@@ -106,7 +108,7 @@ class CheckProgramVisitor(NodeVisitor):
             node.type = op_type
 
     def visit_UnaryOp(self, node):
-        self.visit(node.right)
+        yield node.right
 
         node.type = None
         if node.right.type:
@@ -118,8 +120,8 @@ class CheckProgramVisitor(NodeVisitor):
             node.type = op_type
 
     def visit_WriteLocation(self, node):
-        self.visit(node.location)
-        self.visit(node.value)
+        yield node.location
+        yield node.value
 
         node.type = None
         if node.location.type and node.value.type:
@@ -136,7 +138,7 @@ class CheckProgramVisitor(NodeVisitor):
                       f"Cannot assign type '{node.value.type.name}' to variable '{node.location.name}' of type '{node.location.type.name}'")
 
     def visit_ReadLocation(self, node):
-        self.visit(node.location)
+        yield node.location
         node.type = node.location.type
 
     def visit_SimpleLocation(self, node):
@@ -152,11 +154,11 @@ class CheckProgramVisitor(NodeVisitor):
             error(node.lineno, f"Invalid type '{node.name}'")
 
     def visit_FuncParameter(self, node):
-        self.visit(node.datatype)
+        yield node.datatype
         node.type = node.datatype.type
 
     def visit_ReturnStatement(self, node):
-        self.visit(node.value)
+        yield node.value
         if self.expected_ret_type:
             self.current_ret_type = node.value.type
             if node.value.type and node.value.type != self.expected_ret_type:
@@ -169,7 +171,7 @@ class CheckProgramVisitor(NodeVisitor):
             prev_def = self.functions[node.name].lineno
             error(node.lineno, f"Function '{node.name}' already defined at line {prev_def}")
 
-        self.visit(node.params)
+        yield node.params
 
         param_types_ok = all((param.type is not None for param in node.params))
         param_names = [param.name for param in node.params]
@@ -177,7 +179,7 @@ class CheckProgramVisitor(NodeVisitor):
         if not param_names_ok:
             error(node.lineno, "Duplicate parameter names at function definition")
 
-        self.visit(node.datatype)
+        yield node.datatype
         ret_type_ok = node.datatype.type is not None
 
         if self.temp_symbols:
@@ -192,7 +194,7 @@ class CheckProgramVisitor(NodeVisitor):
             self.expected_ret_type = node.datatype.type
 
             self.recursion = node
-            self.visit(node.body)
+            yield node.body
 
             if not self.current_ret_type:
                 error(node.lineno, f"Function '{node.name}' has no return statement")
@@ -206,37 +208,181 @@ class CheckProgramVisitor(NodeVisitor):
             self.recursion = None
 
     def visit_FuncCall(self, node):
-        if node.name not in self.functions and node.name != self.recursion.name:
+        node.type = None
+        recursive = self.recursion is not None and node.name == self.recursion.name
+        if node.name not in self.functions and not recursive:
             error(node.lineno, f"Function '{node.name}' is not declared")
         else:
-            self.visit(node.arguments)
+            yield node.arguments
 
-            arg_types = tuple([arg.type.name for arg in node.arguments])
-            
-            if node.name == self.recursion.name:
+            if recursive:
                 func = self.recursion
             else:
                 func = self.functions[node.name]
-                
-            expected_types = tuple([param.type.name for param in func.params])
-            if arg_types != expected_types:
-                error(node.lineno, f"Function '{node.name}' expects {expected_types}, but was called with {arg_types}")
+
+            # an argument or parameter without a type has been reported already
+            if all(arg.type for arg in node.arguments) and all(param.type for param in func.params):
+                arg_types = tuple([arg.type.name for arg in node.arguments])
+                expected_types = tuple([param.type.name for param in func.params])
+                if arg_types != expected_types:
+                    error(node.lineno, f"Function '{node.name}' expects {expected_types}, but was called with {arg_types}")
 
             node.type = func.datatype.type
 
-def check_program(ast):
+class RecordingDict(dict):
+    '''
+    Global table that logs every assignment together with the position of
+    the top-level statement making it, so a worker can rebuild the scope
+    any function body sees.
+    '''
+    def __init__(self, log, kind):
+        super().__init__()
+        self.log = log
+        self.kind = kind
+        self.position = 0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.log.append((self.position, self.kind, key, value))
+
+def _child_getter(fields):
+    if not fields:
+        return lambda node: ()
+    if len(fields) == 1:
+        get = attrgetter(fields[0])
+        return lambda node: (get(node),)
+    return attrgetter(*fields)
+
+_children = {cls: _child_getter(cls._children) for cls in AST._nodes.values()}
+
+def _walk(node):
+    '''
+    All nodes below node in a fixed order, so types collected in a worker
+    can be put back on the same nodes here without shipping the tree.
+    '''
+    nodes = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.__class__ is list:
+            stack.extend(node)
+        elif node is not None:
+            nodes.append(node)
+            stack.extend(_children[node.__class__](node))
+    return nodes
+
+# state of a body-checking worker process, see check_program_parallel
+_worker_ast = None
+_worker_log = None
+
+def _init_worker(ast, log):
+    global _worker_ast, _worker_log
+    _worker_ast = ast
+    _worker_log = log
+
+def _check_bodies(positions):
     checker = CheckProgramVisitor()
-    checker.visit(ast)
+    tables = {'symbols': checker.symbols, 'functions': checker.functions}
+    replayed = 0
+
+    results = []
+    for position in positions:
+        while replayed < len(_worker_log) and _worker_log[replayed][0] < position:
+            _, kind, key, value = _worker_log[replayed]
+            tables[kind][key] = value
+            replayed += 1
+
+        node = _worker_ast[position]
+        with collect_errors() as diagnostics:
+            checker.visit(node)
+        registered = checker.functions.get(node.name) is node
+        types = [child.type for child in _walk(node)]
+        results.append((position, types, diagnostics, registered))
+
+    return results
+
+def check_program_parallel(ast, jobs):
+    '''
+    Check in two phases: top-level statements and function signatures in
+    order, then all function bodies at once on a pool of workers. Diagnostics
+    are reported sorted by line.
+    '''
+    from multiprocessing import Pool
+
+    log = []
+    checker = CheckProgramVisitor()
+    checker.symbols = RecordingDict(log, 'symbols')
+    checker.functions = RecordingDict(log, 'functions')
+
+    bodies = []
+    with collect_errors() as diagnostics:
+        for position, node in enumerate(ast):
+            checker.symbols.position = checker.functions.position = position
+            if not isinstance(node, FuncDeclaration):
+                checker.visit(node)
+                continue
+
+            # the workers report these again when checking the whole function
+            with collect_errors():
+                checker.visit(node.params)
+                checker.visit(node.datatype)
+
+            # assume the body turns out fine, which is checked afterwards
+            if node.datatype.type is not None:
+                checker.functions[node.name] = node
+            bodies.append(position)
+
+    batches = [bodies[n::jobs*4] for n in range(jobs*4)]
+    batches = [batch for batch in batches if batch]
+    try:
+        with Pool(jobs, _init_worker, (ast, log)) as pool:
+            results = [result for batch in pool.map(_check_bodies, batches) for result in batch]
+    except Exception:
+        # without fork the tree is pickled, which fails on very deep ones
+        # (MaybeEncodingError, RecursionError), and a body checked against
+        # a function assumed to be fine may trip over its missing types
+        results = None
+
+    if results is not None and all(registered == (ast[position].datatype.type is not None)
+                                   for position, _, _, registered in results):
+        for position, types, body_diagnostics, _ in results:
+            for node, type in zip(_walk(ast[position]), types):
+                node.type = type
+            diagnostics.extend(body_diagnostics)
+    else:
+        # a function some later code relies on was not registered after all,
+        # or the workers could not be started
+        with collect_errors() as diagnostics:
+            CheckProgramVisitor().visit(ast)
+
+    for lineno, msg in sorted(diagnostics, key=lambda diagnostic: diagnostic[0]):
+        error(lineno, msg)
+
+def check_program(ast, jobs=1):
+    if jobs > 1 and ast:
+        check_program_parallel(ast, jobs)
+    else:
+        checker = CheckProgramVisitor()
+        checker.visit(ast)
+
+    if ast:
+        check_memo(ast)
 
 def main():
     import sys
-    from .parser import parse
+    from parser import parse
 
     if len(sys.argv) < 2:
         raise SystemExit(1)
 
-    ast = parse(open(sys.argv[1]).read())
-    check_program(ast)
+    jobs = 1
+    for arg in sys.argv[2:]:
+        if arg.startswith('-j'):
+            jobs = int(arg[2:])
+
+    with open(sys.argv[1]) as source:
+        ast = parse(source)
+    check_program(ast, jobs)
     if '--show-types' in sys.argv:
         for depth, node in flatten(ast):
             print('%s: %s%s type: %s' % (getattr(node, 'lineno', None), ' '*(4*depth), node,
@@ -0,0 +1,314 @@
+# Runs the examples, edge case programs and random programs through the
+# interpreter, the JIT and executables at every optimization level, and
+# checks that they all print what the interpreter prints at -O0
+#
+#   python -O tests/differential.py [random programs] [first seed]
+
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PULSE = os.path.join(ROOT, 'src', 'pulse.py')
+
+from fuzz import Generator
+
+# fib.pulse as it is prints fibonacci(0..49), far too slow to interpret
+EXAMPLES = {
+    'mandel': ('examples/mandel.pulse', {}),
+    'fib': ('examples/fib.pulse', {'LAST <- 50': 'LAST <- 20'}),
+}
+
+EDGE_CASES = {
+    'integer overflow': '''
+function add(a int, b int) int { return a + b; }
+function mul(a int, b int) int { return a * b; }
+function div(a int, b int) int { return a / b; }
+function main() int {
+    print(2147483647 + 1);
+    print(add(2147483647, 1));
+    print(-2147483647 - 2);
+    print(add(-2147483647, -2));
+    print(65536 * 65536);
+    print(mul(46341, 46341));
+    print(-7 / 2);
+    print(div(-7, 2));
+    print(div(7, -2));
+    print(div(-7, -2));
+    print(div(-2147483647 - 1, 1));
+    return 0;
+}
+''',
+    'INT_MIN / -1': '''
+function main() int {
+    var a int <- -2147483647 - 1;
+    print(a / -1);
+    return 0;
+}
+''',
+    'INT_MIN / -1 folded': '''
+function main() int {
+    print((-2147483647 - 1) / -1);
+    return 0;
+}
+''',
+    'division by zero': '''
+function div(a int, b int) int { return a / b; }
+function main() int {
+    print(div(7, 0));
+    return 0;
+}
+''',
+    'guarded division in a loop': '''
+function sum(d int) int {
+    var i int <- 0;
+    var s int <- 0;
+    while i < 5 {
+        if d != 0 && d != -1 {
+            s <- s + 100 / d;
+        }
+        i <- i + 1;
+    }
+    return s;
+}
+function main() int {
+    print(sum(0));
+    print(sum(-1));
+    print(sum(3));
+    return 0;
+}
+''',
+    'floats': '''
+function half(x float) float { return x / 2.0; }
+memo function inv(x float) float { return 1.0 / x; }
+function main() int {
+    var z float <- 0.0;
+    print(z * -1.0);
+    print(0.0 * -1.0);
+    print(0.0);
+    print(1.0 / 3.0);
+    print(half(1.0e10));
+    print(1.0 / z);
+    print(-1.0 / z);
+    print(z / z);
+    print(z < z / z);
+    print(z / z != z / z);
+    print(inv(z));
+    print(inv(z * -1.0));
+    print(inv(z / z));
+    print(inv(z / z));
+    return 0;
+}
+''',
+    'short circuit': '''
+var hits int <- 0;
+var g bool <- (hits > 0) || (hits = 0);
+function touch(v bool) bool {
+    hits <- hits + 1;
+    return v;
+}
+function main() int {
+    var i int <- 0;
+    while i < 5 && touch(true) {
+        if touch(i > 2) || touch(false) && !touch(true) {
+            print(i);
+        } else {
+            print(0 - i);
+        }
+        var b bool <- touch(false) && touch(true);
+        var c bool <- touch(true) || touch(false);
+        if b = c { print(1); } else { print(2); }
+        if !(touch(true) && touch(false)) { print(3); }
+        i <- i + 1;
+    }
+    print(hits);
+    if g { print(7); }
+    return 0;
+}
+''',
+    'tail calls': '''
+var calls int <- 0;
+function fact(n int) int {
+    if n <= 1 { return 1; }
+    return n * fact(n - 1);
+}
+function gcd(a int, b int) int {
+    calls <- calls + 1;
+    if b = 0 { return a; }
+    return gcd(b, a - (a / b) * b);
+}
+function sum(n int) int {
+    if n = 0 { return 0; }
+    print(n);
+    return sum(n - 1) + n;
+}
+function twice(n int) int {
+    if n = 0 { return 0; }
+    var k int <- n - 1;
+    return twice(k) + n * 2 + k;
+}
+function tally(n int) int {
+    calls <- calls + 1;
+    if n = 0 { return 0; }
+    return tally(n - 1) + calls;
+}
+function deep(n int, acc int) int {
+    if n = 0 { return acc; }
+    return deep(n - 1, acc + n);
+}
+function mixed(n int) int {
+    if n < 2 { return n; }
+    if n < 10 { return mixed(n - 1) * 2; }
+    return mixed(n - 3) + 1;
+}
+function grow(x float) float {
+    if x > 100.0 { return x; }
+    return grow(x * 1.5) + 0.1;
+}
+function main() int {
+    print(fact(12));
+    print(fact(20));
+    print(gcd(1071, 462));
+    print(calls);
+    print(sum(5));
+    print(twice(100));
+    print(tally(10));
+    print(deep(1000, 0));
+    print(mixed(25));
+    print(grow(1.0));
+    return 0;
+}
+''',
+    'memo functions': '''
+memo function fibonacci(n int) int {
+    if n > 1 { return fibonacci(n-1) + fibonacci(n-2); }
+    return 1;
+}
+memo function scale(x float, k int, b bool) float {
+    if b { return x * 2.0; }
+    return x + 1.0;
+}
+memo function same(c char) char { return c; }
+memo function five() int { return 5; }
+function main() int {
+    var n int <- 0;
+    while n < 40 {
+        print(fibonacci(n));
+        n <- n + 1;
+    }
+    print(scale(1.5, 2, true));
+    print(scale(1.5, 2, false));
+    print(scale(1.5, 2, true));
+    print(same('a'));
+    print(five());
+    print(five());
+    return 0;
+}
+''',
+    'inlining and globals': '''
+const STEP <- 2;
+var calls int <- 0;
+function count(n int) int {
+    calls <- calls + 1;
+    if n = 0 { return 0; }
+    return 1 + count(n - 1);
+}
+function twice(x int) int { return x * STEP + count(x); }
+function pick(x int) int {
+    if x > 3 { return twice(x); } else { if x < 1 { return 0; } }
+    return x;
+}
+function main() int {
+    var i int <- 0;
+    while i < 6 {
+        print(pick(i));
+        print(twice(pick(i + 1)));
+        i <- i + 1;
+    }
+    print(calls);
+    return 0;
+}
+''',
+}
+
+# edge cases that must trap everywhere rather than print
+TRAPS = {'INT_MIN / -1', 'INT_MIN / -1 folded', 'division by zero'}
+
+# how each mode runs a program, and the -O levels that make a difference:
+# the interpreter only runs the Pulse IR passes, which stop at 2
+MODES = {
+    'interpreter': (['--interp'], [1, 2]),
+    'JIT': ([], [0, 1, 2, 3]),
+    'executable': (['--exe'], [0, 1, 2, 3]),
+}
+
+def run(path, flags, level):
+    '''
+    What the program at path prints, or None if it does not exit normally,
+    as a trap loses what a compiled program still had buffered. Also the
+    last line it wrote to stderr.
+    '''
+    result = subprocess.run([sys.executable, '-O', PULSE, 'run', *flags, '-O', str(level), path],
+                            capture_output=True, timeout=600)
+    errors = result.stderr.decode(errors='replace').splitlines()
+    return result.stdout if result.returncode == 0 else None, errors[-1] if errors else ''
+
+def describe(output, error):
+    if output is not None:
+        return f'{len(output.splitlines())} lines'
+    return f'a failure ({error})' if error else 'a trap'
+
+def check(name, source, tmp):
+    '''
+    The runs of source whose output differs from the interpreter's at -O0.
+    '''
+    path = os.path.join(tmp, 'program.pulse')
+    with open(path, 'w') as f:
+        f.write(source)
+
+    expected, error = run(path, ['--interp'], 0)
+    if (expected is None) != (name in TRAPS):
+        return [f'{name}: the interpreter at -O0 gave {describe(expected, error)}']
+
+    failures = []
+    for mode, (flags, levels) in MODES.items():
+        for level in levels:
+            output, error = run(path, flags, level)
+            if output != expected:
+                failures.append(f'{name}: {mode} -O{level} gave {describe(output, error)}, '
+                                f'the interpreter {describe(expected, "")}')
+    return failures
+
+def programs(count, seed):
+    for name, (path, edits) in EXAMPLES.items():
+        with open(os.path.join(ROOT, path)) as f:
+            source = f.read()
+        for old, new in edits.items():
+            source = source.replace(old, new)
+        yield name, source
+    yield from EDGE_CASES.items()
+    for n in range(seed, seed + count):
+        yield f'random program {n}', Generator(n).program()
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    failures = []
+    checked = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, source in programs(count, seed):
+            found = check(name, source, tmp)
+            print(f'{name}: {"FAILED" if found else "ok"}', flush=True)
+            failures += found
+            checked += 1
+
+    for failure in failures:
+        print(failure)
+    print(f'{checked} programs, {len(failures)} mismatches')
+    if failures:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
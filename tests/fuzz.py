@@ -0,0 +1,161 @@
+# Random well-typed Pulse programs for differential testing
+#
+#   python tests/fuzz.py [seed]
+
+import random
+import sys
+
+TYPES = ['int', 'float', 'bool', 'char']
+
+class Generator(object):
+    '''
+    Programs of globals, functions and a main that prints. They only divide
+    by nonzero constants, every loop runs a bounded number of times and main
+    returns 0, so each one exits normally.
+    '''
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.globals = []       # (name, type, assignable)
+        self.functions = []     # (name, parameter types, return type)
+        self.count = 0
+
+    def name(self, prefix):
+        self.count += 1
+        return f'{prefix}{self.count}'
+
+    def literal(self, ty):
+        choice = self.random.choice
+        if ty == 'int':
+            return str(choice([0, 1, 2, 3, 7, 100, 12345, 2147483647, self.random.randint(0, 50)]))
+        if ty == 'float':
+            return choice(['0.0', '1.0', '0.5', '2.5', '3.25', '100.0', '1.5'])
+        if ty == 'bool':
+            return choice(['true', 'false'])
+        return "'" + choice('abcxyz*.') + "'"
+
+    def call(self, ty, scope, depth):
+        functions = [func for func in self.functions if func[2] == ty]
+        if not functions:
+            return None
+        name, parameters, _ = self.random.choice(functions)
+        args = ', '.join(self.expr(pty, scope, depth + 1) for pty in parameters)
+        return f'{name}({args})'
+
+    def expr(self, ty, scope, depth=0):
+        r = self.random
+        variables = [name for name, vty in scope if vty == ty]
+        if depth > 3 or r.random() < 0.25 or ty == 'char':
+            if variables and r.random() < 0.7:
+                return r.choice(variables)
+            return self.literal(ty)
+
+        k = r.random()
+        if ty in ('int', 'float'):
+            if k < 0.45:
+                op = r.choice(['+', '-', '*'])
+                return f'({self.expr(ty, scope, depth+1)} {op} {self.expr(ty, scope, depth+1)})'
+            if k < 0.55:
+                divisor = r.choice(['3', '7', '2'] if ty == 'int' else ['3.0', '0.5', '2.0'])
+                return f'({self.expr(ty, scope, depth+1)} / {divisor})'
+            if k < 0.65:
+                return f'-{self.expr(ty, scope, depth+1)}'
+        else:
+            if k < 0.4:
+                operand = r.choice(['int', 'float', 'int'])
+                op = r.choice(['<', '<=', '>', '>=', '=', '!='])
+                return f'({self.expr(operand, scope, depth+1)} {op} {self.expr(operand, scope, depth+1)})'
+            if k < 0.6:
+                op = r.choice(['&&', '||'])
+                return f'({self.expr(ty, scope, depth+1)} {op} {self.expr(ty, scope, depth+1)})'
+            if k < 0.7:
+                return f'!{self.expr(ty, scope, depth+1)}'
+
+        if k < 0.8:
+            call = self.call(ty, scope, depth)
+            if call:
+                return call
+        return r.choice(variables) if variables else self.literal(ty)
+
+    def block(self, scope, assignable, return_type, depth, indent, loops=0):
+        r = self.random
+        pad = '    ' * indent
+        scope = list(scope)
+        lines = []
+        for _ in range(r.randint(1, 5)):
+            k = r.random()
+            if k < 0.2:
+                ty = r.choice(TYPES)
+                name = self.name('v')
+                lines.append(f'{pad}var {name} {ty} <- {self.expr(ty, scope)};')
+                scope.append((name, ty))
+                assignable.append((name, ty))
+            elif k < 0.4 and assignable:
+                name, ty = r.choice(assignable)
+                lines.append(f'{pad}{name} <- {self.expr(ty, scope)};')
+            elif k < 0.6:
+                ty = r.choice(TYPES + ['int'])
+                if ty == 'bool':
+                    lines.append(f'{pad}if {self.expr(ty, scope)} {{ print(1); }} else {{ print(0); }}')
+                else:
+                    lines.append(f'{pad}print({self.expr(ty, scope)});')
+            elif k < 0.75 and depth < 3:
+                then = self.block(scope, list(assignable), return_type, depth+1, indent+1, loops)
+                other = self.block(scope, list(assignable), return_type, depth+1, indent+1, loops)
+                lines.append(f'{pad}if {self.expr("bool", scope)} {{\n{then}\n{pad}}} else {{\n{other}\n{pad}}}')
+            elif k < 0.87 and depth < 3 and loops < 2:
+                counter = self.name('i')
+                body = self.block(scope + [(counter, 'int')], list(assignable), return_type,
+                                  depth+1, indent+1, loops+1)
+                lines.append(f'{pad}var {counter} int <- 0;')
+                lines.append(f'{pad}while {counter} < {r.randint(0, 6)} {{\n{body}\n'
+                             f'{pad}    {counter} <- {counter} + 1;\n{pad}}}')
+            elif k < 0.93 and return_type:
+                lines.append(f'{pad}return {self.expr(return_type, scope)};')
+                break
+            else:
+                lines.append(f'{pad}print({self.expr("int", scope)});')
+        return '\n'.join(lines)
+
+    def program(self):
+        r = self.random
+        parts = []
+        for _ in range(r.randint(1, 4)):
+            ty = r.choice(['int', 'float', 'int', 'bool'])
+            name = self.name('g')
+            if r.random() < 0.5:
+                parts.append(f'const {name} <- {self.literal(ty)};')
+                self.globals.append((name, ty, False))
+            else:
+                scope = [(gname, gty) for gname, gty, _ in self.globals]
+                parts.append(f'var {name} {ty} <- {self.expr(ty, scope)};')
+                self.globals.append((name, ty, True))
+
+        scope = [(name, ty) for name, ty, _ in self.globals]
+        assignable = [(name, ty) for name, ty, mutable in self.globals if mutable]
+        for _ in range(r.randint(1, 5)):
+            name = self.name('f')
+            parameters = [(self.name('p'), r.choice(['int', 'float', 'bool'])) for _ in range(r.randint(0, 3))]
+            return_type = r.choice(['int', 'float', 'bool'])
+            body = self.block(scope + parameters, assignable + parameters, return_type, 0, 1)
+            body += f'\n    return {self.expr(return_type, scope + parameters)};'
+            params = ', '.join(f'{pname} {pty}' for pname, pty in parameters)
+            parts.append(f'function {name}({params}) {return_type} {{\n{body}\n}}')
+            self.functions.append((name, [pty for _, pty in parameters], return_type))
+
+        # main only returns at the end, as the exit status is not compared
+        body = self.block(scope, list(assignable), None, 0, 1)
+        for name, parameters, _ in self.functions:
+            args = ', '.join(self.expr(pty, scope) for pty in parameters)
+            body += f'\n    print({name}({args}));'
+        for name, ty, _ in self.globals:
+            if ty != 'bool':
+                body += f'\n    print({name});'
+        parts.append(f'function main() int {{\n{body}\n    return 0;\n}}')
+        return '\n'.join(parts) + '\n'
+
+def main():
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    print(Generator(seed).program(), end='')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Checks that the language server's diagnostics after random edits are the
+# ones a document freshly made from the edited text reports
+#
+#   python -O tests/incremental.py [random programs] [edits per program]
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from server import Document
+from fuzz import Generator
+
+# what the edits put in: comment delimiters, statement ends and some code,
+# including memo functions that are pure depending on what the program has
+SNIPPETS = ['/*', '*/', '//', '/* ', ' */', '*', '/', '\n', ';', '{', '}', ' else ',
+            'x', 'var q int <- 1;\n', 'memo ', 'print(q);', 'g1 <- 2;',
+            'memo function m1(a int) int { return a + f2(a); }\n',
+            'memo function m2() int { return g1 + m1(1); }\n']
+
+def edit(document, r):
+    start = r.randint(0, len(document.text))
+    end = min(start + r.choice([0, 0, 1, 2, 5, 20]), len(document.text))
+    text = r.choice(SNIPPETS) if r.random() < 0.8 else ''
+    document.edit(start, end, text)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    edits = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    failed = 0
+    for n in range(count):
+        r = random.Random(n)
+        document = Document(Generator(n).program())
+        for step in range(edits):
+            edit(document, r)
+            incremental = document.diagnostics()
+            fresh = Document(document.text).diagnostics()
+            if incremental != fresh:
+                print(f'random program {n}, edit {step}: reported {incremental}, '
+                      f'a fresh document {fresh}')
+                failed += 1
+                break
+    print(f'{count} programs, {failed} failed')
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Checks that the parallel type checker (-jN) reports the same diagnostics
+# as the sequential one on invalid programs: hand-written ones and random
+# programs with an error put in
+#
+#   python -O tests/parallel.py [random programs] [jobs]
+
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from parser import parse
+from validator import check_program
+from error import collect_errors
+from fuzz import Generator
+
+INVALID = {
+    'call of a function without a return': '''
+function f(a int) int { print(a); }
+function g() int { return f(nope); }
+function main() int { return 0; }
+''',
+    'call of a function with a bad signature': '''
+function f(a nothing) int { return 1; }
+function g() int { return f(1) + f(2.0); }
+function main() int { return g(); }
+''',
+    'function declared twice': '''
+function f() int { return 1; }
+function f() float { return 1.0; }
+function main() int { return f(); }
+''',
+    'mismatched types': '''
+var g int <- 1.5;
+function f(a int) float { return a; }
+function main() int { print(f(true)); print(g + 1.0); return undefined; }
+''',
+    'impure memo function': '''
+var g int <- 0;
+memo function f(a int) int { g <- a; return a; }
+function main() int { return f(1); }
+''',
+}
+
+# ways to put an error in a valid program, each applied to one match
+MUTATIONS = [
+    (r'\breturn [^;]*;', ''),
+    (r'\b[gpv]\d+\b', 'nope'),
+    (r'\b(int|float|bool)\b', 'char'),
+    (r'\b\d+\.\d+\b', 'true'),
+    (r'\bf\d+\(', 'missing('),
+]
+
+def mutate(source, seed):
+    r = random.Random(seed)
+    pattern, replacement = r.choice(MUTATIONS)
+    matches = list(re.finditer(pattern, source))
+    if not matches:
+        return source
+    match = r.choice(matches)
+    return source[:match.start()] + replacement + source[match.end():]
+
+def diagnostics(source, jobs):
+    with collect_errors() as found:
+        ast = parse(source)
+        if found:
+            return None
+        check_program(ast, jobs)
+    return sorted(found)
+
+def programs(count):
+    yield from INVALID.items()
+    for n in range(count):
+        yield f'random program {n}', mutate(Generator(n).program(), n)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    failed = checked = 0
+    for name, source in programs(count):
+        sequential = diagnostics(source, 1)
+        if sequential is None:
+            continue
+        try:
+            parallel = diagnostics(source, jobs)
+        except Exception as err:
+            parallel = [('exception', repr(err))]
+        if parallel != sequential:
+            print(f'{name}: -j1 reported {sequential}, -j{jobs} {parallel}')
+            failed += 1
+        checked += 1
+    print(f'{checked} programs, {failed} differ')
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+# Focused checks of what the Pulse IR passes leave behind: constant folding,
+# common subexpression elimination, loop invariant code motion and tail calls
+#
+#   python -O tests/passes.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from ir import compile_ircode
+from cfg import build_cfg
+from loops import find_loops
+from optimize import PASSES
+
+class Failure(Exception):
+    pass
+
+def expect(condition, message):
+    # not assert, which python -O leaves out
+    if not condition:
+        raise Failure(message)
+
+def optimized(source, *passes):
+    '''
+    The functions of source in CFG form, by name, after the given passes.
+    '''
+    functions = [build_cfg(func) for func in compile_ircode(source)]
+    expect(functions, 'the program does not compile')
+    for name in passes:
+        PASSES[name](functions)
+    return {func.name: func for func in functions}
+
+def instructions(func, opcode, blocks=None):
+    return [inst for block in (func if blocks is None else blocks) for inst in block
+            if inst.opcode == opcode]
+
+def constants(func):
+    return [inst.operands[0] for block in func for inst in block if inst.opcode.startswith('MOV')]
+
+def loop_blocks(func):
+    return [block for loop in find_loops(func) for block in func if block in loop.blocks]
+
+def check_folding():
+    main = optimized('''
+function main() int {
+    print(2 + 3 * 4);
+    print(2147483647 + 1);
+    print(-7 / 2);
+    return 0;
+}
+''', 'constant folding')['__pulse_main']
+    expect(not instructions(main, 'ADDI') and not instructions(main, 'MULI')
+           and not instructions(main, 'DIVI'), 'arithmetic on constants is left')
+    for value in (14, -2147483648, -3):
+        expect(value in constants(main), f'{value} is not computed at compile time')
+
+def check_folding_leaves_traps():
+    main = optimized('''
+function main() int {
+    print((-2147483647 - 1) / -1);
+    print(7 / 0);
+    return 0;
+}
+''', 'constant folding')['__pulse_main']
+    expect(len(instructions(main, 'DIVI')) == 2, 'a division that traps was folded')
+
+def check_folding_globals():
+    main = optimized('''
+var fixed int <- 7;
+var changed int <- 7;
+function bump() int { changed <- changed + 1; return 0; }
+function main() int {
+    print(fixed * 2);
+    print(changed * 2);
+    return bump();
+}
+''', 'constant folding')['__pulse_main']
+    expect(14 in constants(main), 'a global stored once is not folded')
+    expect(len(instructions(main, 'MULI')) == 1, 'a global stored twice is folded')
+
+def check_cse():
+    funcs = optimized('''
+function twice(a int, b int) int { return a * b + a * b; }
+function stored(a int) int {
+    var x int <- a + 1;
+    a <- 5;
+    return x + (a + 1);
+}
+function dominated(c bool) int {
+    var t int <- 1000 * 3;
+    if c { print(1000 * 3); }
+    return t;
+}
+function main() int {
+    print(twice(2, 3));
+    print(stored(1));
+    print(dominated(true));
+    return 0;
+}
+''', 'common subexpression elimination')
+    expect(len(instructions(funcs['twice'], 'MULI')) == 1, 'a * b is computed twice in one block')
+    expect(len(instructions(funcs['stored'], 'ADDI')) == 3, 'a + 1 is reused past a store to a')
+    expect(len(instructions(funcs['dominated'], 'MULI')) == 1,
+           '1000 * 3 is not reused in a block the entry dominates')
+
+def check_cse_signed_zero():
+    main = optimized('''
+function main() int {
+    print(0.0 * -1.0);
+    print(0.0 * 1.0);
+    return 0;
+}
+''', 'constant folding', 'common subexpression elimination')['__pulse_main']
+    expect(sorted(map(repr, constants(main))) == ['-0.0', '0', '0.0'],
+           '-0.0 and 0.0 share a value')
+
+def check_licm():
+    funcs = optimized('''
+var g int <- 1;
+function bump() int { g <- g + 1; return 0; }
+function loop(k int, d int) int {
+    var i int <- 0;
+    var s int <- 0;
+    while i < 10 {
+        s <- s + k * 7 + d / 7 + g;
+        if d != 0 { s <- s + 100 / d; }
+        i <- i + bump() + 1;
+    }
+    return s;
+}
+function main() int { print(loop(3, 0)); return 0; }
+''', 'loop invariant code motion')
+    func = funcs['loop']
+    body = loop_blocks(func)
+    expect(body, 'no loop found')
+    expect(instructions(func, 'MULI') and not instructions(func, 'MULI', body),
+           'k * 7 is not moved out of the loop')
+    divisions = instructions(func, 'DIVI', body)
+    expect(len(divisions) == 1 and divisions[0].operands[0].definition.opcode == 'MOVI',
+           'd / 7 stays in the loop, or 100 / d, which can trap, leaves it')
+    loads = [inst.operands[0] for inst in instructions(func, 'LOADI', body)]
+    expect('g' in loads and 'k' not in loads,
+           'the load of g, which bump() stores, moved, or the load of k did not')
+
+def check_tail_calls():
+    funcs = optimized('''
+function deep(n int, acc int) int {
+    if n = 0 { return acc; }
+    return deep(n - 1, acc + n);
+}
+function sum(n int) int {
+    if n = 0 { return 0; }
+    return sum(n - 1) + n * 2;
+}
+var calls int <- 0;
+function tally(n int) int {
+    calls <- calls + 1;
+    if n = 0 { return 0; }
+    return tally(n - 1) + calls;
+}
+function kept(n int) int {
+    if n = 0 { return 0; }
+    var r int <- kept(n - 1);
+    print(r);
+    return r;
+}
+function main() int {
+    print(deep(10, 0));
+    print(sum(10));
+    print(tally(3));
+    print(kept(3));
+    return 0;
+}
+''', 'tail call elimination')
+    for name in ('deep', 'sum'):
+        calls = [inst for inst in instructions(funcs[name], 'CALL') if inst.operands[0] == name]
+        expect(not calls, f'{name} still calls itself')
+    expect(instructions(funcs['tally'], 'CALL'),
+           'a call whose result is added to a global it stores was removed')
+    expect(instructions(funcs['kept'], 'CALL'), 'a call that is not in tail position was removed')
+
+CHECKS = [
+    check_folding,
+    check_folding_leaves_traps,
+    check_folding_globals,
+    check_cse,
+    check_cse_signed_zero,
+    check_licm,
+    check_tail_calls,
+]
+
+def main():
+    failed = 0
+    for check in CHECKS:
+        try:
+            check()
+            print(f'{check.__name__}: ok')
+        except Failure as failure:
+            print(f'{check.__name__}: FAILED, {failure}')
+            failed += 1
+    print(f'{len(CHECKS)} checks, {failed} failed')
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Checks that Pulse IR written by ir.dump and read back by ir.load is the
+# same code, before and after the passes, and compiles to the same LLVM IR
+#
+#   python -O tests/roundtrip.py [random programs]
+
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from ir import compile_ircode, dump, load
+from cfg import build_cfg
+from optimize import optimize
+from llvm import generate_llvm
+from differential import programs
+
+def roundtrip(functions):
+    file = io.BytesIO()
+    dump(functions, file)
+    file.seek(0)
+    return load(file)
+
+def differences(functions, loaded):
+    if [func.name for func in functions] != [func.name for func in loaded]:
+        return ['the functions differ']
+
+    found = []
+    for func, copy in zip(functions, loaded):
+        for field in ('parameters', 'return_type', 'memo', 'lineno'):
+            if getattr(func, field) != getattr(copy, field):
+                found.append(f'{func.name}: {field} differs')
+        if list(func.code) != copy.code:
+            found.append(f'{func.name}: code differs')
+        if [lineno or 0 for lineno in func.lines] != list(copy.lines):
+            found.append(f'{func.name}: lines differ')
+    return found
+
+def check(source):
+    functions = compile_ircode(source, lines=True)
+    if not functions:
+        return ['the program does not compile']
+
+    found = differences(functions, roundtrip(functions))
+    if generate_llvm(functions, 2) != generate_llvm(roundtrip(functions), 2):
+        found.append('the LLVM IR differs')
+
+    optimized = [build_cfg(func) for func in functions]
+    optimize(optimized)
+    optimized = [func.linearize() for func in optimized]
+    found += [f'after the passes, {difference}'
+              for difference in differences(optimized, roundtrip(optimized))]
+    return found
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    failed = 0
+    checked = 0
+    for name, source in programs(count, 0):
+        found = check(source)
+        for difference in found:
+            print(f'{name}: {difference}')
+        failed += bool(found)
+        checked += 1
+    print(f'{checked} programs, {failed} failed')
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()